@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:40 2026
+"""
+import numpy as np
+import scipy.sparse as sp
+from LSsurf.lin_op import lin_op
+
+# Variable-resolution grids are represented as a quadtree of cells on a
+# regular fd_grid (the finest level).  A leaf cell at level L spans 2**L
+# cells of the fd_grid in x and y, and its corners are aligned to multiples
+# of 2**L nodes.  Neighboring leaves differ by at most one level.  The
+# degrees of freedom are the leaf corners that are not in the middle of an
+# edge of a larger neighbor ("hanging" nodes);  the values at every other
+# node of the fd_grid are bilinear interpolations from the corners of the
+# largest leaf that contains the node, so the hanging-node constraints are
+# built into the prolongation matrix that maps degrees of freedom to nodes.
+# Quadtree arrays below are in units of fd_grid nodes, in the (y, x)
+# dimensions of the grid.
+
+def _block_min(raster, s, fill):
+    # the minimum of raster over aligned s x s blocks.  Partial blocks at the edges are padded with fill
+    ny, nx=raster.shape
+    padded=np.zeros((-(-ny//s)*s, -(-nx//s)*s), dtype=raster.dtype)+fill
+    padded[0:ny, 0:nx]=raster
+    return padded.reshape(padded.shape[0]//s, s, padded.shape[1]//s, s).min(axis=(1, 3))
+
+def _block_sum(raster, s):
+    ny, nx=raster.shape
+    padded=np.zeros((-(-ny//s)*s, -(-nx//s)*s), dtype=raster.dtype)
+    padded[0:ny, 0:nx]=raster
+    return padded.reshape(padded.shape[0]//s, s, padded.shape[1]//s, s).sum(axis=(1, 3))
+
+def _min3(raster, fill):
+    # the minimum of raster over the 3 x 3 neighborhood of each value
+    padded=np.pad(raster, 1, mode='constant', constant_values=fill)
+    result=raster.copy()
+    for d0 in (0, 1, 2):
+        for d1 in (0, 1, 2):
+            result=np.minimum(result, padded[d0:d0+raster.shape[0], d1:d1+raster.shape[1]])
+    return result
+
+def _split(i0, j0, L, cell_shape):
+    # the children of a set of cells at level L that start inside the grid
+    h=2**(L-1)
+    i0=np.concatenate([i0, i0, i0+h, i0+h])
+    j0=np.concatenate([j0, j0+h, j0, j0+h])
+    keep=(i0 < cell_shape[0]) & (j0 < cell_shape[1])
+    return i0[keep], j0[keep]
+
+def quadtree_leaves(cell_level, max_level):
+    """
+        Build the leaves of a quadtree whose cells are as large as cell_level allows
+
+        input arguments:
+            cell_level: integer array (one value per cell of the fd_grid) giving the largest level allowed for each cell
+            max_level: the level of the root cells
+        output arguments:
+            leaves: dict, indexed by level, of (i0, j0) arrays giving the first node of each leaf
+    """
+    cell_shape=cell_level.shape
+    s=2**max_level
+    i0, j0=[temp.ravel() for temp in np.meshgrid(np.arange(0, cell_shape[0], s), np.arange(0, cell_shape[1], s), indexing='ij')]
+    leaves=dict()
+    for L in range(max_level, -1, -1):
+        s=2**L
+        if L==0:
+            ok=np.ones(i0.size, dtype=bool)
+        else:
+            # cells that extend past the edge of the grid must be split
+            ok=_block_min(cell_level, s, -1)[i0//s, j0//s] >= L
+        leaves[L]=(i0[ok], j0[ok])
+        if L > 0:
+            i0, j0=_split(i0[~ok], j0[~ok], L, cell_shape)
+    return leaves
+
+def leaf_raster(leaves, cell_shape):
+    # the level of the leaf that contains each cell of the fd_grid
+    raster=np.zeros(cell_shape, dtype=int)-1
+    for L, (i0, j0) in leaves.items():
+        s=2**L
+        mark=np.zeros((-(-cell_shape[0]//s), -(-cell_shape[1]//s)), dtype=bool)
+        mark[i0//s, j0//s]=True
+        mark=np.repeat(np.repeat(mark, s, axis=0), s, axis=1)[0:cell_shape[0], 0:cell_shape[1]]
+        raster[mark]=L
+    return raster
+
+def balance_leaves(leaves, cell_shape):
+    """
+        Split leaves until neighboring leaves (including diagonal neighbors) differ by at most one level
+    """
+    N_levels=np.max(list(leaves.keys()))+1
+    while True:
+        big=N_levels+1
+        mf=_min3(leaf_raster(leaves, cell_shape), big)
+        changed=False
+        for L in range(N_levels-1, 1, -1):
+            i0, j0=leaves[L]
+            bad=_block_min(mf, 2**L, big)[i0//2**L, j0//2**L] < L-1
+            if np.any(bad):
+                changed=True
+                i_c, j_c=_split(i0[bad], j0[bad], L, cell_shape)
+                leaves[L]=(i0[~bad], j0[~bad])
+                leaves[L-1]=(np.concatenate([leaves[L-1][0], i_c]), np.concatenate([leaves[L-1][1], j_c]))
+                break
+        if not changed:
+            return leaves
+
+def leaf_node_levels(leaves, node_shape):
+    # the level of the smallest leaf for which each node is a corner (-1 for nodes that are not leaf corners)
+    node_level=np.zeros(node_shape, dtype=int)+np.max(list(leaves.keys()))+1
+    for L, (i0, j0) in leaves.items():
+        s=2**L
+        for di in (0, s):
+            for dj in (0, s):
+                np.minimum.at(node_level, (i0+di, j0+dj), L)
+    node_level[node_level > np.max(list(leaves.keys()))]=-1
+    return node_level
+
+def leaf_prolongation(raster):
+    """
+        Build the matrix that interpolates the node values of the fd_grid from the degrees of freedom of a quadtree
+
+        input arguments:
+            raster: the leaf level for each cell of the fd_grid (see leaf_raster)
+        output arguments:
+            P: sparse matrix, (number of nodes) x (number of degrees of freedom)
+            dof: the (raveled y, x) indices of the nodes that are degrees of freedom
+    """
+    node_shape=(raster.shape[0]+1, raster.shape[1]+1)
+    R=np.pad(raster, 1, mode='constant', constant_values=-1)
+    # find the largest leaf that touches each node, and one of the cells of the node that it contains
+    L_max=np.zeros(node_shape, dtype=int)-1
+    ci, cj=[np.zeros(node_shape, dtype=int) for _ in range(2)]
+    ii, jj=np.meshgrid(np.arange(node_shape[0]), np.arange(node_shape[1]), indexing='ij')
+    for di in (0, 1):
+        for dj in (0, 1):
+            this_L=R[di:di+node_shape[0], dj:dj+node_shape[1]]
+            larger=this_L > L_max
+            L_max[larger]=this_L[larger]
+            ci[larger]=ii[larger]+di-1
+            cj[larger]=jj[larger]+dj-1
+    s=2**L_max
+    i0=(ci//s)*s
+    j0=(cj//s)*s
+    fy=(ii-i0)/s
+    fx=(jj-j0)/s
+    rows, cols, vals=list(), list(), list()
+    for di, wy in ((0, 1.-fy), (1, fy)):
+        for dj, wx in ((0, 1.-fx), (1, fx)):
+            w=(wy*wx).ravel()
+            nz=w != 0
+            rows.append(np.flatnonzero(nz))
+            cols.append(np.ravel_multi_index(((i0+di*s).ravel()[nz], (j0+dj*s).ravel()[nz]), node_shape))
+            vals.append(w[nz])
+    N=np.prod(node_shape)
+    A=sp.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(N, N)).tocsr()
+    dof=np.flatnonzero(((fy==0) | (fy==1)) & ((fx==0) | (fx==1)))
+    # hanging nodes are interpolated from corners that may themselves be hanging:
+    # substitute until every column is a degree of freedom (at most one substitution per level)
+    is_dof=np.zeros(N, dtype=bool)
+    is_dof[dof]=True
+    P=A
+    for _ in range(int(np.max(L_max))+1):
+        if np.all(is_dof[P.tocoo().col]):
+            break
+        P=P.dot(A)
+    P.eliminate_zeros()
+    return P[:, dof].tocsr(), dof
+
+def refinement_levels(grid, data=None, max_level=2, min_count=None, mask_levels=None):
+    """
+        Choose the quadtree level for each node of a grid from the data density and the mask classes
+
+        input arguments:
+            grid: the fd_grid (the finest level)
+            data: pointdata instance, used for the density criterion
+            max_level: the coarsest level allowed (cells 2**max_level times the grid spacing)
+            min_count: if specified, each node is given the finest level at which the cells around it contain at least min_count data
+            mask_levels: dict mapping grid mask values to the coarsest level allowed for nodes with that mask value
+        output arguments:
+            level: integer array with the shape of the first two (y, x) dimensions of the grid
+    """
+    node_shape=tuple(grid.shape[0:2])
+    cell_shape=(node_shape[0]-1, node_shape[1]-1)
+    level=np.zeros(node_shape, dtype=int)+max_level
+    if min_count is not None and data is not None:
+        pts=(data.y, data.x)
+        good=np.isfinite(pts[0]) & np.isfinite(pts[1])
+        for pp, bd in zip(pts, grid.bds):
+            good &= (pp >= bd[0]) & (pp <= bd[1])
+        ci=[np.minimum(np.floor((pp[good]-bd[0])/delta).astype(int), N-1) for pp, bd, delta, N in zip(pts, grid.bds, grid.delta, cell_shape)]
+        count=np.bincount(np.ravel_multi_index(ci, cell_shape), minlength=np.prod(cell_shape)).reshape(cell_shape)
+        cell_level=np.zeros(cell_shape, dtype=int)+max_level
+        for L in range(max_level-1, -1, -1):
+            s=2**L
+            dense=np.repeat(np.repeat(_block_sum(count, s) >= min_count, s, axis=0), s, axis=1)[0:cell_shape[0], 0:cell_shape[1]]
+            cell_level[dense]=L
+        # each node takes the finest level of the cells around it
+        padded=np.pad(cell_level, 1, mode='constant', constant_values=max_level)
+        for di in (0, 1):
+            for dj in (0, 1):
+                level=np.minimum(level, padded[di:di+node_shape[0], dj:dj+node_shape[1]])
+    if mask_levels is not None and grid.mask is not None:
+        mask=np.asarray(grid.mask)
+        for val, L in mask_levels.items():
+            level[mask==val]=np.minimum(level[mask==val], L)
+    return level
+
+def level_op(grid, name, build):
+    """
+        Build a derivative operator on a variable-resolution grid, with a template spacing that follows the quadtree
+
+        At each leaf corner, the operator's template spans 2**L nodes, where L
+        is the level of the smallest leaf at that corner, and its rows are
+        weighted by 2**L, so that each row represents the area of its leaf.
+        If the grid is not refined, the operator is built on the grid as usual.
+
+        input arguments:
+            grid: fd_grid, optionally refined with set_levels
+            name: the name of the operator
+            build: function that takes an empty lin_op and returns the operator (e.g. lambda op: op.grad2(DOF='z0'))
+        output arguments:
+            op: lin_op
+    """
+    if grid.node_level is None:
+        return build(lin_op(grid, name=name))
+    ops=[build(lin_op(grid.view_for_level(L), name=name)) for L in np.unique(grid.node_level[grid.node_level >= 0])]
+    return lin_op(grid, name=name).vstack(ops)
+
+def column_prolongation(grids, col_N, keys=('z0','dz')):
+    """
+        Build the matrix that maps the degrees of freedom of a fit to its columns
+
+        Columns of unrefined grids (and columns outside the grids, e.g. biases) are their own degrees of freedom.
+
+        input arguments:
+            grids: dict of fd_grids
+            col_N: the number of columns
+            keys: the grids that may be refined
+        output arguments:
+            P: sparse matrix, col_N x col_N, whose nonzero columns are the degrees of freedom
+            dof_cols: the columns that are degrees of freedom
+    """
+    is_refined=np.zeros(col_N, dtype=bool)
+    rows, cols, vals=list(), list(), list()
+    for key in keys:
+        grid=grids[key]
+        if grid.prolongation is None:
+            continue
+        is_refined[grid.col_0:grid.col_0+grid.N_nodes]=True
+        temp=grid.prolongation.tocoo()
+        rows.append(grid.col_0+temp.row)
+        cols.append(grid.dof_cols[temp.col])
+        vals.append(temp.data)
+    unrefined=np.flatnonzero(~is_refined)
+    rows.append(unrefined)
+    cols.append(unrefined)
+    vals.append(np.ones(unrefined.size))
+    P=sp.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(col_N, col_N)).tocsc()
+    dof_cols=np.union1d(unrefined, np.concatenate([grids[key].dof_cols for key in keys if grids[key].prolongation is not None]))
+    return P, dof_cols
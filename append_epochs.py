@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:02:33 2026
+"""
+import numpy as np
+from time import time
+from LSsurf.lin_op import lin_op
+from LSsurf.smooth_xyt_fit import smooth_xyt_fit, smooth_xyt_fit_args, setup_grids, center_dzbar_matrix
+from LSsurf.predict_xyt import interp_grid
+
+def append_epochs(prev, data, t_end=None, N_overlap=2, prior_sigma=None, **kwargs):
+    """
+        Extend a previous fit to include new epochs, solving only for the end of the record
+
+        The new fit covers the last N_overlap epochs of the previous fit and
+        the new epochs up to t_end.  The information from the earlier epochs
+        is carried forward through a Gaussian prior:  the window's z0 and
+        its dz values for the overlapping epochs are tied to the previous
+        solution, with errors from the previous fit's E (if it was
+        calculated with compute_E) or from prior_sigma.  No reference epoch
+        is removed from the window; its z0 and dz are fixed by the prior
+        instead.  The output keeps the previous z0, and the window's dz is
+        shifted by the difference between the window's z0 and the previous
+        z0, so that the heights (z0+dz) of the earlier epochs are unchanged,
+        the heights of the window epochs are those of the window solution,
+        and the output dz continues the previous record.  The cost
+        of the solution depends on the window length and on the number of
+        new data, not on the length of the full record.
+
+        input arguments:
+            prev: output dict from smooth_xyt_fit (or from append_epochs)
+            data: pointdata instance containing the data for the window (new data, and optionally data for the overlapping epochs)
+            t_end: end time for the new record.  Defaults to the first epoch at or after the last data time
+            N_overlap: number of epochs from the previous fit that are re-solved (at least 1)
+            prior_sigma: dict with entries 'z0' and 'dz' giving the prior errors, needed if prev does not include E['z0'] and E['dz']
+            keywords: the arguments for smooth_xyt_fit used for the previous fit (except 'data').  The time center and width are replaced by those of the window.
+        output arguments:
+            S: dict in the format of the smooth_xyt_fit output, with m['z0'], m['dz'] (and E['z0'], E['dz'] if available) covering the full record.
+                E['dz'] for the window epochs is that of the window solution, which does not include the error in the z0 shift.
+                dz_bar, dzdt_lag, and dzdt_bar_lag products are recalculated for the full record, their errors are not.
+                S['window'] contains the smooth_xyt_fit output for the window.
+    """
+    tic=time()
+    t_prev=prev['grids']['dz'].ctrs[2]
+    dt=prev['grids']['dz'].delta[2]
+    N_prev=t_prev.size
+    if N_overlap < 1:
+        raise ValueError("N_overlap must be at least 1")
+    N_overlap=np.minimum(N_overlap, N_prev)
+    i0=N_prev-N_overlap
+    if t_end is None:
+        t_end=t_prev[-1]+dt*np.maximum(1, np.ceil((np.nanmax(data.time)-t_prev[-1])/dt))
+    N_window=int(np.round((t_end-t_prev[i0])/dt))+1
+    if N_window <= N_overlap:
+        raise ValueError("t_end must be after the last epoch of the previous fit")
+
+    # the prior errors come from the previous solution, if available
+    m_prev, E_prev=prev['m'], prev.get('E', dict())
+    if 'z0' in E_prev and 'dz' in E_prev:
+        sigma_z0=E_prev['z0']
+        sigma_dz=E_prev['dz'][:, :, i0:]
+    elif prior_sigma is not None:
+        sigma_z0=prior_sigma['z0']
+        sigma_dz=prior_sigma['dz']+np.zeros(m_prev['dz'][:, :, i0:].shape)
+    else:
+        raise ValueError("prior_sigma must be specified if the previous fit has no error estimates")
+    prior={'z0':m_prev['z0'], 'sigma_z0':sigma_z0}
+    prior['dz']=np.zeros(m_prev['dz'].shape[0:2]+(N_window,))+np.nan
+    prior['dz'][:, :, 0:N_overlap]=m_prev['dz'][:, :, i0:]
+    prior['sigma_dz']=np.ones_like(prior['dz'])
+    prior['sigma_dz'][:, :, 0:N_overlap]=sigma_dz
+
+    # fit the window
+    W_window=dt*(N_window-1)
+    window_kwargs=kwargs.copy()
+    window_kwargs.update({'data':data, 'prior':prior, 'reference_epoch':None, 'N_subset':None,
+                          'W':dict(kwargs['W'], t=W_window), 'ctr':dict(kwargs['ctr'], t=t_prev[i0]+W_window/2.)})
+    S_w=smooth_xyt_fit(**window_kwargs)
+    if not np.allclose(S_w['grids']['dz'].ctrs[2][0:N_overlap], t_prev[i0:]):
+        raise ValueError("the window epochs do not match the epochs of the previous fit")
+
+    # merge the previous and window solutions
+    m=dict()
+    E=dict()
+    # express the window's dz relative to the previous z0:  the change in z0, evaluated at the dz nodes, is added to dz
+    grid_z0, grid_dz=S_w['grids']['z0'], S_w['grids']['dz']
+    yx=[temp.ravel() for temp in np.meshgrid(grid_dz.ctrs[0], grid_dz.ctrs[1], indexing='ij')]
+    z0_shift=(interp_grid(grid_z0, S_w['m']['z0'], yx)-interp_grid(grid_z0, m_prev['z0'], yx)).reshape(grid_dz.shape[0:2])
+    m['z0']=m_prev['z0']
+    m['dz']=np.concatenate((m_prev['dz'][:, :, 0:i0], S_w['m']['dz']+z0_shift[:, :, np.newaxis]), axis=2)
+    if 'dz' in E_prev and 'dz' in S_w['E']:
+        E['z0']=E_prev['z0']
+        E['dz']=np.concatenate((E_prev['dz'][:, :, 0:i0], S_w['E']['dz']), axis=2)
+
+    # recalculate the products for the full record
+    args=smooth_xyt_fit_args(**dict(kwargs, data=data))
+    t0=t_prev[0]
+    W_full=dt*(i0+N_window-1)
+    args.update({'W':dict(kwargs['W'], t=W_full), 'ctr':dict(kwargs['ctr'], t=t0+W_full/2.)})
+    grids, bds=setup_grids(args)
+    m0=np.concatenate((m['z0'].ravel(), m['dz'].ravel()))
+    m0[~np.isfinite(m0)]=0
+    for lag in args['dzdt_lags']:
+        this_name='dzdt_lag%d' % lag
+        m[this_name]=lin_op(grids['dz'], name='dzdt', col_N=grids['dz'].col_N).dzdt(lag=lag).grid_prod(m0)
+    m['dz_bar']=center_dzbar_matrix(grids, args['W_ctr'], grids['dz'].col_N).dot(m0)
+    for lag in args['dzdt_lags']:
+        this_name='dzdt_bar_lag%d' % lag
+        m[this_name]=lin_op(grids['t'], name=this_name).diff(lag=lag).toCSR().dot(m['dz_bar'].ravel())
+    m['extent']=S_w['m']['extent']
+
+    timing=dict(S_w['timing'])
+    timing['append_epochs']=time()-tic
+    return {'m':m, 'E':E, 'data':S_w['data'], 'grids':grids, 'valid_data':S_w['valid_data'], 'TOC':S_w['TOC'],
+            'R':S_w['R'], 'RMS':S_w['RMS'], 'timing':timing, 'E_RMS':S_w['E_RMS'], 'window':S_w}
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:03:17 2026
+"""
+import numpy as np
+from time import time, process_time
+from LSsurf.bin_index import bin_index
+from LSsurf.smooth_xyt_fit import smooth_xyt_fit, smooth_xyt_fit_args, setup_fit_structure
+from LSsurf.shared_data import share_data, attach_data
+from LSsurf.fit_plan import plan_fit
+from LSsurf.thread_budget import available_cores, split_cores, limit_threads, utilization, worker_threads
+
+# the shared fit structure and arguments for the worker processes, set by _init_batch_worker
+_batch_state=dict()
+
+def _init_batch_worker(kwargs, data_handle=None, N_threads=None):
+    _batch_state.update({'kwargs':kwargs, 'data_handle':data_handle})
+    if N_threads is not None:
+        limit_threads(N_threads)
+
+def _batch_worker(tile):
+    ctr, data=tile
+    if _batch_state['data_handle'] is not None:
+        # the tile is specified by the indices of its data in the shared data
+        data=attach_data(_batch_state['data_handle'], data)
+    return fit_one_tile(ctr, data, _batch_state['kwargs'])
+
+def fit_one_tile(ctr, data, kwargs):
+    """
+        Fit one tile using the arguments and fit structure shared by a batch
+
+        input arguments:
+            ctr: dict giving the x, y, and t center of the tile
+            data: pointdata instance for the tile
+            kwargs: keyword arguments for smooth_xyt_fit, including 'fit_structure'
+        output arguments:
+            S: the output dict of smooth_xyt_fit, or None if the tile has too few data
+    """
+    if data is None or data.size < kwargs['min_data']:
+        return None
+    these_kwargs=kwargs.copy()
+    these_kwargs.pop('min_data')
+    these_kwargs.update({'ctr':ctr, 'data':data})
+    tic=time(); cpu0=process_time()
+    S=smooth_xyt_fit(**these_kwargs)
+    # the CPU time includes the native threads of the solver
+    S['timing']['tile_cpu']=process_time()-cpu0
+    S['timing']['tile_wall']=time()-tic
+    return S
+
+def batch_fit_structure(args):
+    """
+        Build the fit structure to be shared by a set of tiles
+
+        input arguments:
+            args: fit arguments for one of the tiles (see smooth_xyt_fit_args)
+        output arguments:
+            structure: the fit structure (see setup_fit_structure), or None if each tile must build its own
+    """
+    if args['active_nodes'] or args['refinement'] is not None:
+        # the active nodes and the quadtree depend on each tile's mask and data, so each tile builds its own structure
+        return None
+    return setup_fit_structure(args)
+
+def select_tile_data(data, tile_ctrs, W, return_index=False):
+    """
+        Select the data for each of a set of tiles
+
+        input arguments:
+            data: pointdata instance containing data for all the tiles
+            tile_ctrs: list of dicts giving the x and y center of each tile
+            W: dict giving the x and y width of the tiles
+            return_index: if True, the indices of each tile's data are returned instead of the data
+        output arguments:
+            tile_data: list of pointdata instances (or of index arrays), one for each tile
+    """
+    data_index=bin_index(data.x, data.y, np.minimum(W['x'], W['y'])/2)
+    tile_data=list()
+    for ctr in tile_ctrs:
+        ind=data_index.query_xy_box(ctr['x']+np.array([-0.5, 0.5])*W['x'], ctr['y']+np.array([-0.5, 0.5])*W['y'])
+        if return_index:
+            tile_data.append(ind)
+        else:
+            tile_data.append(data.copy().subset(ind))
+    return tile_data
+
+def batch_xyt_fit(tile_ctrs, tile_data, N_workers=1, min_data=10, share_dir=None, N_cores=None, **kwargs):
+    """
+        Fit a set of tiles that share the same grid dimensions and spacing
+
+        The smoothness constraints, column map, and averaging operators are
+        built once, from the first tile center, and shared by all of the
+        tiles, so that only the data-dependent parts of each fit (the data
+        selection, the interpolation matrix, and the solution) are
+        calculated for each tile.  The tiles are solved in series, or in a
+        multiprocessing pool if N_workers > 1.  If a single pointdata instance
+        is given and the tiles are fit in a pool, its fields are placed in
+        shared memory once, and each worker receives only the indices of its
+        tile's data.
+
+        The native threads of the solver (and of BLAS) in each worker are
+        limited so that the workers together use no more than the available
+        cores:  the workers are started with the limits in their environment
+        (see thread_budget.worker_threads), so the calling script must guard
+        its top-level code with if __name__=='__main__'.  If N_cores is specified, the number of workers is chosen from
+        the tile size (see thread_budget.split_cores):  large tiles get fewer
+        workers with more threads each.
+
+        input arguments:
+            tile_ctrs: list of dicts giving the x, y, and t center of each tile
+            tile_data: list of pointdata instances, one for each tile, or a single pointdata instance
+                from which the data for each tile are selected
+            N_workers: number of processes used to fit the tiles
+            min_data: tiles with fewer than this many data are not fit
+            share_dir: optional directory for memory-mapped files used to share the data with the workers, instead of shared memory
+            N_cores: if specified, N_workers and the threads for each worker are chosen to use this many cores
+            keywords: any keyword accepted by smooth_xyt_fit except 'ctr' and 'data'.
+        output arguments:
+            results: list of smooth_xyt_fit output dicts (or None for tiles with too few data), one for each tile.
+                The timing for each tile includes its CPU time, the threads per worker, and the utilization
+                of the cores by the whole batch (see thread_budget.utilization)
+    """
+    if len(tile_ctrs)==0:
+        return list()
+    if N_cores is None:
+        N_cores=available_cores()
+        N_threads=int(np.maximum(1, N_cores//N_workers))
+    else:
+        # the number of columns depends only on the grids, so the split can be chosen before the data are selected
+        N_workers, N_threads=split_cores(N_cores, len(tile_ctrs), plan_fit(N_data=0, N_bias=0, **smooth_xyt_fit_args(ctr=tile_ctrs[0], data=None, **kwargs))['N_cols'])
+    all_data=None
+    if not isinstance(tile_data, (list, tuple)):
+        all_data=tile_data
+        tile_data=select_tile_data(all_data, tile_ctrs, kwargs['W'], return_index=N_workers > 1)
+    if len(tile_ctrs) != len(tile_data):
+        raise ValueError("tile_ctrs and tile_data must be the same length")
+    tic=time()
+    # the structure is built using the first tile center, but depends only on W and spacing
+    if N_workers > 1 and all_data is not None:
+        first_data=all_data.copy().subset(tile_data[0])
+    else:
+        first_data=tile_data[0]
+    kwargs['fit_structure']=batch_fit_structure(smooth_xyt_fit_args(ctr=tile_ctrs[0], data=first_data, **kwargs))
+    kwargs['min_data']=min_data
+    t_structure=time()-tic
+    if N_workers > 1 and all_data is not None:
+        with share_data(all_data, directory=share_dir) as store, worker_threads(N_threads) as context:
+            with context.Pool(N_workers, initializer=_init_batch_worker, initargs=(kwargs, store.handle, N_threads)) as pool:
+                results=pool.map(_batch_worker, list(zip(tile_ctrs, tile_data)))
+    elif N_workers > 1:
+        with worker_threads(N_threads) as context:
+            with context.Pool(N_workers, initializer=_init_batch_worker, initargs=(kwargs, None, N_threads)) as pool:
+                results=pool.map(_batch_worker, list(zip(tile_ctrs, tile_data)))
+    else:
+        results=[fit_one_tile(ctr, data, kwargs) for ctr, data in zip(tile_ctrs, tile_data)]
+    batch_utilization=utilization(results, time()-tic, N_cores)
+    for S in results:
+        if S is not None:
+            S['timing'].update({'fit_structure':t_structure, 'N_threads':N_threads, 'batch_utilization':batch_utilization})
+    return results
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:41:05 2026
+"""
+import numpy as np
+
+class bin_index(object):
+    # a bin_index sorts a set of points by the square bins they fall into, so
+    # that the points within a rectangle can be found without comparing every
+    # point to the rectangle's bounds.  The bins are numbered in row-major
+    # order (y, then x), and 'offsets' gives the first entry in 'order' for
+    # each bin, so that the points in bin k are order[offsets[k]:offsets[k+1]].
+    # Within a row of bins, the points in a range of columns are contiguous in
+    # 'order', so a rectangular query reads one range of indices per row.
+    def __init__(self, x, y, delta):
+        self.x=np.asarray(x).ravel()
+        self.y=np.asarray(y).ravel()
+        self.delta=delta
+        good=np.isfinite(self.x) & np.isfinite(self.y)
+        if np.any(good):
+            self.x0=np.floor(np.min(self.x[good])/delta)*delta
+            self.y0=np.floor(np.min(self.y[good])/delta)*delta
+            self.shape=np.array([np.floor((np.max(self.y[good])-self.y0)/delta)+1, \
+                                 np.floor((np.max(self.x[good])-self.x0)/delta)+1]).astype(int)
+        else:
+            self.x0, self.y0=0., 0.
+            self.shape=np.array([0, 0], dtype=int)
+        N_bins=np.prod(self.shape)
+        # points with invalid coordinates are assigned to a bin past the last valid bin
+        bin_num=np.zeros(self.x.size, dtype=int)+N_bins
+        bin_num[good]=self.bin_for_xy(self.x[good], self.y[good])
+        self.order=np.argsort(bin_num, kind='stable')
+        self.offsets=np.concatenate([[0], np.cumsum(np.bincount(bin_num, minlength=N_bins+1))])
+
+    def bin_for_xy(self, x, y):
+        # find the bin number for a set of points
+        col=np.floor((x-self.x0)/self.delta).astype(int)
+        row=np.floor((y-self.y0)/self.delta).astype(int)
+        return row*self.shape[1]+col
+
+    def query_xy_box(self, xr, yr, strict=False):
+        """
+        Find the points within a rectangle
+
+        inputs:
+            xr, yr: x and y ranges of the rectangle
+            strict (default false):  if true, points on the edges of the rectangle are excluded
+        output:
+            ind: sorted indices of the points within the rectangle
+        """
+        if np.prod(self.shape)==0:
+            return np.zeros(0, dtype=int)
+        c0=np.maximum(0, int(np.floor((xr[0]-self.x0)/self.delta)))
+        c1=np.minimum(self.shape[1]-1, int(np.floor((xr[1]-self.x0)/self.delta)))
+        r0=np.maximum(0, int(np.floor((yr[0]-self.y0)/self.delta)))
+        r1=np.minimum(self.shape[0]-1, int(np.floor((yr[1]-self.y0)/self.delta)))
+        if c1 < c0 or r1 < r0:
+            return np.zeros(0, dtype=int)
+        # one contiguous range of sorted points for each row of bins
+        ranges=[(self.offsets[row*self.shape[1]+c0], self.offsets[row*self.shape[1]+c1+1]) for row in range(r0, r1+1)]
+        ind=np.concatenate([self.order[i0:i1] for i0, i1 in ranges])
+        # trim the points in the edge bins that fall outside the rectangle
+        if strict:
+            keep=(self.x[ind] > xr[0]) & (self.x[ind] < xr[1]) & (self.y[ind] > yr[0]) & (self.y[ind] < yr[1])
+        else:
+            keep=(self.x[ind] >= xr[0]) & (self.x[ind] <= xr[1]) & (self.y[ind] >= yr[0]) & (self.y[ind] <= yr[1])
+        return np.sort(ind[keep])
+
+    def query_xy_ctr(self, x0, y0, W, strict=False):
+        # find the points within a square of width W centered on x0, y0
+        return self.query_xy_box(x0+np.array([-0.5, 0.5])*W, y0+np.array([-0.5, 0.5])*W, strict=strict)
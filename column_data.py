@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:10:36 2026
+"""
+import numpy as np
+
+class column_data(object):
+    # a column_data object holds point data as a set of equal-length arrays
+    # (one per field), and provides the same interface as the point_data
+    # objects used by smooth_xyt_fit: fields are read as attributes, and the
+    # object has size, shape, list_of_fields, copy(), subset(), coords() and
+    # assign().
+    # copy() and subset() do not copy any data:  the object keeps a reference
+    # to the base arrays, which are shared between copies, and an index into
+    # them.  A field is gathered from its base array the first time it is
+    # read after a subset, and the gathered array is cached.  All fields are
+    # read-only, so in-place writes fail in the same way with or without a
+    # subset, instead of changing a cached copy that the next subset()
+    # discards, or an array that is shared with copies of the object.  A
+    # field can only be changed by assigning a new array (with assign() or
+    # by setting the attribute), which is stored with this object alone.
+    def __init__(self, fields=None, coord_fields=('y','x','time')):
+        object.__setattr__(self, '_base', dict())    # shared arrays, indexed by _index
+        object.__setattr__(self, '_local', dict())   # arrays owned by this object, in subset coordinates
+        object.__setattr__(self, '_cache', dict())   # gathered subsets of the base arrays
+        object.__setattr__(self, '_index', None)     # index into the base arrays, None for all
+        object.__setattr__(self, '_N_base', 0)
+        object.__setattr__(self, 'coord_fields', tuple(coord_fields))
+        object.__setattr__(self, 'list_of_fields', list())
+        if fields is not None:
+            self.from_dict(fields)
+
+    def from_dict(self, fields):
+        # set the base arrays from a dict of arrays.  The arrays are not copied
+        for key, val in fields.items():
+            val=np.asarray(val)
+            if len(self._base)==0:
+                object.__setattr__(self, '_N_base', val.size)
+            self._base[key]=val.ravel()
+            if key not in self.list_of_fields:
+                self.list_of_fields.append(key)
+        return self
+
+    def from_pointdata(self, D, fields=None):
+        # make a column_data object from the fields of a point_data object.  The arrays are not copied
+        if fields is None:
+            fields=D.list_of_fields
+        return self.from_dict({field:getattr(D, field) for field in fields})
+
+    def __getattr__(self, name):
+        # only called for names that are not regular attributes:  look up the data fields
+        if name.startswith('_') or name not in self.__dict__.get('list_of_fields', []):
+            raise AttributeError(name)
+        if name in self._local:
+            return self._local[name]
+        if name not in self._cache:
+            if self._index is None:
+                val=self._base[name].view()
+            else:
+                val=self._base[name][self._index]
+            val.flags.writeable=False
+            self._cache[name]=val
+        return self._cache[name]
+
+    def __setattr__(self, name, val):
+        if name in self.__dict__ or name.startswith('_'):
+            object.__setattr__(self, name, val)
+        else:
+            self.assign({name:val})
+
+    def __getstate__(self):
+        # only the selected points are pickled, so that a subset of a large (or shared) data set stays small
+        state=dict(self.__dict__)
+        if self._index is not None:
+            state['_base']={key:val[self._index] for key, val in self._base.items() if key in self.list_of_fields}
+            state['_index']=None
+            state['_N_base']=self._index.size
+        state['_cache']=dict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    @property
+    def size(self):
+        if self._index is None:
+            return self._N_base
+        return self._index.size
+
+    @property
+    def shape(self):
+        return (self.size,)
+
+    def assign(self, fields):
+        # set fields for this object.  The arrays must have the same size as the object
+        for key, val in fields.items():
+            val=np.asarray(val).ravel()
+            if val.size != self.size:
+                raise ValueError("field %s has size %d, expected %d" % (key, val.size, self.size))
+            # the array may be shared with copies of this object, so it is made read-only (through a view)
+            val=val.view()
+            val.flags.writeable=False
+            self._local[key]=val
+            self._cache.pop(key, None)
+            if key not in self.list_of_fields:
+                self.list_of_fields.append(key)
+        return self
+
+    def copy(self):
+        # make a copy that shares the base arrays with this object
+        other=column_data(coord_fields=self.coord_fields)
+        other._base.update(self._base)
+        other._local.update(self._local)
+        other._cache.update(self._cache)
+        object.__setattr__(other, '_index', self._index)
+        object.__setattr__(other, '_N_base', self._N_base)
+        other.list_of_fields.extend(self.list_of_fields)
+        return other
+
+    def subset(self, index, datasets=None):
+        # reduce the object to the points selected by index (boolean or integer).  Only the index
+        # into the base arrays is changed; fields owned by this object are subsetted
+        index=np.asarray(index)
+        if index.dtype==bool:
+            index=np.flatnonzero(index)
+        if self._index is None:
+            object.__setattr__(self, '_index', index)
+        else:
+            object.__setattr__(self, '_index', self._index[index])
+        for key in list(self._local.keys()):
+            self._local[key]=self._local[key][index]
+            self._local[key].flags.writeable=False
+        self._cache.clear()
+        if datasets is not None:
+            for key in [field for field in self.list_of_fields if field not in datasets]:
+                self.list_of_fields.remove(key)
+                self._local.pop(key, None)
+        return self
+
+    def coords(self):
+        # return the coordinate fields (y, x, time by default).  The arrays are cached, not rebuilt
+        return tuple(getattr(self, field) for field in self.coord_fields)
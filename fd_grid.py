@@ -4,8 +4,9 @@ Created on Mon Dec  4 14:07:39 2017
 
 @author: ben
 """
-#import scipy.sparse as sp
+import scipy.sparse as sp
 import numpy as np
+import copy
 from osgeo import gdal 
  
 class fd_grid: 
@@ -28,6 +29,15 @@ class fd_grid:
         self.srs_WKT=srs_WKT # Well Known Text for the spatial reference system of the grid
         self.mask_file=mask_file
         self.mask=None
+        self.active=None # boolean array (same shape as the grid) that is true for nodes that are degrees of freedom
+        self.active_cols=None # global indices of the active nodes, in order:  the k-th active node is column active_cols[k]
+        self.node_level=None # for variable-resolution grids (see set_levels), the quadtree level of each (y, x) node, -1 for nodes that are not leaf corners
+        self.prolongation=None # for variable-resolution grids, the matrix that interpolates the nodes from the degrees of freedom
+        self.dof_cols=None # for variable-resolution grids, the global indices of the degrees of freedom
+        self.xy_prolongation=None # for variable-resolution grids, the (y, x) part of the prolongation, and the (y, x) nodes that are degrees of freedom
+        self.xy_dof=None
+        self.time_basis=None # for grids with a reduced temporal basis (see set_time_basis), the value of each basis function at each epoch
+        self.level_view=None # for a view of a variable-resolution grid (see view_for_level), the template scale, center nodes, and row weight
         self.name=name # name of the degree of freedom specified by the grid
         if col_N is None:
             self.col_N=self.col_0+self.N_nodes
@@ -35,6 +45,116 @@ class fd_grid:
             self.mask=self.read_geotif(self.mask_file, interp_algorithm=gdal.GRA_Average)
             self.mask=np.round(self.mask).astype(np.int)
         
+    def set_active(self, active):
+        # specify which nodes of the grid are degrees of freedom.  If active
+        # has fewer dimensions than the grid (e.g. a 2-D mask for an x-y-t grid),
+        # it is repeated along the remaining dimensions.
+        active=np.asarray(active, dtype=bool)
+        while active.ndim < self.N_dims:
+            active=np.repeat(active[..., np.newaxis], self.shape[active.ndim], axis=active.ndim)
+        self.active=active
+        self.active_cols=self.col_0+np.flatnonzero(active.ravel())
+        return self
+
+    def set_levels(self, level, max_level=None):
+        # make the grid variable-resolution in its first two (y, x)
+        # dimensions.  The grid itself is the finest level, and level gives,
+        # for each (y, x) node, the coarsest quadtree level allowed there:
+        # at level L, cells are 2**L times the grid spacing.  The quadtree
+        # is balanced so that neighboring cells differ by at most one level,
+        # and the values at nodes that are not degrees of freedom are
+        # interpolated from those that are (see adaptive_grid.py).
+        from LSsurf.adaptive_grid import quadtree_leaves, balance_leaves, leaf_raster, leaf_node_levels, leaf_prolongation
+        level=np.asarray(level, dtype=int)
+        if max_level is None:
+            max_level=int(np.max(level))
+        # each cell can be no coarser than the finest of its corners
+        cell_level=np.minimum(np.minimum(level[:-1, :-1], level[1:, :-1]), np.minimum(level[:-1, 1:], level[1:, 1:]))
+        leaves=balance_leaves(quadtree_leaves(cell_level, max_level), cell_level.shape)
+        self.node_level=leaf_node_levels(leaves, level.shape)
+        self.xy_prolongation, self.xy_dof=leaf_prolongation(leaf_raster(leaves, cell_level.shape))
+        return self._update_prolongation()
+
+    def set_time_basis(self, B):
+        # represent the values of an x-y-t grid at each (y, x) node as a
+        # combination of a small number of functions of time.  B gives the
+        # value of each function (column) at each epoch (row).  The basis
+        # coefficients are stored in the columns of the first B.shape[1]
+        # epochs of each node, so the number of functions can be no more
+        # than the number of epochs.
+        B=np.asarray(B, dtype=float)
+        N_t=int(self.N_nodes/np.prod(self.shape[0:2]))
+        if B.shape[0] != N_t or B.shape[1] > N_t:
+            raise ValueError("time basis has shape %s, expected %d rows and no more than %d columns" % (str(B.shape), N_t, N_t))
+        self.time_basis=B
+        return self._update_prolongation()
+
+    def _update_prolongation(self):
+        # combine the (y, x) prolongation and the time basis into the prolongation for the whole grid.
+        # Time varies fastest in the global index
+        N_xy=int(np.prod(self.shape[0:2]))
+        N_t=int(self.N_nodes/N_xy)
+        if self.xy_prolongation is None:
+            P_xy, dof_xy=sp.identity(N_xy), np.arange(N_xy)
+        else:
+            P_xy, dof_xy=self.xy_prolongation, self.xy_dof
+        if self.time_basis is None:
+            B=sp.identity(N_t)
+        else:
+            B=sp.csr_matrix(self.time_basis)
+        self.prolongation=sp.kron(P_xy, B).tocsr()
+        self.dof_cols=self.col_0+(dof_xy[:, np.newaxis]*N_t+np.arange(B.shape[1])[np.newaxis, :]).ravel()
+        return self
+
+    def view_for_level(self, level):
+        # return a copy of a variable-resolution grid on which derivative
+        # templates (see lin_op.diff_op) span 2**level nodes in x and y, and
+        # are centered only on the nodes at that level
+        scale=2**level
+        view=copy.copy(self)
+        view.delta=np.array(self.delta, dtype=float)
+        view.delta[0:2] *= scale
+        N_t=int(self.N_nodes/np.prod(self.shape[0:2]))
+        xy=np.flatnonzero(self.node_level.ravel()==level)
+        view.level_view={'scale':scale, 'nodes':self.col_0+(xy[:, np.newaxis]*N_t+np.arange(N_t)[np.newaxis, :]).ravel(), 'weight':float(scale)}
+        return view
+
+    def active_from_mask(self, N_dilate=1):
+        # define the active nodes as those within N_dilate nodes (in x and y)
+        # of a nonzero mask value.  The dilation ensures that every node of a
+        # cell that contains a valid mask value is active.
+        mask=np.asarray(self.mask)
+        active=np.isfinite(mask) & (mask != 0)
+        for _ in range(N_dilate):
+            temp=np.pad(active, 1, mode='constant')
+            active=np.zeros_like(active)
+            for d0 in (0, 1, 2):
+                for d1 in (0, 1, 2):
+                    active |= temp[d0:d0+self.mask.shape[0], d1:d1+self.mask.shape[1]]
+        return self.set_active(active)
+
+    def active_for_pts(self, pts, good=None):
+        # check if all the nodes of the cell containing each point are active
+        if good is None:
+            good=self.validate_pts(pts)
+        if self.active is None:
+            return good
+        cell_sub=self.cell_sub_for_pts(pts, good=good)
+        result=good.copy()
+        for corner in np.ndindex(*([2]*self.N_dims)):
+            sub=[np.minimum(cell_sub[dim][good].astype(int)+corner[dim], self.shape[dim]-1) for dim in range(self.N_dims)]
+            result[good] &= self.active[tuple(sub)]
+        return result
+
+    def mask_for_polygon(self, xy):
+        # make a boolean array, with the shape of the first two (y, x) grid
+        # dimensions, that is true for the nodes inside a polygon whose
+        # vertices are given by the columns of xy (x, y)
+        from matplotlib.path import Path
+        nodes=np.meshgrid(self.ctrs[0], self.ctrs[1], indexing='ij')
+        inside=Path(np.column_stack(xy)).contains_points(np.c_[nodes[1].ravel(), nodes[0].ravel()])
+        return inside.reshape(self.shape[0:2])
+
     def validate_pts(self, pts):
         # check if each point is inside the grid
         good=np.isfinite(pts[0])
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:20:48 2026
+"""
+import numpy as np
+import h5py
+import json
+from LSsurf.fd_grid import fd_grid
+
+# version of the file layout written by write_fit_h5.  The layout is:
+#   /m/<field>, /E/<field>:  model and error fields (dict-valued fields, like 'bias', are groups)
+#   /grids/<name>:  one group per grid, with attributes bds, delta, shape, col_0, col_N (and srs_WKT), and a 'mask' dataset if the grid has one
+#   /TOC/rows/<name>, /TOC/cols/<name>: the table of contents of the constraint equations
+#   /data/<field>: the edited data
+#   /valid_data: boolean array for the input data
+#   /R, /RMS, /timing: groups whose attributes give the misfit and timing values
+#   root attributes: schema_version and E_RMS (as a JSON string)
+SCHEMA_VERSION=1
+
+def _write_array(group, name, val, compression):
+    val=np.asarray(val)
+    if val.dtype==object:
+        val=val.astype(float)
+    if val.ndim==0 or val.size < 2 or compression is None:
+        group.create_dataset(name, data=val)
+    else:
+        group.create_dataset(name, data=val, chunks=True, compression=compression, shuffle=True)
+
+def _write_dict(group, D, compression):
+    for key, val in D.items():
+        if val is None:
+            continue
+        if isinstance(val, dict):
+            _write_dict(group.require_group(key), val, compression)
+        else:
+            _write_array(group, key, val, compression)
+
+def write_fit_h5(filename, S, compression='gzip', write_data=True):
+    """
+        Write the output of smooth_xyt_fit to an hdf5 file
+
+        input arguments:
+            filename: the output file (overwritten if it exists)
+            S: output dict from smooth_xyt_fit
+            compression: hdf5 filter for the arrays.  If None, arrays are written
+                contiguously, which allows fit_h5 to memory-map them
+            write_data: if True, the edited data are written
+    """
+    with h5py.File(filename,'w') as h5f:
+        h5f.attrs['schema_version']=SCHEMA_VERSION
+        if 'E_RMS' in S:
+            h5f.attrs['E_RMS']=json.dumps(S['E_RMS'])
+        for field in ('m','E'):
+            if field in S:
+                _write_dict(h5f.require_group(field), S[field], compression)
+        for name, grid in S['grids'].items():
+            g=h5f.require_group('grids/'+name)
+            g.attrs['bds']=np.array(grid.bds)
+            g.attrs['delta']=grid.delta
+            g.attrs['shape']=grid.shape
+            g.attrs['col_0']=grid.col_0
+            g.attrs['col_N']=grid.col_N
+            if grid.srs_WKT is not None:
+                g.attrs['srs_WKT']=grid.srs_WKT
+            if grid.mask is not None:
+                _write_array(g, 'mask', grid.mask, compression)
+        if 'TOC' in S:
+            for rc in ('rows','cols'):
+                g=h5f.require_group('TOC/'+rc)
+                for key, val in S['TOC'][rc].items():
+                    _write_array(g, key, np.array(val, dtype=int), compression)
+        if write_data and 'data' in S:
+            g=h5f.require_group('data')
+            for field in S['data'].list_of_fields:
+                _write_array(g, field, getattr(S['data'], field), compression)
+        if 'valid_data' in S:
+            _write_array(h5f, 'valid_data', S['valid_data'], compression)
+        for field in ('R','RMS','timing'):
+            # R is replaced by the QR factor when errors are calculated, so only dicts are written
+            if field in S and isinstance(S[field], dict):
+                g=h5f.require_group(field)
+                for key, val in S[field].items():
+                    g.attrs[key]=val
+
+class fit_h5(object):
+    # a fit_h5 object gives lazy access to a file written by write_fit_h5.
+    # Arrays are not read until they are indexed:  contiguous, uncompressed
+    # arrays are returned as read-only memory maps, other arrays as h5py
+    # datasets, which read only the chunks that are indexed.
+    def __init__(self, filename, memmap=True):
+        self.filename=filename
+        self.memmap=memmap
+        self.h5f=h5py.File(filename,'r')
+        self.schema_version=self.h5f.attrs.get('schema_version', 0)
+        if self.schema_version > SCHEMA_VERSION:
+            raise ValueError("%s was written with schema version %d, newer than %d" % (filename, self.schema_version, SCHEMA_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.h5f is not None:
+            self.h5f.close()
+            self.h5f=None
+
+    def __contains__(self, path):
+        return path in self.h5f
+
+    def __getitem__(self, path):
+        # return a lazy array for a dataset, e.g. fit['m/dz']
+        ds=self.h5f[path]
+        if isinstance(ds, h5py.Group):
+            return {key:self[path+'/'+key] for key in ds.keys()}
+        if self.memmap and ds.chunks is None and ds.compression is None and ds.size > 0:
+            offset=ds.id.get_offset()
+            if offset is not None:
+                return np.memmap(self.filename, mode='r', dtype=ds.dtype, shape=ds.shape, offset=offset)
+        return ds
+
+    def keys(self, group='m'):
+        return list(self.h5f[group].keys())
+
+    @property
+    def E_RMS(self):
+        return json.loads(self.h5f.attrs['E_RMS'])
+
+    def attrs_dict(self, group):
+        # return the attributes of a group (e.g. 'R', 'RMS', or 'timing') as a dict
+        if group not in self.h5f:
+            return dict()
+        return {key:val for key, val in self.h5f[group].attrs.items()}
+
+    def grid(self, name):
+        # reconstruct an fd_grid from its stored geometry.  Masks are not re-read from the mask file
+        g=self.h5f['grids/'+name]
+        srs_WKT=g.attrs['srs_WKT'] if 'srs_WKT' in g.attrs else None
+        bds=[np.array(bd) for bd in g.attrs['bds']]
+        grid=fd_grid(bds, g.attrs['delta'], col_0=int(g.attrs['col_0']), srs_WKT=srs_WKT, name=name)
+        grid.col_N=int(g.attrs['col_N'])
+        if 'mask' in g:
+            grid.mask=np.array(g['mask'])
+        return grid
+
+    def grids(self):
+        return {name:self.grid(name) for name in self.h5f['grids'].keys()}
+
+    def read(self, group='m'):
+        # read every array in a group into memory
+        return {key:np.array(val) if not isinstance(val, dict) else {k:np.array(v) for k, v in val.items()} \
+                for key, val in self[group].items()}
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:05:12 2026
+"""
+import numpy as np
+from time import time
+import scipy.sparse as sp
+import sparseqr
+from LSsurf.time_basis import time_basis
+
+# coefficients of the cost model used by plan_fit:
+#   fill_coeff, fill_exp: nnz(R)=fill_coeff*N_cols**fill_exp for the QR factor of the weighted system
+#   bytes_per_G_nz: bytes per nonzero of the design matrix, counting the copies made during assembly and solution
+#   bytes_per_R_nz: bytes per nonzero of R during the QR solution, counting the Householder vectors
+#   t_per_flop: seconds per estimated floating-point operation of the factorization
+#   t_per_flop_E: seconds per estimated operation of the error propagation (inv_tr_upper)
+# The defaults are conservative values for a regular x-y-t grid;  calibrate_plan
+# fits fill_coeff, fill_exp, and t_per_flop from benchmark runs on the target machine.
+PLAN_COEFFS={'fill_coeff':4.0, 'fill_exp':1.5, 'bytes_per_G_nz':100., 'bytes_per_R_nz':40., \
+             't_per_flop':1.e-9, 't_per_flop_E':1.e-8}
+
+def _grid_shapes(kwargs):
+    # the node counts of the z0 and dz grids, as fd_grid would calculate them
+    W, spacing=kwargs['W'], kwargs['spacing']
+    shape_z0=np.array([W['y']/spacing['z0']+1, W['x']/spacing['z0']+1]).astype(int)
+    shape_dz=np.array([W['y']/spacing['dz']+1, W['x']/spacing['dz']+1, W['t']/spacing['dt']+1]).astype(int)
+    return shape_z0, shape_dz
+
+def _count_biases(data, bias_params):
+    # the number of unique combinations of the bias parameters in the data
+    vals=np.c_[[getattr(data, param) for param in bias_params]].T
+    return np.unique(vals, axis=0).shape[0]
+
+def plan_fit(N_data=None, N_bias=None, coeffs=None, max_memory=None, **kwargs):
+    """
+        Estimate the size, memory use, and run time of a fit before it is set up
+
+        The estimates are made from the grid dimensions and the number of data,
+        without building any matrices.  The size of the QR factor is estimated
+        from the number of columns using a fill model (see PLAN_COEFFS and
+        calibrate_plan).  If compute_E is set, the peak memory includes the
+        buffer allocated by inv_tr_upper (a quarter of the dense inverse),
+        which is usually the largest single allocation in a fit.
+
+        The model covers regular grids with a column for every node (less the
+        reference epoch, or reduced by time_basis), one row for each datum,
+        the bias parameters, and compute_E.  It does not model active_nodes,
+        refinement, or super_obs, which depend on the mask and the data:  they
+        remove columns or rows, so for those fits the estimate is usually too
+        large (although refinement can add nonzeros to each data row).  The
+        plan only reports the action needed to fit within max_memory:  if
+        max_memory is given to smooth_xyt_fit, a fit whose estimate exceeds it
+        raises a MemoryError, and tiles are only divided if the caller uses
+        split_for_memory.
+
+        input arguments:
+            N_data: number of data.  Taken from kwargs['data'] if not specified
+            N_bias: number of bias parameters.  Counted from kwargs['data'] and kwargs['bias_params'] if not specified
+            coeffs: dict of cost-model coefficients, defaults to PLAN_COEFFS
+            max_memory: optional memory budget in bytes, used to choose the action
+            keywords: arguments for smooth_xyt_fit.  'W' and 'spacing' are required
+        output arguments:
+            plan: dict with entries:
+                shape: dict giving the shape of the z0 and dz grids
+                N_cols, N_rows: the size of the system
+                nnz_G, nnz_R: the number of nonzeros in the design matrix and in its QR factor
+                flops: estimated operation count for one factorization
+                memory: dict giving the estimated bytes for the design matrix ('G'), and the peak bytes for the solution ('solve') and error propagation ('E')
+                peak_memory: the peak of the memory estimates
+                time: dict giving the estimated seconds for the iterated solution ('solve') and error propagation ('E')
+                action: 'fit' if the fit fits within max_memory, 'fit_without_E' if only the solution fits, 'split' if the tile must be divided
+    """
+    these_coeffs=PLAN_COEFFS.copy()
+    if coeffs is not None:
+        these_coeffs.update(coeffs)
+    coeffs=these_coeffs
+    data=kwargs.get('data', None)
+    if N_data is None:
+        N_data=data.size
+    if N_bias is None:
+        N_bias=0
+        if kwargs.get('bias_params', None) is not None and data is not None:
+            N_bias=_count_biases(data, kwargs['bias_params'])
+    shape_z0, shape_dz=_grid_shapes(kwargs)
+    N_z0=np.prod(shape_z0)
+    N_dz=np.prod(shape_dz)
+    N_cols=N_z0+N_dz+N_bias
+    if kwargs.get('time_basis', None) is not None:
+        # the dz columns are the basis coefficients at each (y, x) node, which already exclude the reference epoch
+        N_basis=time_basis(np.arange(shape_dz[2])*kwargs['spacing']['dt'], reference_epoch=kwargs.get('reference_epoch', 0), **kwargs['time_basis']).shape[1]
+        N_cols -= np.prod(shape_dz[0:2])*(shape_dz[2]-N_basis)
+    elif kwargs.get('reference_epoch', 0) is not None:
+        N_cols -= np.prod(shape_dz[0:2])
+
+    # constraint rows and nonzeros per node: grad2_z0 has three equations with 10 nonzeros,
+    # grad2_dzdt three with 20, grad_dzdt two with 8, and d2z_dt2 one with 3
+    N_rows_c=3*N_z0+5*N_dz
+    nnz_c=10*N_z0+28*N_dz
+    E_RMS=kwargs.get('E_RMS', dict())
+    if E_RMS.get('d2z_dt2', None) is not None:
+        N_rows_c += N_dz
+        nnz_c += 3*N_dz
+    # each datum interpolates from 4 z0 nodes and 8 dz nodes, plus one bias
+    nnz_data=N_data*(12+(N_bias>0))
+    N_rows=N_data+N_rows_c+N_bias
+    nnz_G=nnz_data+nnz_c+N_bias
+
+    nnz_R=coeffs['fill_coeff']*float(N_cols)**coeffs['fill_exp']
+    nnz_R=np.minimum(np.maximum(nnz_R, N_cols), N_cols*(N_cols+1)/2.)
+    # for a factor with c nonzeros per column, the factorization takes about N_cols*c**2 operations
+    flops=nnz_R**2/N_cols
+
+    memory=dict()
+    memory['G']=coeffs['bytes_per_G_nz']*nnz_G
+    memory['solve']=memory['G']+coeffs['bytes_per_R_nz']*nnz_R
+    memory['E']=0.
+    time_est={'solve':coeffs['t_per_flop']*flops*kwargs.get('max_iterations', 10), 'E':0.}
+    if kwargs.get('compute_E', False):
+        # inv_tr_upper allocates N_cols**2/4 row, column, and value entries (24 bytes), and
+        # Rinv is converted to CSR (12 bytes per entry) and squared
+        N_Rinv=float(N_cols)**2/4.
+        memory['E']=memory['G']+coeffs['bytes_per_R_nz']*nnz_R+(24.+2*12.)*N_Rinv
+        time_est['E']=coeffs['t_per_flop_E']*N_cols*nnz_R
+    peak_memory=np.maximum(memory['solve'], memory['E'])
+
+    action='fit'
+    if max_memory is not None and peak_memory > max_memory:
+        if memory['solve'] <= max_memory:
+            action='fit_without_E'
+        else:
+            action='split'
+    return {'shape':{'z0':shape_z0, 'dz':shape_dz}, 'N_cols':int(N_cols), 'N_rows':int(N_rows), \
+            'nnz_G':int(nnz_G), 'nnz_R':int(nnz_R), 'flops':flops, 'memory':memory, \
+            'peak_memory':peak_memory, 'time':time_est, 'action':action}
+
+def split_for_memory(max_memory, N_data=None, max_splits=8, coeffs=None, **kwargs):
+    """
+        Divide a tile into equal sub-tiles, each of which can be fit within a memory budget
+
+        The data are assumed to be evenly distributed over the tile, and the
+        sub-tiles are planned with plan_fit, with the same limitations.  None
+        of the drivers (batch_xyt_fit, fit_GL, the tile queue) call this:  the
+        caller fits the sub-tiles it returns (e.g. with batch_xyt_fit).
+
+        input arguments:
+            max_memory: memory budget in bytes
+            N_data: number of data in the tile.  Taken from kwargs['data'] if not specified
+            max_splits: the largest number of sub-tiles along x and y to try
+            coeffs: cost-model coefficients (see plan_fit)
+            keywords: arguments for smooth_xyt_fit, including 'W' and 'ctr'
+        output arguments:
+            ctrs: list of dicts giving the centers of the sub-tiles
+            W: dict giving the width of the sub-tiles
+            plan: the plan for one sub-tile
+    """
+    if N_data is None:
+        N_data=kwargs['data'].size
+    for N_split in range(1, max_splits+1):
+        W_sub=dict(kwargs['W'], x=kwargs['W']['x']/N_split, y=kwargs['W']['y']/N_split)
+        sub_kwargs=dict(kwargs, W=W_sub)
+        sub_kwargs.pop('data', None)
+        plan=plan_fit(N_data=N_data/N_split**2, coeffs=coeffs, max_memory=max_memory, **sub_kwargs)
+        if plan['action'] != 'split':
+            break
+    else:
+        raise MemoryError("no division of the tile into up to %d x %d sub-tiles fits in %d bytes" % (max_splits, max_splits, max_memory))
+    offsets=(np.arange(N_split)+0.5)/N_split-0.5
+    ctrs=[dict(kwargs['ctr'], x=kwargs['ctr']['x']+dx*kwargs['W']['x'], y=kwargs['ctr']['y']+dy*kwargs['W']['y']) \
+          for dy in offsets for dx in offsets]
+    return ctrs, W_sub, plan
+
+def calibrate_plan(cases, coeffs=None, VERBOSE=False):
+    """
+        Fit the fill and timing coefficients of the cost model to benchmark fits
+
+        Each case is assembled and its weighted system is factored once with
+        sparseqr.qz.  The fill exponent and coefficient are fit to the measured
+        nnz(R) (the exponent is kept fixed if only one case is given), and the
+        time per operation is the median over the cases.
+
+        input arguments:
+            cases: list of keyword-argument dicts for smooth_xyt_fit, for problems of different sizes
+            coeffs: starting coefficients, defaults to PLAN_COEFFS
+            VERBOSE: if true, report the measurements
+        output arguments:
+            coeffs: the updated coefficients (can be passed to plan_fit)
+            measurements: list of dicts giving N_cols, nnz_R, and t_factor for each case
+    """
+    from LSsurf.smooth_xyt_fit import smooth_xyt_fit_args, assemble_fit, calc_Ec
+    these_coeffs=PLAN_COEFFS.copy()
+    if coeffs is not None:
+        these_coeffs.update(coeffs)
+    coeffs=these_coeffs
+    measurements=list()
+    for case in cases:
+        args=smooth_xyt_fit_args(**case)
+        fit=assemble_fit(args, np.ones(args['data'].size, dtype=bool), dict())
+        Ec=calc_Ec(fit, args['E_RMS'])
+        TCinv=sp.dia_matrix((1./np.concatenate((fit['Ed'], Ec)), 0), shape=(fit['N_eq'], fit['N_eq']))
+        tic=time()
+        z, R, perm, rank=sparseqr.qz(TCinv.dot(fit['Gcoo']), TCinv.dot(fit['rhs']))
+        t_factor=time()-tic
+        measurements.append({'N_cols':fit['Gcoo'].shape[1], 'nnz_R':sp.csr_matrix(R).nnz, 't_factor':t_factor})
+        if VERBOSE:
+            print("N_cols=%d, nnz_R=%d, t=%3.2f" % (measurements[-1]['N_cols'], measurements[-1]['nnz_R'], t_factor))
+    log_N=np.log([meas['N_cols'] for meas in measurements])
+    log_nnz=np.log([meas['nnz_R'] for meas in measurements])
+    if np.unique(log_N).size > 1:
+        coeffs['fill_exp'], log_coeff=np.polyfit(log_N, log_nnz, 1)
+    else:
+        log_coeff=np.mean(log_nnz-coeffs['fill_exp']*log_N)
+    coeffs['fill_coeff']=np.exp(log_coeff)
+    flops=np.array([meas['nnz_R']**2/meas['N_cols'] for meas in measurements])
+    coeffs['t_per_flop']=np.median(np.array([meas['t_factor'] for meas in measurements])/flops)
+    return coeffs, measurements
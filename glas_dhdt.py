@@ -11,50 +11,66 @@ from PointDatabase.geo_index import geo_index
 from PointDatabase.matlabToYear import matlabToYear
 from LSsurf.fd_grid import fd_grid
 from LSsurf.lin_op import lin_op
-from ATL11.RDE import RDE
+from LSsurf.three_sigma_editor import RDE_select as RDE
+from LSsurf.fit_h5 import write_fit_h5
 import numpy as np
 import matplotlib.pyplot as plt
-from PySPQR import sparseqr
+import sparseqr
 import scipy.sparse as sp
 from time import time
+import os
+import threading
+import queue
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
+def read_glas_data(xy0, W0, gI):
+    """
+        Read and filter the GLAS data for a tile from a geo_index
 
-def glas_fit(xy0=np.array((-150000, -2000000)), W0, D=None, E_RMS=None, gI=None, giFile='/Data/glas/GL/rel_634/GeoIndex.h5'):
-    if gI is None:
-        gI=geo_index().from_file(giFile)
+        input arguments:
+            xy0: x and y center of the tile
+            W0: width of the tile
+            gI: geo_index for the GLAS data
+        output arguments:
+            D: point data for the tile, with fields x, y, z, time (decimal year), and sigma, or None if the tile has no data
+    """
+    fields=[ 'IceSVar', 'deltaEllip', 'numPk', 'ocElv', 'reflctUC', 'satElevCorr',  'time',  'x', 'y', 'z']
+    D=gI.query_xy_box(xy0[0]+np.array([-W0/2, W0/2]), xy0[1]+np.array([-W0/2, W0/2]), fields=fields)
+    if D is None or D.size==0:
+        return None
+    D.assign({'year': matlabToYear(D.time)})
+    good=(D.IceSVar < 0.035) & (D.reflctUC >0.05) & (D.satElevCorr < 1) & (D.numPk==1)
+    D.subset(good, datasets=['x','y','z','year'])
 
-    #import_D=False; print("WARNING::::::REUSING D")
+    D.assign({'sigma':np.zeros_like(D.x)+0.2, 'time':D.year})
+    return D
+
+def glas_fit(xy0=np.array((-150000, -2000000)), W0=4.e4, D=None, E_RMS=None, gI=None, giFile='/Data/glas/GL/rel_634/GeoIndex.h5', DOPLOT=False, VERBOSE=False):
     timing=dict()
-    xy0=np.array((-150000, -2000000))
-    E_RMS={'d2z0_dx2':20000./3000/3000, 'd3z_dx2dt':10./3000/3000, 'd2z_dxdt':100/3000, 'd2z_dt2':1}
+    if E_RMS is None:
+        E_RMS={'d2z0_dx2':20000./3000/3000, 'd3z_dx2dt':10./3000/3000, 'd2z_dxdt':100/3000, 'd2z_dt2':1}
 
     W={'x':W0, 'y':W0,'t':6}
     spacing={'z0':5.e2, 'dzdt':5.e3}
+    ctr={'x':xy0[0], 'y':xy0[1], 't':(2003+2009)/2. }
 
     args={'W':W, 'ctr':ctr, 'spacing':spacing, 'E_RMS':E_RMS, 'max_iterations':25}
 
-
     if D is None:
-        fields=[ 'IceSVar', 'deltaEllip', 'numPk', 'ocElv', 'reflctUC', 'satElevCorr',  'time',  'x', 'y', 'z']
-        ctr={'x':xy0[0], 'y':xy0[1], 't':(2003+2009)/2. }
-
-        D=gI.query_xy_box(xy0[0]+np.array([-W['x']/2, W['x']/2]), xy0[1]+np.array([-W['y']/2, W['y']/2]), fields=fields)
-
-        #plt.plot(xy[0], xy[1],'.')
-        #plt.plot(xy0[0], xy0[1],'r*')
-
-        D.assign({'year': matlabToYear(D.time)})
-        good=(D.IceSVar < 0.035) & (D.reflctUC >0.05) & (D.satElevCorr < 1) & (D.numPk==1)
-        D.subset(good, datasets=['x','y','z','year'])
-
-        D.assign({'sigma':np.zeros_like(D.x)+0.2, 'time':D.year})
-        plt.plot(D.x, D.y,'m.')
+        if gI is None:
+            gI=geo_index().from_file(giFile)
+        D=read_glas_data(xy0, W0, gI)
+        if D is None:
+            # no data for the tile
+            return None
+        if DOPLOT:
+            plt.plot(D.x, D.y,'m.')
 
     bds={coord:args['ctr'][coord]+np.array([-0.5, 0.5])*args['W'][coord] for coord in ('x','y')}
     grids=dict()
     grids['z0']=fd_grid( [bds['y'], bds['x']], args['spacing']['z0']*np.ones(2), name='z0')
     grids['dzdt']=fd_grid( [bds['y'], bds['x']],  args['spacing']['dzdt']*np.ones(2), \
-         col_0=grids['z0'].col_N+1, name='dzdt')
+         col_0=grids['z0'].col_N, name='dzdt')
 
     valid_z0=grids['z0'].validate_pts((D.coords()[0:2]))
     valid_dz=grids['dzdt'].validate_pts((D.coords()))
@@ -69,7 +85,7 @@ def glas_fit(xy0=np.array((-150000, -2000000)), W0, D=None, E_RMS=None, gI=None,
     grad2_z0=lin_op(grids['z0'], name='grad2_z0').grad2(DOF='z0')
     grad_z0=lin_op(grids['z0'], name='grad_z0').grad(DOF='z0')
     grad2_dzdt=lin_op(grids['dzdt'], name='grad2_dzdt').grad2(DOF='dzdt')
-    grad_dzdt=lin_op(grids['dzdt'], name='grad_dzdt').grad2(DOF='dzdt')
+    grad_dzdt=lin_op(grids['dzdt'], name='grad_dzdt').grad(DOF='dzdt')
     Gc=lin_op(None, name='constraints').vstack((grad2_z0, grad_z0, grad2_dzdt, grad_dzdt))
     Ec=np.zeros(Gc.N_eq)
     root_delta_A_z0=np.sqrt(np.prod(grids['z0'].delta))
@@ -107,8 +123,8 @@ def glas_fit(xy0=np.array((-150000, -2000000)), W0, D=None, E_RMS=None, gI=None,
         m0=sparseqr.solve(Ip_r.dot(TCinv.dot(Gcoo)), Ip_r.dot(TCinv.dot(rhs)));
         timing['sparseqr_solve']=time()-tic
 
-        # quit if the solution is too similar to the previous solution
-        if np.max(np.abs((m0_last-m0)[Gc.TOC['cols']['dzdt']])) < 0.05:
+        # quit if the solution is too similar to the previous solution (the first solution has no predecessor)
+        if iteration > 0 and np.max(np.abs((m0_last-m0)[Gc.TOC['cols']['dzdt']])) < 0.05:
             break
 
         # calculate the full data residual
@@ -118,13 +134,15 @@ def glas_fit(xy0=np.array((-150000, -2000000)), W0, D=None, E_RMS=None, gI=None,
         inTSE_last=inTSE
         # select the data that are within 3*sigma of the solution
         inTSE=np.where(np.abs(rs_data)<3.0*sigma_hat)[0]
-        print('found %d in TSE, sigma_hat=%3.3f' % (inTSE.size, sigma_hat))
+        if VERBOSE:
+            print('found %d in TSE, sigma_hat=%3.3f' % (inTSE.size, sigma_hat))
         if sigma_hat <= 1 or( inTSE.size == inTSE_last.size and np.all( inTSE_last == inTSE )):
             break
     m=dict()
     m['z0']=m0[Gc.TOC['cols']['z0']].reshape(grids['z0'].shape)
     m['dzdt']=m0[Gc.TOC['cols']['dzdt']].reshape(grids['dzdt'].shape)
     if DOPLOT:
+        plt.figure()
         plt.subplot(121)
         plt.imshow(m['z0'])
         plt.colorbar()
@@ -141,6 +159,101 @@ def glas_fit(xy0=np.array((-150000, -2000000)), W0, D=None, E_RMS=None, gI=None,
 
     return grids, m, D, inTSE, sigma_hat
 
-def fit_GL():
-    giFile='/Data/glas/GL/rel_634/GeoIndex.h5'
-    gI=geo_index().from_file(giFile, read_file=False)
+def _read_tiles(tile_ctrs, W0, giFile, tile_queue):
+    # I/O stage: read the data for each tile in turn and put it on the queue.
+    # The queue has a limited size, so reading stays a few tiles ahead of the solutions.
+    # The final None is always queued, so that the solution loop ends even if the index cannot be read
+    try:
+        gI=geo_index().from_file(giFile, read_file=False)
+        for xy0 in tile_ctrs:
+            try:
+                tile_queue.put((xy0, read_glas_data(xy0, W0, gI)))
+            except Exception as e:
+                tile_queue.put((xy0, e))
+    finally:
+        tile_queue.put(None)
+
+def _handle_tile(xy0, future, out_dir, results, VERBOSE=False):
+    # collect the result for a finished tile, writing it to a file if out_dir is specified.
+    # If the fit failed, the exception is stored in results instead
+    try:
+        result=future.result()
+    except Exception as e:
+        if VERBOSE:
+            print("failed to fit tile at %d, %d: %s" % (xy0[0], xy0[1], e))
+        results[xy0]=e
+        return
+    if result is None:
+        return
+    grids, m, D, inTSE, sigma_hat=result
+    if out_dir is None:
+        results[xy0]=result
+    else:
+        out_file=os.path.join(out_dir, 'GL_dhdt_E%d_N%d.h5' % (xy0[0]/1000, xy0[1]/1000))
+        write_fit_h5(out_file, {'m':m, 'grids':grids, 'data':D.subset(inTSE), 'RMS':{'sigma_hat':sigma_hat}})
+        results[xy0]=out_file
+
+def fit_GL(tile_ctrs=None, xy_bounds=None, W0=4.e4, giFile='/Data/glas/GL/rel_634/GeoIndex.h5', N_workers=4, N_prefetch=4, out_dir=None, E_RMS=None, min_data=100, VERBOSE=False):
+    """
+        Fit dh/dt for a set of GLAS tiles, overlapping data reads with the solutions
+
+        A background thread reads the data for upcoming tiles from the
+        GeoIndex while earlier tiles are solved in a pool of processes.  No
+        more than N_workers+N_prefetch tiles are submitted to the pool at
+        once, and each tile's result is collected (or written) as soon as it
+        is finished, so the memory used does not grow with the number of
+        tiles, and the output writes overlap the reads and solutions.
+
+        input arguments:
+            tile_ctrs: list of (x, y) tile centers
+            xy_bounds: if tile_ctrs is not given, tiles are centered every W0/2 within ((x0, x1), (y0, y1))
+            W0: tile width
+            giFile: GeoIndex file for the GLAS data
+            N_workers: number of processes solving tiles
+            N_prefetch: number of tiles that can be read ahead of the solutions
+            out_dir: if specified, the results for each tile are written to an hdf5 file in this directory (see fit_h5)
+            E_RMS: expected RMS values for the constraints (see glas_fit)
+            min_data: tiles with fewer data than this are not fit
+            VERBOSE: if true, report the progress of the fits and any failures
+        output arguments:
+            results: dict giving the (grids, m, D, inTSE, sigma_hat) output of glas_fit for each tile center
+                (or the output filename if out_dir is specified).  For tiles that could not be read or
+                fit, the entry is the exception that was raised
+    """
+    if tile_ctrs is None:
+        xg, yg=np.meshgrid(np.arange(xy_bounds[0][0], xy_bounds[0][1]+W0/4, W0/2), np.arange(xy_bounds[1][0], xy_bounds[1][1]+W0/4, W0/2))
+        tile_ctrs=list(zip(xg.ravel(), yg.ravel()))
+    tile_ctrs=[tuple(xy0) for xy0 in tile_ctrs]
+    tile_queue=queue.Queue(maxsize=N_prefetch)
+    reader=threading.Thread(target=_read_tiles, args=(tile_ctrs, W0, giFile, tile_queue), daemon=True)
+    reader.start()
+    results=dict()
+    # the tiles submitted to the pool and not yet collected, keyed by their futures
+    pending=dict()
+    reading=True
+    with ProcessPoolExecutor(N_workers) as pool:
+        while reading or len(pending) > 0:
+            # collect any tiles that have finished
+            for future in [future for future in pending if future.done()]:
+                _handle_tile(pending.pop(future), future, out_dir, results, VERBOSE=VERBOSE)
+            if not reading or len(pending) >= N_workers+N_prefetch:
+                # wait for a tile to finish before submitting more
+                done, not_done=wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    _handle_tile(pending.pop(future), future, out_dir, results, VERBOSE=VERBOSE)
+                continue
+            item=tile_queue.get()
+            if item is None:
+                reading=False
+                continue
+            xy0, D=item
+            if isinstance(D, Exception):
+                if VERBOSE:
+                    print("failed to read tile at %d, %d: %s" % (xy0[0], xy0[1], D))
+                results[xy0]=D
+                continue
+            if D is None or D.size < min_data:
+                continue
+            pending[pool.submit(glas_fit, xy0=np.array(xy0), W0=W0, D=D, E_RMS=E_RMS, VERBOSE=VERBOSE)]=xy0
+    reader.join()
+    return results
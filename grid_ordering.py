@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:48:20 2026
+"""
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spl
+
+# orderings that have been calculated in this process, keyed by the relative geometry of the grids
+_orderings=dict()
+
+def _node_coords(grid):
+    # the coordinates of every node of a grid, in global-index order
+    return [temp.ravel() for temp in np.meshgrid(*grid.ctrs, indexing='ij')]
+
+def _geometry_key(grids, keys, min_size):
+    # a key that identifies the column layout of a set of grids, independent of their location.  A
+    # grid that is shifted gives the same ordering (up to roundoff in the separator positions, which
+    # can affect the fill but not the solution)
+    origin=[grids[keys[0]].bds[dim][0] for dim in range(2)]
+    return (min_size,)+tuple((key, tuple(grids[key].shape), tuple(grids[key].delta), grids[key].col_0, \
+        tuple(np.round(grids[key].bds[dim][0]-origin[dim], 6) for dim in range(2))) for key in keys)
+
+def _dissect(ind, yx, h, min_size, out):
+    # order the nodes in ind:  nodes on either side of a separator slab first, then the slab
+    if ind.size <= min_size:
+        out.append(ind)
+        return
+    extent=[np.ptp(coord[ind]) for coord in yx]
+    dim=int(np.argmax(extent))
+    if extent[dim] <= 4*h:
+        out.append(ind)
+        return
+    coord=yx[dim][ind]
+    c=np.median(coord)
+    left=coord < c-h
+    right=coord > c+h
+    if not (np.any(left) and np.any(right)):
+        out.append(ind)
+        return
+    _dissect(ind[left], yx, h, min_size, out)
+    _dissect(ind[right], yx, h, min_size, out)
+    out.append(ind[~(left | right)])
+
+def grid_nested_dissection(grids, min_size=64, keys=('z0','dz')):
+    """
+        Build a nested-dissection ordering for the columns of a fit from the grid geometry
+
+        The nodes of all the grids are dissected together in x and y:  the
+        z0 and dz nodes at the same location are coupled through the data, and
+        every z0 node is coupled to every epoch of the dz nodes around it, so
+        the grids are not split in time.  A separator is a slab, centered on
+        the median node coordinate, that is as wide as the longest stencil
+        (a second difference, or a data point's interpolation cell) in the
+        coarsest grid, so that no equation connects the nodes on either side
+        of it.  The nodes on the two sides are ordered first, recursively, and
+        the separator nodes are ordered after them.
+
+        The ordering depends only on the shapes, spacings, and relative
+        positions of the grids, so it is calculated once for each grid
+        geometry in a process, and reused for tiles at other locations.
+
+        input arguments:
+            grids: dict of fd_grid objects for the fit
+            min_size: blocks with this many nodes or fewer are not dissected further
+            keys: the grids whose columns are ordered
+        output arguments:
+            perm: permutation of the global column indices, from 0 to the col_N of the grids.
+                Columns that are not in any of the grids (e.g. biases) are ordered last.
+    """
+    geometry=_geometry_key(grids, keys, min_size)
+    if geometry in _orderings:
+        return _orderings[geometry]
+    col_N=np.max([grids[key].col_N for key in keys])
+    cols=list()
+    yx=[list(), list()]
+    h=0.
+    for key in keys:
+        grid=grids[key]
+        coords=_node_coords(grid)
+        cols.append(grid.col_0+np.arange(grid.N_nodes))
+        for dim in range(2):
+            yx[dim].append(coords[dim])
+        h=np.maximum(h, np.max(grid.delta[0:2]))
+    cols=np.concatenate(cols)
+    yx=[np.concatenate(temp) for temp in yx]
+    out=list()
+    _dissect(np.arange(cols.size), yx, h, min_size, out)
+    perm=cols[np.concatenate(out)]
+    _orderings[geometry]=np.concatenate((perm, np.setdiff1d(np.arange(col_N), perm)))
+    return _orderings[geometry]
+
+def restrict_ordering(perm, include_cols, N_cols=None):
+    """
+        Restrict an ordering of the global columns to the columns included in a fit
+
+        input arguments:
+            perm: permutation of the global columns (from grid_nested_dissection)
+            include_cols: the global columns that are included in the fit, in the order of the fit's columns
+            N_cols: number of columns in the fit. Columns after the last included column (e.g. biases) are ordered last
+        output arguments:
+            ordering: permutation of the fit's columns
+    """
+    if N_cols is None:
+        N_cols=include_cols.size
+    reduced=np.zeros(np.maximum(perm.size, np.max(include_cols)+1), dtype=int)-1
+    reduced[include_cols]=np.arange(include_cols.size)
+    ordering=reduced[perm]
+    ordering=ordering[ordering >= 0]
+    return np.concatenate((ordering, np.setdiff1d(np.arange(N_cols), ordering)))
+
+def solve_ordered(A, b, ordering):
+    """
+        Solve a least-squares problem through its normal equations, using a fixed column ordering
+
+        The columns of A are permuted by the ordering and scaled to unit
+        norm, and the normal equations are factored symmetrically with no
+        further reordering, so that the fill of the factor is controlled by
+        the ordering alone.  Forming the normal equations squares the
+        condition number of A, so this is less accurate than the QR solution
+        (sparseqr.solve) for poorly conditioned systems, such as those with
+        constraints that are much stiffer than the data.  It is used only if
+        smooth_xyt_fit is called with solver='nd_normal'; the ordering is not
+        used by the QR solver, which calculates its own.
+
+        input arguments:
+            A: sparse design matrix (weighted)
+            b: right-hand side (weighted)
+            ordering: permutation of the columns of A (e.g. from restrict_ordering)
+        output arguments:
+            x: the least-squares solution
+    """
+    Ap=sp.csc_matrix(A)[:, ordering]
+    # scale the columns to unit norm, which reduces the condition number of the normal equations
+    scale=np.sqrt(np.asarray(Ap.multiply(Ap).sum(axis=0)).ravel())
+    scale[scale==0]=1.
+    Ap=Ap.dot(sp.diags(1./scale)).tocsc()
+    N=Ap.T.dot(Ap).tocsc()
+    lu=spl.splu(N, permc_spec='NATURAL', diag_pivot_thresh=0, options={'SymmetricMode':True})
+    x=np.zeros(A.shape[1])
+    x[ordering]=lu.solve(Ap.T.dot(b))/scale
+    return x
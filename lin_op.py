@@ -28,6 +28,7 @@ class lin_op:
         self.c=np.array([], dtype=int)
         self.v=np.array([], dtype=float)
         self.ind0=np.zeros([0], dtype=int)
+        self.region_ids=None
         self.TOC={'rows':dict(),'cols':dict()}
         self.grid=grid
 
@@ -38,6 +39,18 @@ class lin_op:
         # in each direction of the grid, and a list of values corresponding
         # to each offset.  Only those nodes for which the template falls
         # entirely inside the grid are included in the operator
+        # If the grid is a view of a variable-resolution grid at one level
+        # (see fd_grid.view_for_level), the offsets in x and y are scaled to
+        # the level's node spacing, only the level's nodes are used as
+        # centers, and the rows are weighted by the level's row weight.
+        row_weight=1.
+        if self.grid.level_view is not None:
+            delta_subs=[np.asarray(delta_sub)*(self.grid.level_view['scale'] if dim < 2 else 1) for dim, delta_sub in enumerate(delta_subs)]
+            if which_nodes is None:
+                which_nodes=self.grid.level_view['nodes']
+            else:
+                which_nodes=np.intersect1d(which_nodes, self.grid.level_view['nodes'])
+            row_weight=self.grid.level_view['weight']
 
         # compute the maximum and minimum offset in each dimension
         max_deltas=[np.max(delta_sub) for delta_sub in delta_subs]
@@ -50,6 +63,12 @@ class lin_op:
         if which_nodes is not None:
             temp_mask=np.in1d(self.grid.global_ind(sub0s), which_nodes)
             sub0s=[temp[temp_mask] for temp in sub0s]
+        if self.grid.active is not None:
+            # only include the nodes for which the template falls entirely on active nodes
+            temp_mask=np.ones_like(sub0s[0], dtype=bool)
+            for ii in range(len(delta_subs[0])):
+                temp_mask &= self.grid.active[tuple(sub0+delta[ii] for sub0, delta in zip(sub0s, delta_subs))]
+            sub0s=[temp[temp_mask] for temp in sub0s]
         self.r, self.c=[np.zeros((len(sub0s[0]), len(delta_subs[0])), dtype=int) for _ in range(2)]
         self.v=np.zeros_like(self.r, dtype=float)
         self.N_eq=len(sub0s[0])
@@ -59,7 +78,7 @@ class lin_op:
             this_sub=[sub0+delta[ii] for sub0, delta in zip(sub0s, delta_subs)]
             self.r[:,ii]=self.row_0+np.arange(0, self.N_eq, dtype=int)
             self.c[:,ii]=self.grid.global_ind(this_sub)
-            self.v[:,ii]=vals[ii]
+            self.v[:,ii]=vals[ii]*row_weight
         self.ind0=self.grid.global_ind(sub0s).ravel()
         self.TOC['rows']={self.name:range(self.N_eq)}
         self.TOC['cols']={self.grid.name:np.arange(self.grid.col_0, self.grid.col_0+self.grid.N_nodes)}
@@ -117,8 +136,8 @@ class lin_op:
         delta_ind=np.c_[[kk.ravel() for kk in list_of_dims]]
         n_neighbors=delta_ind.shape[1]
         Npts=len(pts[0])
-        rr=np.zeros([Npts, n_neighbors])
-        cc=np.zeros([Npts, n_neighbors])
+        rr=np.zeros([Npts, n_neighbors], dtype=int)
+        cc=np.zeros([Npts, n_neighbors], dtype=int)
         vv= np.ones([Npts, n_neighbors])
         # make lists of row and column indices and weights for the nodes
         for ii in range(n_neighbors):
@@ -211,6 +230,53 @@ class lin_op:
         self.N_eq=1.
         return self
 
+    def mean_of_regions(self, regions):
+        # make a linear operator that calculates the mean of the grid over
+        # each of a set of regions in the first two (y, x) dimensions of the
+        # grid, for each node in the remaining dimension (e.g. for each epoch
+        # of a dz grid).  All rows are built in one pass.
+        # 'regions' can be:
+        #    an integer label array, with the shape of the first two grid
+        #         dimensions, in which each positive value defines a region
+        #    a list of boolean arrays, with the shape of the first two grid
+        #         dimensions, each defining a region (regions may overlap)
+        # The output rows are ordered by region, then by epoch, so the product
+        # of the operator with a model vector can be reshaped to
+        # [N_regions, N_epochs].  If the grid has active nodes, only those are
+        # included in the means.  The region labels (or list indices) are
+        # stored in self.region_ids, and the number of nodes averaged for
+        # each row in self.region_count:  rows with no nodes give zero, and
+        # should be treated as undefined.
+        N_xy=np.prod(self.grid.shape[0:2])
+        if isinstance(regions, (list, tuple)):
+            xy_ind=[np.flatnonzero(np.asarray(region).ravel()) for region in regions]
+            region_num=np.concatenate([np.zeros(ind.size, dtype=int)+k for k, ind in enumerate(xy_ind)])
+            xy_ind=np.concatenate(xy_ind).astype(int)
+            self.region_ids=np.arange(len(regions))
+        else:
+            labels=np.asarray(regions).ravel()
+            xy_ind=np.flatnonzero(labels > 0)
+            self.region_ids, region_num=np.unique(labels[xy_ind], return_inverse=True)
+        N_regions=len(self.region_ids)
+        N_t=int(self.grid.N_nodes/N_xy)
+        # the non-(y, x) dimensions are the fastest-varying in the global index
+        nodes=(xy_ind[:, np.newaxis]*N_t+np.arange(N_t)[np.newaxis, :]).ravel()
+        rows=(region_num[:, np.newaxis]*N_t+np.arange(N_t)[np.newaxis, :]).ravel()
+        if self.grid.active is not None:
+            keep=self.grid.active.ravel()[nodes]
+            nodes=nodes[keep]
+            rows=rows[keep]
+        count=np.bincount(rows, minlength=N_regions*N_t)
+        self.region_count=count
+        self.N_eq=N_regions*N_t
+        self.r=self.row_0+rows
+        self.c=self.grid.col_0+nodes
+        self.v=1./count[rows]
+        self.ind0=np.zeros([0], dtype=int)
+        self.TOC['rows']={self.name:np.arange(self.N_eq, dtype=int)}
+        self.TOC['cols']={self.grid.name:np.unique(self.c)}
+        return self
+
     def data_bias(self, ind, col=None):
         # make a linear operator that returns a particular model parameter.
         # can be used to add one model parameter to a set of other parameters,
@@ -332,7 +398,7 @@ class lin_op:
         else:
             inds=self.ind0-self.grid.col_0
             subs=np.unravel_index(inds, self.grid.mask.shape)
-        temp=self.grid.mask[subs]
+        temp=self.grid.mask[tuple(subs)]
         if mask_scale is not None:
             temp2=np.zeros_like(temp)
             for key in mask_scale.keys():
@@ -349,13 +415,32 @@ class lin_op:
                 print("\t%s\t%d : %d" % (key, np.min(self.TOC[rc][key]), np.max(self.TOC[rc][key])))
 
     def fix_dtypes(self):
-        self.r=self.r.astype(int)
-        self.c=self.c.astype(int)
+        # make sure that the row and column indices are integers.  Integer
+        # indices are left as they are, so that reduced-precision operators
+        # (see set_precision) keep their index type
+        if not np.issubdtype(self.r.dtype, np.integer):
+            self.r=self.r.astype(int)
+        if not np.issubdtype(self.c.dtype, np.integer):
+            self.c=self.c.astype(int)
+
+    def set_precision(self, float_type=np.float32, int_type=np.int32):
+        # change the storage type of the operator's nonzero entries.  With the
+        # defaults, the memory used by r, c, and v is halved.  Products of the
+        # operator with float64 vectors are still calculated in float64.
+        if np.issubdtype(int_type, np.integer) and np.iinfo(int_type).max < np.max([self.col_N or 0, self.N_eq]):
+            raise ValueError("%s cannot represent the indices of operator %s" % (np.dtype(int_type).name, self.name))
+        self.r=np.asarray(self.r).astype(int_type)
+        self.c=np.asarray(self.c).astype(int_type)
+        self.v=np.asarray(self.v).astype(float_type)
+        return self
 
-    def toCSR(self, col_N=None):
-        # transform a linear operator to a sparse CSR matrix
+    def toCSR(self, col_N=None, row_N=None):
+        # transform a linear operator to a sparse CSR matrix.  Unless row_N
+        # is specified, the matrix ends at the last row with a nonzero entry
         if col_N is None:
             col_N=self.col_N
         self.fix_dtypes()
         good=self.v.ravel()!=0
-        return sp.csr_matrix((self.v.ravel()[good],(self.r.ravel()[good], self.c.ravel()[good])), shape=(np.max(self.r.ravel()[good])+1, col_N))
+        if row_N is None:
+            row_N=np.max(self.r.ravel()[good])+1
+        return sp.csr_matrix((self.v.ravel()[good],(self.r.ravel()[good], self.c.ravel()[good])), shape=(row_N, col_N))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:26:51 2026
+"""
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+def interp_grid(grid, vals, pts):
+    """
+        Multilinear interpolation of nodal values at a set of points
+
+        Gives the same values as lin_op(grid).interp_mtx(pts).toCSR().dot(vals.ravel()),
+        without building the interpolation matrix.  Nodes whose weight is zero
+        do not contribute, so NaN values (e.g. inactive nodes) only affect the
+        points that use them.
+
+        input arguments:
+            grid: fd_grid defining the node locations
+            vals: nodal values, with the shape of the grid
+            pts: list of coordinate arrays, one for each grid dimension
+        output arguments:
+            result: interpolated values, NaN for points outside the grid
+    """
+    pts=[np.asarray(pp, dtype=float).ravel() for pp in pts]
+    result=np.zeros(pts[0].size)+np.nan
+    good=grid.validate_pts(pts)
+    if not np.any(good):
+        return result
+    flat=np.asarray(vals, dtype=float).ravel()
+    ind0=np.zeros(np.sum(good), dtype=int)
+    frac=list()
+    for dim in range(grid.N_dims):
+        idxf=(pts[dim][good]-grid.bds[dim][0])/grid.delta[dim]
+        # points on the upper edge use the last cell, with a fractional position of 1
+        sub=np.maximum(0, np.minimum(np.floor(idxf).astype(int), grid.shape[dim]-2))
+        frac.append(idxf-sub)
+        ind0 += sub*grid.stride[dim]
+    temp=np.zeros(ind0.size)
+    for corner in np.ndindex(*([2]*grid.N_dims)):
+        w=np.ones(ind0.size)
+        ind=ind0.copy()
+        for dim in range(grid.N_dims):
+            if corner[dim]==0:
+                w *= 1.-frac[dim]
+            else:
+                w *= frac[dim]
+                ind += grid.stride[dim]
+        ind=np.minimum(ind, flat.size-1)
+        temp += np.where(w != 0, w*flat[ind], 0.)
+    result[good]=temp
+    return result
+
+def _predict_chunk(m, grids, x, y, t, E):
+    z=interp_grid(grids['z0'], m['z0'], (y, x))+interp_grid(grids['dz'], m['dz'], (y, x, t))
+    if E is None:
+        return z, None
+    # the errors are interpolated separately, and their covariance is neglected
+    sigma=np.sqrt(interp_grid(grids['z0'], E['z0'], (y, x))**2+interp_grid(grids['dz'], E['dz'], (y, x, t))**2)
+    return z, sigma
+
+def predict_xyt(m, grids, x, y, t, E=None, chunk_size=1000000, N_threads=1):
+    """
+        Evaluate a fitted surface, z0 + dz, at a set of points
+
+        The points are processed in chunks, so that the memory used does not
+        depend on the number of points, and chunks can be evaluated in
+        parallel threads (numpy releases the GIL for the array operations).
+
+        input arguments:
+            m: model dict (from smooth_xyt_fit, or fit_h5.read('m')) with entries 'z0' and 'dz'
+            grids: grids dict for the fit, with entries 'z0' and 'dz'
+            x, y, t: point coordinates
+            E: optional error dict with entries 'z0' and 'dz'.  If specified, approximate errors are returned
+            chunk_size: number of points evaluated at once
+            N_threads: number of threads used to evaluate chunks
+        output arguments:
+            z: model heights at the points (NaN outside the grids)
+            sigma: (only if E is specified) error estimates at the points
+    """
+    x, y, t=[np.asarray(temp, dtype=float).ravel() for temp in (x, y, t)]
+    z=np.zeros(x.size)+np.nan
+    sigma=None
+    if E is not None:
+        sigma=np.zeros(x.size)+np.nan
+    chunk_size=int(chunk_size)
+    starts=range(0, x.size, chunk_size)
+
+    def do_chunk(i0):
+        ii=slice(i0, np.minimum(i0+chunk_size, x.size))
+        z[ii], sigma_chunk=_predict_chunk(m, grids, x[ii], y[ii], t[ii], E)
+        if sigma_chunk is not None:
+            sigma[ii]=sigma_chunk
+
+    if N_threads > 1:
+        with ThreadPoolExecutor(N_threads) as pool:
+            list(pool.map(do_chunk, starts))
+    else:
+        for i0 in starts:
+            do_chunk(i0)
+    if E is None:
+        return z
+    return z, sigma
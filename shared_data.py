@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:31:05 2026
+"""
+import numpy as np
+import os
+import tempfile
+from multiprocessing import shared_memory
+from LSsurf.column_data import column_data
+
+# shared-memory segments attached by this process, kept open while arrays built on them may be in use
+_attached=dict()
+
+class shared_arrays(object):
+    # a shared_arrays object places a set of arrays in shared memory (or, if
+    # a directory is given, in memory-mapped files) once, so that worker
+    # processes can use them without copying.  The object owns the storage:
+    # it is released by close() (or at the end of a with block).  The handle
+    # attribute is a small dict that describes where each array is, and can
+    # be sent to a worker, which calls attach_arrays() to get the arrays.
+    def __init__(self, arrays, directory=None):
+        self.segments=dict()
+        self.files=list()
+        self.handle=dict()
+        for key, val in arrays.items():
+            val=np.ascontiguousarray(val)
+            if directory is None:
+                shm=shared_memory.SharedMemory(create=True, size=np.maximum(val.nbytes, 1))
+                np.ndarray(val.shape, dtype=val.dtype, buffer=shm.buf)[...]=val
+                self.segments[key]=shm
+                self.handle[key]=('shm', shm.name, val.dtype.str, val.shape)
+            else:
+                fd, filename=tempfile.mkstemp(suffix='_'+key+'.bin', dir=directory)
+                os.close(fd)
+                if val.size > 0:
+                    np.memmap(filename, mode='w+', dtype=val.dtype, shape=val.shape)[...]=val
+                self.files.append(filename)
+                self.handle[key]=('file', filename, val.dtype.str, val.shape)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for shm in self.segments.values():
+            shm.close()
+            shm.unlink()
+        self.segments=dict()
+        for filename in self.files:
+            if os.path.isfile(filename):
+                os.remove(filename)
+        self.files=list()
+
+def _attach_segment(name):
+    if name not in _attached:
+        try:
+            # python >= 3.13:  the owner, not the worker, is responsible for unlinking the segment
+            _attached[name]=shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            _attached[name]=shared_memory.SharedMemory(name=name)
+    return _attached[name]
+
+def attach_arrays(handle):
+    """
+        Get the arrays described by a shared_arrays handle, without copying them
+
+        input arguments:
+            handle: the handle attribute of a shared_arrays object
+        output arguments:
+            arrays: dict of read-only arrays
+    """
+    arrays=dict()
+    for key, (kind, name, dtype, shape) in handle.items():
+        if int(np.prod(shape))==0:
+            arrays[key]=np.zeros(shape, dtype=dtype)
+        elif kind=='shm':
+            arrays[key]=np.ndarray(shape, dtype=dtype, buffer=_attach_segment(name).buf)
+        else:
+            arrays[key]=np.memmap(name, mode='r', dtype=dtype, shape=shape)
+        arrays[key].flags.writeable=False
+    return arrays
+
+def share_data(data, fields=None, directory=None):
+    """
+        Place the fields of a point data object in shared memory
+
+        input arguments:
+            data: pointdata or column_data instance
+            fields: the fields to share, defaults to data.list_of_fields
+            directory: if specified, the fields are written to memory-mapped files in this directory instead of shared memory
+        output arguments:
+            store: shared_arrays object holding the fields.  store.handle can be passed to attach_data
+    """
+    if fields is None:
+        fields=data.list_of_fields
+    return shared_arrays({field:getattr(data, field) for field in fields}, directory=directory)
+
+def attach_data(handle, index=None):
+    """
+        Make a column_data object from shared fields, optionally selecting a subset of the points
+
+        The fields are not copied until they are read from the subset (see column_data).
+
+        input arguments:
+            handle: the handle of a shared_arrays object made by share_data
+            index: optional boolean or integer index (or slice) selecting the points
+        output arguments:
+            data: column_data instance
+    """
+    data=column_data().from_dict(attach_arrays(handle))
+    if isinstance(index, slice):
+        index=np.arange(data.size)[index]
+    if index is not None:
+        data.subset(index)
+    return data
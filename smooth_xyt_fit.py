@@ -12,8 +12,14 @@ import matplotlib.pyplot as plt
 import copy
 import sparseqr
 from time import time
-from LSsurf.RDE import RDE
+from LSsurf.three_sigma_editor import three_sigma_editor, robust_weighter
+from LSsurf.fit_plan import plan_fit
+from LSsurf.grid_ordering import grid_nested_dissection, restrict_ordering, solve_ordered
+from LSsurf.super_obs import super_obs
+from LSsurf.adaptive_grid import refinement_levels, level_op, column_prolongation
+from LSsurf.time_basis import time_basis
 from LSsurf.unique_by_rows import unique_by_rows
+from LSsurf.bin_index import bin_index
 from osgeo import gdal
 import os
 import h5py
@@ -32,18 +38,21 @@ def edit_data_by_subset_fit(N_subset, args):
 
     subset_ctrs=np.meshgrid(np.arange(bds['x'][0]+subset_spacing['x'], bds['x'][1], subset_spacing['x']),  np.arange(bds['y'][0]+subset_spacing['y'], bds['y'][1], subset_spacing['y']))
     valid_data=np.ones_like(args['data'].x, dtype=bool)
+    # index the data by bins half the width of the tight subset bounds
+    data_index=bin_index(args['data'].x, args['data'].y, W_subset['x']/4)
     count=0
     for x0, y0 in zip(subset_ctrs[0].ravel(), subset_ctrs[1].ravel()):
         count += 1
-        in_bounds= \
-            (args['data'].x > x0-W_subset['x']/2) & ( args['data'].x < x0+W_subset['y']/2) & \
-            (args['data'].y > y0-W_subset['x']/2) & ( args['data'].y < y0+W_subset['y']/2)
-        if in_bounds.sum() < 10:
+        in_bounds=data_index.query_xy_box(x0+np.array([-0.5, 0.5])*W_subset['x'], y0+np.array([-0.5, 0.5])*W_subset['y'], strict=True)
+        if in_bounds.size < 10:
             valid_data[in_bounds]=False
             continue
-        sub_args=copy.deepcopy(args)
+        # the subset grids are smaller than the full grid, so the fit structure cannot be shared
+        # the data are not deep-copied:  copy() and subset() on a column_data object share the input arrays
+        sub_args=copy.deepcopy({key:args[key] for key in args if key not in ('fit_structure', 'data')})
+        sub_args['fit_structure']=None
         sub_args['N_subset']=None
-        sub_args['data']=sub_args['data'].subset(in_bounds)
+        sub_args['data']=args['data'].copy().subset(in_bounds)
         sub_args['W_ctr']=W_subset['x']
         sub_args['W'].update(W_subset)
         sub_args['ctr'].update({'x':x0, 'y':y0})
@@ -52,18 +61,16 @@ def edit_data_by_subset_fit(N_subset, args):
             sub_args['max_iterations']=args['subset_iterations']
         tic=time()
         if args['VERBOSE']:
-            print("working on subset %d, XR=[%d, %d], YR=[%d, %d], f_tot=%2.2f" % (count, x0-W_subset['x']/2, x0+W_subset['x']/2, y0-W_subset['x']/2, y0+W_subset['x']/2, np.mean(in_bounds)))
+            print("working on subset %d, XR=[%d, %d], YR=[%d, %d], f_tot=%2.2f" % (count, x0-W_subset['x']/2, x0+W_subset['x']/2, y0-W_subset['x']/2, y0+W_subset['x']/2, in_bounds.size/float(valid_data.size)))
  
         sub_fit=smooth_xyt_fit(**sub_args)
         t_fit=time()-tic
         if args['VERBOSE']:
             print("dt=%3.2f, t expected for all=%3.2f"  % (t_fit, t_fit*subset_ctrs[0].size))
-        in_tight_bounds_sub = \
-            (sub_args['data'].x > x0-W_subset['x']/4) & (sub_args['data'].x < x0+W_subset['x']/4) & \
-            (sub_args['data'].y > y0-W_subset['y']/4) & (sub_args['data'].y < y0+W_subset['y']/4)
-        in_tight_bounds_all=\
-            (args['data'].x > x0-W_subset['x']/4) & ( args['data'].x < x0+W_subset['x']/4) & \
-            (args['data'].y > y0-W_subset['y']/4) & ( args['data'].y < y0+W_subset['x']/4)
+        in_tight_bounds_all=data_index.query_xy_box(x0+np.array([-0.25, 0.25])*W_subset['x'], y0+np.array([-0.25, 0.25])*W_subset['y'], strict=True)
+        # the tight bounds are inside the loose bounds, and both index arrays are sorted,
+        # so the location of each tight-bounds point in the subset data can be found by a search
+        in_tight_bounds_sub=np.searchsorted(in_bounds, in_tight_bounds_all)
         valid_data[in_tight_bounds_all] = valid_data[in_tight_bounds_all] & sub_fit['valid_data'][in_tight_bounds_sub]
     if args['VERBOSE']:
         print("from all subsets, found %d data" % valid_data.sum())
@@ -82,9 +89,13 @@ def select_repeat_data(data, grids, repeat_dt, resolution):
     repeat_grid=fd_grid( grids['z0'].bds, resolution*np.ones(2), name='repeat')
     t_coarse=np.round((data.time-grids['dz'].bds[2][0])/repeat_dt)*repeat_dt
     grid_repeat_count=np.zeros(np.prod(repeat_grid.shape))
-    for t_val in np.unique(t_coarse):
+    # sort the data by epoch once, so that each epoch's points are a contiguous range
+    t_vals, t_ind=np.unique(t_coarse, return_inverse=True)
+    t_order=np.argsort(t_ind, kind='stable')
+    t_offsets=np.concatenate([[0], np.cumsum(np.bincount(t_ind, minlength=t_vals.size))])
+    for i_t in range(t_vals.size):
         # select the data points for each epoch
-        ii=t_coarse==t_val
+        ii=t_order[t_offsets[i_t]:t_offsets[i_t+1]]
         # use the lin_op.interp_mtx to find the grid points associated with each node
         grid_repeat_count += np.asarray(lin_op(repeat_grid).interp_mtx((data.y[ii], data.x[ii])).toCSR().sum(axis=0)>0.5).ravel()
     data_repeats = lin_op(repeat_grid).interp_mtx((data.y, data.x)).toCSR().dot((grid_repeat_count>1).astype(np.float64))
@@ -179,40 +190,20 @@ def parse_biases(m, ID_dict, bias_params):
             b_dict[param].append(ID_dict[item][param])        
     return b_dict
 
-def smooth_xyt_fit(**kwargs):
-    required_fields=('data','W','ctr','spacing','E_RMS')
-    args={'reference_epoch':0,
-    'W_ctr':1e4,
-    'mask_file':None,
-    'mask_scale':None,
-    'compute_E':False,
-    'max_iterations':10,
-    'srs_WKT': None,
-    'N_subset': None,
-    'bias_params': None, 
-    'repeat_res':None, 
-    'repeat_dt': 1, 
-    'Edit_only': False,
-    'dzdt_lags':[1, 4],
-    'VERBOSE': True}
-    args.update(kwargs)
-    for field in required_fields:
-        if field not in kwargs:
-            raise ValueError("%s must be defined", field)
-    valid_data=np.ones_like(args['data'].x, dtype=bool)
-    timing=dict()
-    
-    if args['N_subset'] is not None:
-        tic=time()
-        valid_data=edit_data_by_subset_fit(args['N_subset'], args)
-        timing['edit_by_subset']=time()-tic
-        if args['Edit_only']:
-            return {'timing':timing, 'data':args['data'].copy().subset(valid_data)}
-    m=dict()
-    E=dict()
+def setup_grids(args):
+    """
+        Define the z0, dz, and t grids for a fit
 
-    # define the grids
-    tic=time()
+        input arguments:
+            args: fit arguments (see smooth_xyt_fit), must contain 'ctr', 'W', 'spacing', 'srs_WKT' and 'mask_file'.
+                If args['refinement'] is specified (a dict of keywords for adaptive_grid.refinement_levels), the z0 and dz
+                grids are made variable-resolution, with the spacings in args['spacing'] as their finest level.
+                If args['time_basis'] is specified (a dict of keywords for time_basis.time_basis), dz is represented
+                at each node by the coefficients of a small set of functions of time, rather than by its value at each epoch
+        output arguments:
+            grids: dict of fd_grid objects, with entries 'z0', 'dz', and 't'
+            bds: dict giving the x, y, and t bounds of the grids
+    """
     bds={coord:args['ctr'][coord]+np.array([-0.5, 0.5])*args['W'][coord] for coord in ('x','y','t')}
     grids=dict()
     grids['z0']=fd_grid( [bds['y'], bds['x']], args['spacing']['z0']*np.ones(2), name='z0', srs_WKT=args['srs_WKT'], mask_file=args['mask_file'])
@@ -220,16 +211,133 @@ def smooth_xyt_fit(**kwargs):
         [args['spacing']['dz'], args['spacing']['dz'], args['spacing']['dt']], col_0=grids['z0'].N_nodes, name='dz', srs_WKT=args['srs_WKT'], mask_file=args['mask_file'])
     grids['z0'].col_N=grids['dz'].col_N
     grids['t']=fd_grid([bds['t']], [args['spacing']['dt']], name='t')
+    if args['active_nodes']:
+        # only the nodes near valid mask values are degrees of freedom
+        if args['mask_file'] is None:
+            raise ValueError("active_nodes requires a mask_file")
+        for key in ('z0','dz'):
+            grids[key].active_from_mask()
+    if args['refinement'] is not None:
+        for key in ('z0','dz'):
+            grids[key].set_levels(refinement_levels(grids[key], data=args['data'], **args['refinement']))
+    if args['time_basis'] is not None:
+        # the basis functions are zero at the reference epoch, so no dz columns need to be removed for it
+        grids['dz'].set_time_basis(time_basis(grids['dz'].ctrs[2], reference_epoch=args['reference_epoch'], **args['time_basis']))
+    return grids, bds
+
+def setup_fit_structure(args, grids=None):
+    """
+        Build the parts of a fit that depend only on the grid geometry
+
+        The smoothness constraints and the column map depend only on the
+        grid dimensions and spacing, not on the grid location or the data, so
+        the structure returned by this function can be shared between
+        tiles with the same 'W' and 'spacing' (see batch_xyt_fit).
+
+        If active nodes are used (args['active_nodes']), or the grids are
+        variable-resolution (args['refinement']), the constraints depend on
+        the tile's mask or data, so the structure can only be shared between
+        fits of the same tile.
+
+        input arguments:
+            args: fit arguments (see smooth_xyt_fit)
+            grids: optional grids for the fit (see setup_grids).  Calculated from args if not specified
+        output arguments:
+            structure: dict with entries:
+                constraint_ops: list of smoothness-constraint operators
+                Gc: the smoothness constraints stacked into one operator
+                Gc_csr: Gc as a sparse matrix
+                Ec_scale: mask-based scaling for the constraint errors (None if a mask file is used, because then it depends on the tile location)
+                z02_mask: the dz columns for the reference epoch
+                shape: dict giving the shape of each grid
+    """
+    if grids is None:
+        grids, bds=setup_grids(args)
+    # define the smoothness constraints
+    # on variable-resolution grids, the template spacing follows the quadtree (see adaptive_grid.level_op)
+    grad2_z0=level_op(grids['z0'], 'grad2_z0', lambda op: op.grad2(DOF='z0'))
+    grad2_dz=level_op(grids['dz'], 'grad2_dzdt', lambda op: op.grad2_dzdt(DOF='z', t_lag=1))
+    grad_dzdt=level_op(grids['dz'], 'grad_dzdt', lambda op: op.grad_dzdt(DOF='z', t_lag=1))
+    constraint_op_list=[grad2_z0, grad2_dz, grad_dzdt]
+    if 'd2z_dt2' in args['E_RMS'] and args['E_RMS']['d2z_dt2'] is not None:
+        d2z_dt2=level_op(grids['dz'], 'd2z_dt2', lambda op: op.d2z_dt2(DOF='z'))
+        constraint_op_list.append(d2z_dt2)
+    # the mask-based scaling of the constraint errors does not depend on E_RMS
+    Ec_scale=None
+    if args['mask_file'] is None:
+        Ec_scale=mask_Ec_scale(constraint_op_list, grids, args['mask_scale'])
+    Gc=lin_op(None, name='constraints').vstack(constraint_op_list)
+
+    # Find the identify the rows and columns that match the reference epoch
+    # If reference_epoch is None, no columns are removed, and the split between z0 and dz
+    # must be determined by other equations (e.g. a prior, see append_epochs).
+    # With a time basis, dz is zero at the reference epoch by construction (see setup_grids)
+    if args['reference_epoch'] is None or args['time_basis'] is not None:
+        z02_mask=np.zeros(0, dtype=int)
+    else:
+        temp_r, temp_c=np.meshgrid(np.arange(0, grids['dz'].shape[0]), np.arange(0, grids['dz'].shape[1]))
+        z02_mask=grids['dz'].global_ind([temp_r.transpose().ravel(), temp_c.transpose().ravel(), args['reference_epoch']+np.zeros_like(temp_r).ravel()])
+
+    return {'constraint_ops':constraint_op_list, 'Gc':Gc, 'Gc_csr':Gc.toCSR(), 'Ec_scale':Ec_scale, \
+            'z02_mask':z02_mask, 'shape':{key:grids[key].shape for key in grids}}
+
+def mask_Ec_scale(constraint_op_list, grids, mask_scale):
+    """
+        Sample the grid masks at the center of each smoothness constraint
+
+        The operators may have been built on another tile's grids (see
+        setup_fit_structure), so the masks are sampled from the grid in
+        'grids' that has the same name as each operator's grid.
+    """
+    Ec_scale=dict()
+    for op in constraint_op_list:
+        this_op=copy.copy(op)
+        this_op.grid=grids[op.grid.name]
+        Ec_scale[op.name]=this_op.mask_for_ind0(mask_scale)
+    return Ec_scale
+
+def assemble_fit(args, valid_data, timing):
+    """
+        Build the data and constraint equations for a fit
+
+        The returned dict contains everything needed to solve the fit for a
+        particular set of E_RMS values: only the constraint errors (see calc_Ec)
+        depend on E_RMS, so the same assembled fit can be re-solved many times.
+        If args['fit_structure'] is specified (see setup_fit_structure), the
+        constraint equations and column map are taken from it, and only the
+        data-dependent parts of the fit are built.  If args['super_obs'] is
+        specified (a dict of keywords for super_obs), the rows of G_data are
+        for super-observations (fit['super_obs']) combined from the data.
+
+        input arguments:
+            args: fit arguments (see smooth_xyt_fit)
+            valid_data: boolean array, true for data that may be used in the fit
+            timing: dict to which the setup time is added
+        output arguments:
+            fit: dict containing the grids, edited data, operators and the book-keeping matrices for the fit
+    """
+    tic=time()
+    grids, bds=setup_grids(args)
+    structure=args['fit_structure']
+    if structure is None:
+        structure=setup_fit_structure(args, grids=grids)
+    for key in grids:
+        if not np.all(grids[key].shape==structure['shape'][key]):
+            raise ValueError("the fit structure does not match the %s grid" % key)
 
     # select only the data points that are within the grid bounds
     valid_z0=grids['z0'].validate_pts((args['data'].coords()[0:2]))
-    valid_dz=grids['dz'].validate_pts((args['data'].coords()))     
+    valid_dz=grids['dz'].validate_pts((args['data'].coords()))
     valid_data=valid_data & valid_dz & valid_z0
-    
+    if args['active_nodes']:
+        # only use data whose interpolation nodes are all active
+        valid_data[valid_data]=grids['z0'].active_for_pts([temp[valid_data] for temp in args['data'].coords()[0:2]]) & \
+            grids['dz'].active_for_pts([temp[valid_data] for temp in args['data'].coords()])
+
     # if repeat_res is given, resample the data to include only repeat data (to within a spatial tolerance of repeat_res)
     if args['repeat_res'] is not None:
         valid_data[valid_data]=valid_data[valid_data] & \
-            select_repeat_data(args['data'].copy().subset(valid_data), grids, args['repeat_dt'], args['repeat_res']) 
+            select_repeat_data(args['data'].copy().subset(valid_data), grids, args['repeat_dt'], args['repeat_res'])
 
     # subset the data based on the valid mask
     data=args['data'].copy().subset(valid_data)
@@ -243,134 +351,542 @@ def smooth_xyt_fit(**kwargs):
         if np.any(data_mask==0):
             data.subset(~(data_mask==0))
             valid_data[valid_data]= ~(data_mask==0)
- 
+
+    # if super-observations are requested, the data are combined before the equations are built,
+    # and the data equations are written for the super-observations (obs) instead of the data
+    bias_model=None
+    obs=data
+    super_data=None
+    if args['super_obs'] is not None:
+        group_fields=None
+        if args['bias_params'] is not None:
+            data, bias_model=assign_bias_ID(data, args['bias_params'])
+            group_fields=['bias_ID']
+        super_data=super_obs(data, grids['dz'], group_fields=group_fields, **args['super_obs'])
+        obs=super_data.data
+
     # define the interpolation operator, equal to the sum of the dz and z0 operators
-    G_data=lin_op(grids['z0'], name='interp_z').interp_mtx(data.coords()[0:2])
-    G_data.add(lin_op(grids['dz'], name='interp_dz').interp_mtx(data.coords()))
+    G_data=lin_op(grids['z0'], name='interp_z').interp_mtx(obs.coords()[0:2])
+    G_data.add(lin_op(grids['dz'], name='interp_dz').interp_mtx(obs.coords()))
 
-     # define the smoothness constraints
-    grad2_z0=lin_op(grids['z0'], name='grad2_z0').grad2(DOF='z0')
-    grad2_dz=lin_op(grids['dz'], name='grad2_dzdt').grad2_dzdt(DOF='z', t_lag=1)
-    grad_dzdt=lin_op(grids['dz'], name='grad_dzdt').grad_dzdt(DOF='z', t_lag=1)
-    constraint_op_list=[grad2_z0, grad2_dz, grad_dzdt]
-    if 'd2z_dt2' in args['E_RMS'] and args['E_RMS']['d2z_dt2'] is not None:
-        d2z_dt2=lin_op(grids['dz'], name='d2z_dt2').d2z_dt2(DOF='z')
-        constraint_op_list.append(d2z_dt2)
+    # the mask-based scaling of the constraint errors does not depend on E_RMS
+    Ec_scale=structure['Ec_scale']
+    if Ec_scale is None:
+        Ec_scale=mask_Ec_scale(structure['constraint_ops'], grids, args['mask_scale'])
 
     # if bias params are given, create a set of parameters to estimate them
+    Cvals_bias=None
+    Gc_bias=None
     if args['bias_params'] is not None:
-        data, bias_model=assign_bias_ID(data, args['bias_params'])
-        G_bias, Gc_bias, Cvals_bias, bias_model=param_bias_matrix(data, bias_model, bias_param_name='bias_ID', col_0=grids['dz'].col_N)
+        if super_data is None:
+            data, bias_model=assign_bias_ID(data, args['bias_params'])
+            obs=data
+        G_bias, Gc_bias, Cvals_bias, bias_model=param_bias_matrix(obs, bias_model, bias_param_name='bias_ID', col_0=grids['dz'].col_N)
         G_data.add(G_bias)
-        constraint_op_list.append(Gc_bias)
- 
-    # put the equations together
-    Gc=lin_op(None, name='constraints').vstack(constraint_op_list)
+    # if a prior is given, create equations that tie the nodes to the prior values
+    prior_ops, prior_vals, prior_sigma=[], [], []
+    if args['prior'] is not None:
+        prior_ops, prior_vals, prior_sigma=setup_prior(args['prior'], grids, structure['z02_mask'])
+    if Gc_bias is not None or len(prior_ops) > 0:
+        # put the equations together
+        Gc=lin_op(None, name='constraints').vstack(structure['constraint_ops']+[op for op in [Gc_bias] if op is not None]+prior_ops)
+        Gc_csr=Gc.toCSR()
+    else:
+        Gc=structure['Gc']
+        Gc_csr=structure['Gc_csr']
+    # in mixed-precision mode, the interpolation weights are stored as float32
+    # and their indices as int32, and the assembled matrix (Gcoo) is kept in
+    # float32.  Gcoo is converted to float64 when it is weighted for each
+    # solution, so the solution is still calculated in float64.
+    residual_dtype=np.float64
+    matrix_dtype=None
+    if args['precision']=='mixed':
+        G_data.set_precision(np.float32, np.int32)
+        residual_dtype=np.float32
+        matrix_dtype=np.float32
+    elif args['precision'] != 'double':
+        raise ValueError("precision must be 'double' or 'mixed'")
     N_eq=G_data.N_eq+Gc.N_eq
 
-    # put together all the errors
-    Ec=np.zeros(Gc.N_eq)
-    root_delta_V_dz=np.sqrt(np.prod(grids['dz'].delta))
-    root_delta_A_z0=np.sqrt(np.prod(grids['z0'].delta))
-    Ec[Gc.TOC['rows']['grad2_z0']]=args['E_RMS']['d2z0_dx2']/root_delta_A_z0*grad2_z0.mask_for_ind0(args['mask_scale'])
-    Ec[Gc.TOC['rows']['grad2_dzdt']]=args['E_RMS']['d3z_dx2dt']/root_delta_V_dz*grad2_dz.mask_for_ind0(args['mask_scale'])
-    Ec[Gc.TOC['rows']['grad_dzdt']]=args['E_RMS']['d2z_dxdt']/root_delta_V_dz*grad_dzdt.mask_for_ind0(args['mask_scale'])
-    if 'd2z_dt2' in args['E_RMS'] and args['E_RMS']['d2z_dt2'] is not None:
-        Ec[Gc.TOC['rows']['d2z_dt2']]=args['E_RMS']['d2z_dt2']/root_delta_V_dz
-    if args['bias_params'] is not None:
-        Ec[Gc.TOC['rows'][Gc_bias.name]]=Cvals_bias
-    Ed=data.sigma.ravel()
-    # calculate the inverse square root of the data covariance matrix
-    TCinv=sp.dia_matrix((1./np.concatenate((Ed, Ec)), 0), shape=(N_eq, N_eq))
-
     # define the right hand side of the equation
     rhs=np.zeros([N_eq])
-    rhs[0:data.size]=data.z.ravel()
+    rhs[0:obs.size]=obs.z.ravel()
+    for op, vals in zip(prior_ops, prior_vals):
+        rhs[G_data.N_eq+Gc.TOC['rows'][op.name]]=vals
 
     # put the fit and constraint matrices together
-    Gcoo=sp.vstack([G_data.toCSR(), Gc.toCSR()]).tocoo()
+    Gcoo=sp.vstack([G_data.toCSR(), Gc_csr], dtype=matrix_dtype).tocoo()
     cov_rows=G_data.N_eq+np.arange(Gc.N_eq)
 
     # define the matrix that sets dz[reference_epoch]=0 by removing columns from the solution:
-    # Find the identify the rows and columns that match the reference epoch
-    temp_r, temp_c=np.meshgrid(np.arange(0, grids['dz'].shape[0]), np.arange(0, grids['dz'].shape[1]))
-    z02_mask=grids['dz'].global_ind([temp_r.transpose().ravel(), temp_c.transpose().ravel(), args['reference_epoch']+np.zeros_like(temp_r).ravel()])
-
     # Identify all of the DOFs that do not include the reference epoch
     cols=np.arange(G_data.col_N, dtype='int')
-    include_cols=np.setdiff1d(cols, z02_mask)
+    include_cols=np.setdiff1d(cols, structure['z02_mask'])
+    if args['active_nodes']:
+        # remove the columns for inactive nodes
+        inactive_cols=np.concatenate([np.setdiff1d(np.arange(grids[key].col_0, grids[key].col_0+grids[key].N_nodes), grids[key].active_cols) for key in ('z0','dz')])
+        include_cols=np.setdiff1d(include_cols, inactive_cols)
     # Generate a matrix that has diagonal elements corresponding to all DOFs except the reference epoch.
     # Multiplying this by a matrix with columns for all model parameters yeilds a matrix with no columns
     # corresponding to the reference epoch.
     Ip_c=sp.coo_matrix((np.ones_like(include_cols), (include_cols, np.arange(include_cols.size))), shape=(Gc.col_N, include_cols.size)).tocsc()
+    if args['refinement'] is not None or args['time_basis'] is not None:
+        # on variable-resolution grids, only the quadtree degrees of freedom are solved for,
+        # and the other nodes are interpolated from them.  With a time basis, the basis
+        # coefficients are solved for, and dz at each epoch is calculated from them
+        P, dof_cols=column_prolongation(grids, Gc.col_N)
+        include_cols=np.intersect1d(include_cols, dof_cols)
+        Ip_c=P[:, include_cols].tocsc()
 
     # eliminate the columns for the model variables that are set to zero
-    Gcoo=Gcoo.dot(Ip_c)
+    if matrix_dtype is None:
+        Gcoo=Gcoo.dot(Ip_c)
+    else:
+        Gcoo=Gcoo.dot(Ip_c.astype(matrix_dtype))
+
+    # the nested-dissection ordering is only used by the (optional) normal-equations solver.  It depends
+    # only on the grid geometry, so it is kept with the fit structure, and grid_nested_dissection also
+    # keeps it for fits on grids of the same geometry in this process
+    ordering=None
+    if args['solver']=='nd_normal':
+        if 'ordering' not in structure:
+            structure['ordering']=grid_nested_dissection(grids)
+        ordering=restrict_ordering(structure['ordering'], include_cols, N_cols=Gcoo.shape[1])
+    elif args['solver'] != 'qr':
+        raise ValueError("solver must be 'qr' or 'nd_normal'")
     timing['setup']=time()-tic
-    
-    if np.any(data.z>2500):
-        print('outlier!')
+
+    return {'grids':grids, 'data':data, 'valid_data':valid_data, 'G_data':G_data, 'Gc':Gc, \
+            'Gc_bias':Gc_bias, 'Cvals_bias':Cvals_bias, 'bias_model':bias_model, 'Ec_scale':Ec_scale,\
+            'Ed':obs.sigma.ravel(), 'rhs':rhs, 'Gcoo':Gcoo, 'cov_rows':cov_rows, 'Ip_c':Ip_c, 'N_eq':N_eq, \
+            'structure':structure, 'residual_dtype':residual_dtype, 'ordering':ordering, 'super_obs':super_data, \
+            'prior_ops':prior_ops, 'prior_sigma':prior_sigma}
+
+def setup_prior(prior, grids, z02_mask):
+    """
+        Build equations that tie the z0 and dz nodes to prior values
+
+        input arguments:
+            prior: dict with optional entries 'z0' and 'dz' (arrays with the shapes
+                of the z0 and dz grids, NaN where there is no prior) and
+                'sigma_z0' and 'sigma_dz' (scalars or arrays giving the prior errors)
+            grids: grids for the fit
+            z02_mask: dz columns for the reference epoch, which are not included
+        output arguments:
+            prior_ops: list of lin_op objects, one for each grid with a prior
+            prior_vals: list of prior values for the rows of each operator
+            prior_sigma: list of prior errors for the rows of each operator
+    """
+    prior_ops, prior_vals, prior_sigma=[], [], []
+    for key in ('z0','dz'):
+        if key not in prior or prior[key] is None:
+            continue
+        vals=np.asarray(prior[key], dtype=float).ravel()
+        sigma=np.broadcast_to(np.asarray(prior['sigma_'+key], dtype=float), grids[key].shape).ravel()
+        good=np.isfinite(vals) & np.isfinite(sigma) & (sigma > 0)
+        if grids[key].active is not None:
+            good &= grids[key].active.ravel()
+        ind=np.flatnonzero(good)
+        ind=ind[~np.isin(grids[key].col_0+ind, z02_mask)]
+        if ind.size==0:
+            continue
+        prior_ops.append(lin_op(grids[key], name='prior_'+key).data_bias(np.arange(ind.size), col=grids[key].col_0+ind))
+        prior_vals.append(vals[ind])
+        prior_sigma.append(sigma[ind])
+    return prior_ops, prior_vals, prior_sigma
+
+def calc_Ec(fit, E_RMS):
+    """
+        Calculate the expected errors for the constraint equations of an assembled fit
+
+        input arguments:
+            fit: assembled fit dict from assemble_fit
+            E_RMS: dict of expected RMS values for the smoothness constraints
+        output arguments:
+            Ec: array of constraint errors, one per row of fit['Gc']
+    """
+    Gc=fit['Gc']
+    grids=fit['grids']
+    Ec=np.zeros(Gc.N_eq)
+    root_delta_V_dz=np.sqrt(np.prod(grids['dz'].delta))
+    root_delta_A_z0=np.sqrt(np.prod(grids['z0'].delta))
+    Ec[Gc.TOC['rows']['grad2_z0']]=E_RMS['d2z0_dx2']/root_delta_A_z0*fit['Ec_scale']['grad2_z0']
+    Ec[Gc.TOC['rows']['grad2_dzdt']]=E_RMS['d3z_dx2dt']/root_delta_V_dz*fit['Ec_scale']['grad2_dzdt']
+    Ec[Gc.TOC['rows']['grad_dzdt']]=E_RMS['d2z_dxdt']/root_delta_V_dz*fit['Ec_scale']['grad_dzdt']
+    if 'd2z_dt2' in Gc.TOC['rows']:
+        Ec[Gc.TOC['rows']['d2z_dt2']]=E_RMS['d2z_dt2']/root_delta_V_dz
+    if fit['Gc_bias'] is not None:
+        Ec[Gc.TOC['rows'][fit['Gc_bias'].name]]=fit['Cvals_bias']
+    for op, sigma in zip(fit['prior_ops'], fit['prior_sigma']):
+        Ec[Gc.TOC['rows'][op.name]]=sigma
+    return Ec
+
+def iterate_fit(fit, Ec, max_iterations, timing, VERBOSE=False, editor=None, min_solves=4):
+    """
+        Solve an assembled fit, iteratively editing the data to within three sigma of the solution
+
+        If the fit uses super-observations, the editor, inTSE, and rs_data refer to the
+        individual data points, and the super-observations are recombined from
+        the selected points before each solution.
+
+        input arguments:
+            fit: assembled fit dict from assemble_fit
+            Ec: constraint errors from calc_Ec
+            max_iterations: maximum number of solutions to calculate
+            timing: dict to which the solution and iteration times are added
+            VERBOSE: if true, report the progress of the iterations
+            editor: optional three_sigma_editor, which is updated in place, so that the caller can see
+                which rows changed in the last iteration.  Initialized from the data if not specified
+            min_solves: the number of solutions to calculate before the iterations may stop
+        output arguments:
+            m0: the model vector
+            inTSE: indices of the data used in the next-to-last solution
+            rs_data: the scaled data residuals for m0
+            sigma_hat: the robust spread of the scaled residuals
+            Ip_r: the parsing matrix selecting the rows used in the final solution
+            TCinv: the inverse square root of the data and constraint covariance matrix
+    """
+    data=fit['data']
+    G_data=fit['G_data']
+    Gc=fit['Gc']
+    Gcoo=fit['Gcoo']
+    Ip_c=fit['Ip_c']
+    rhs=fit['rhs']
+    cov_rows=fit['cov_rows']
+    N_eq=fit['N_eq']
+    # calculate the inverse square root of the data covariance matrix
+    TCinv=sp.dia_matrix((1./np.concatenate((fit['Ed'], Ec)), 0), shape=(N_eq, N_eq))
+    super_data=fit['super_obs']
+
     # initialize the book-keeping matrices for the inversion
     m0=np.zeros(Ip_c.shape[0])
-    if "three_sigma_edit" in data.list_of_fields:
-        inTSE=np.where(data.three_sigma_edit)[0]
-    else:
-        inTSE=np.arange(G_data.N_eq, dtype=int)
-    if args['VERBOSE']:
+    if editor is None:
+        if "three_sigma_edit" in data.list_of_fields:
+            editor=three_sigma_editor(data.size, selected=data.three_sigma_edit)
+        else:
+            editor=three_sigma_editor(data.size)
+    G_data_csr=G_data.toCSR()
+    if VERBOSE:
         print("initial: %d:" % G_data.r.max())
     tic_iteration=time()
-    for iteration in range(args['max_iterations']):
+    for iteration in range(max_iterations):
+        if super_data is None:
+            inTSE=editor.rows()
+        else:
+            # recombine the super-observations from the selected data
+            obs_z, obs_sigma, obs_used=super_data.combine(editor.selected)
+            rhs=fit['rhs'].copy()
+            rhs[0:obs_z.size]=obs_z
+            TCinv=sp.dia_matrix((1./np.concatenate((obs_sigma, Ec)), 0), shape=(N_eq, N_eq))
+            inTSE=np.flatnonzero(obs_used)
         # build the parsing matrix that removes invalid rows
         Ip_r=sp.coo_matrix((np.ones(Gc.N_eq+inTSE.size), (np.arange(Gc.N_eq+inTSE.size), np.concatenate((inTSE, cov_rows)))), shape=(Gc.N_eq+inTSE.size, Gcoo.shape[0])).tocsc()
 
         m0_last=m0
-        if args['VERBOSE']:
+        if VERBOSE:
             print("starting qr solve for iteration %d" % iteration)
         # solve the equations
-        tic=time(); m0=Ip_c.dot(sparseqr.solve(Ip_r.dot(TCinv.dot(Gcoo)), Ip_r.dot(TCinv.dot(rhs)))); timing['sparseqr_solve']=time()-tic
+        if fit['ordering'] is None:
+            tic=time(); m0=Ip_c.dot(sparseqr.solve(Ip_r.dot(TCinv.dot(Gcoo)), Ip_r.dot(TCinv.dot(rhs)))); timing['sparseqr_solve']=time()-tic
+        else:
+            tic=time(); m0=Ip_c.dot(solve_ordered(Ip_r.dot(TCinv.dot(Gcoo)), Ip_r.dot(TCinv.dot(rhs)), fit['ordering'])); timing['ordered_solve']=time()-tic
 
         # quit if the solution is too similar to the previous solution
-        if (np.max(np.abs((m0_last-m0)[Gc.TOC['cols']['dz']])) < 0.05) and (iteration > 2):
+        if (np.max(np.abs((m0_last-m0)[Gc.TOC['cols']['dz']])) < 0.05) and (iteration+1 >= min_solves):
             break
 
         # calculate the full data residual
-        rs_data=(data.z-G_data.toCSR().dot(m0))/data.sigma
-        # calculate the robust standard deviation of the scaled residuals for the selected data
-        sigma_hat=RDE(rs_data[inTSE])
-        inTSE_last=inTSE
-        # select the data that are within 3*sigma of the solution
-        inTSE=np.where(np.abs(rs_data)<3.0*np.maximum(1,sigma_hat))[0]
-        if args['VERBOSE']:
-            print('found %d in TSE, sigma_hat=%3.3f' % (inTSE.size, sigma_hat))
-        if (sigma_hat <= 1 or( inTSE.size == inTSE_last.size and np.all( inTSE_last == inTSE ))) and (iteration > 2):           
-            if args['VERBOSE']:
+        rs_data=((data.z-data_model(fit, m0, G_data_csr=G_data_csr))/data.sigma).astype(fit['residual_dtype'])
+        # calculate the robust standard deviation of the scaled residuals for the selected data,
+        # and select the data that are within 3*sigma of the solution
+        sigma_hat=editor.update(rs_data)
+        if VERBOSE:
+            print('found %d in TSE, sigma_hat=%3.3f' % (editor.N_selected, sigma_hat))
+        if (sigma_hat <= 1 or editor.converged) and (iteration+1 >= min_solves):
+            if VERBOSE:
                 print("sigma_hat LT 1, exiting")
             break
     timing['iteration']=time()-tic_iteration
-    inTSE=inTSE_last
+    timing['N_solves']=iteration+1
+    return m0, editor.rows(last=True), rs_data, sigma_hat, Ip_r, TCinv
+
+def iterate_robust_fit(fit, Ec, max_iterations, timing, robust, VERBOSE=False):
+    """
+        Solve an assembled fit by iteratively-reweighted least squares
+
+        Instead of rejecting data outside three sigma of the solution, each
+        datum is weighted (through the diagonal of TCinv) by a smooth function
+        of its scaled residual (see three_sigma_editor.robust_weighter).  The
+        iterations stop when the weighted objective changes by less than a
+        fraction robust['tol'] of its value, or of its total decrease.  The
+        result is an M-estimate, which is a different estimator from the
+        three-sigma-edited solution of iterate_fit, and is not expected to
+        match it.  The three_sigma_edit flags returned are found from the
+        residuals to the weighted solution.
+
+        If robust['three_sigma'] is True, the three-sigma editing is continued
+        from the data within three sigma of the weighted solution, with the
+        stopping rules of iterate_fit, so that the output matches the edited
+        solution to within the tolerance of those rules.  This does not save
+        solutions compared with iterate_fit.
+
+        The iterations are warm-started from robust['m0'] (the model vector of
+        an earlier fit of the same tile) if it is given, which saves the
+        initial unweighted solution, or otherwise from the three_sigma_edit
+        flags of the data, if present.
+
+        input arguments:
+            fit: assembled fit dict from assemble_fit
+            Ec: constraint errors from calc_Ec
+            max_iterations: maximum number of weighted solutions to calculate
+            timing: dict to which the solution and iteration times are added
+            robust: dict with entries:
+                weight: 'tukey' (the default, which, like the editing, gives outliers no weight) or 'huber'
+                c: the tuning constant for the weights, in units of the robust spread (defaults in three_sigma_editor.ROBUST_C)
+                tol: fractional change in the objective at which the iterations stop (default 0.02)
+                three_sigma: if True, continue with three-sigma editing to give the edited solution (default False)
+                m0: optional model vector for the warm start
+            VERBOSE: if true, report the progress of the iterations
+        output arguments:
+            the same as for iterate_fit.  The weights of the data are stored in fit['robust_weights']
+    """
+    robust=dict({'weight':'tukey', 'c':None, 'tol':2.e-2, 'three_sigma':False, 'm0':None}, **robust)
+    data=fit['data']
+    Gc=fit['Gc']
+    Gcoo=fit['Gcoo']
+    Ip_c=fit['Ip_c']
+    cov_rows=fit['cov_rows']
+    N_eq=fit['N_eq']
+    super_data=fit['super_obs']
+    G_data_csr=fit['G_data'].toCSR()
+    Gc_csr=Gc.toCSR()
+
+    weights=None
+    if "three_sigma_edit" in data.list_of_fields:
+        weights=data.three_sigma_edit.astype(float)
+    weighter=robust_weighter(data.size, kind=robust['weight'], c=robust['c'], tol=robust['tol'], weights=weights)
+    if robust['m0'] is not None:
+        # weight the data using the residuals to the previous solution
+        m0=np.asarray(robust['m0'])
+        weighter.update((data.z-data_model(fit, m0, G_data_csr=G_data_csr))/data.sigma, np.sum((Gc_csr.dot(m0)/Ec)**2))
+    tic_iteration=time()
+    for iteration in range(max_iterations):
+        if super_data is None:
+            rhs=fit['rhs']
+            TCinv=sp.dia_matrix((np.concatenate((np.sqrt(weighter.weights)/fit['Ed'], 1./Ec)), 0), shape=(N_eq, N_eq))
+        else:
+            # the weights are applied to the data as they are combined into super-observations
+            obs_z, obs_sigma, obs_used=super_data.combine(weighter.weights)
+            rhs=fit['rhs'].copy()
+            rhs[0:obs_z.size]=obs_z
+            TCinv=sp.dia_matrix((1./np.concatenate((obs_sigma, Ec)), 0), shape=(N_eq, N_eq))
+        inTSE=weighter.rows() if super_data is None else np.flatnonzero(obs_used)
+        Ip_r=sp.coo_matrix((np.ones(Gc.N_eq+inTSE.size), (np.arange(Gc.N_eq+inTSE.size), np.concatenate((inTSE, cov_rows)))), shape=(Gc.N_eq+inTSE.size, Gcoo.shape[0])).tocsc()
+        if fit['ordering'] is None:
+            tic=time(); m0=Ip_c.dot(sparseqr.solve(Ip_r.dot(TCinv.dot(Gcoo)), Ip_r.dot(TCinv.dot(rhs)))); timing['sparseqr_solve']=time()-tic
+        else:
+            tic=time(); m0=Ip_c.dot(solve_ordered(Ip_r.dot(TCinv.dot(Gcoo)), Ip_r.dot(TCinv.dot(rhs)), fit['ordering'])); timing['ordered_solve']=time()-tic
+        rs_data=((data.z-data_model(fit, m0, G_data_csr=G_data_csr))/data.sigma).astype(fit['residual_dtype'])
+        sigma_hat=weighter.update(rs_data, np.sum((Gc_csr.dot(m0)/Ec)**2))
+        if VERBOSE:
+            print('robust iteration %d: objective=%3.5g, sigma_hat=%3.3f' % (iteration, weighter.objective, sigma_hat))
+        if weighter.converged:
+            break
+    timing['iteration']=time()-tic_iteration
+    timing['N_solves']=iteration+1
+    fit['robust_weights']=weighter.weights
+    if robust['three_sigma']:
+        # continue with the three-sigma editing, starting from the data within three sigma of the robust solution
+        robust_timing={key:timing[key] for key in ('iteration', 'N_solves')}
+        editor=three_sigma_editor(data.size, selected=np.abs(rs_data)<3.0*np.maximum(1, sigma_hat))
+        result=iterate_fit(fit, Ec, max_iterations, timing, VERBOSE=VERBOSE, editor=editor, min_solves=1)
+        for key in robust_timing:
+            timing[key] += robust_timing[key]
+        return result
+    return m0, inTSE, rs_data, sigma_hat, Ip_r, TCinv
+
+def data_model(fit, m0, G_data_csr=None):
+    """
+        Evaluate a model at the data points of a fit
+
+        If the fit uses super-observations, the model is evaluated at each of
+        their member points (see super_obs.point_model).
+    """
+    if G_data_csr is None:
+        G_data_csr=fit['G_data'].toCSR()
+    z_est=G_data_csr.dot(m0)
+    if fit['super_obs'] is not None:
+        z_est=fit['super_obs'].point_model(m0, z_est, fit['grids'], fit['Gc'].TOC['cols'])
+    return z_est
+
+def calc_misfit(fit, m0, Ec, z_est=None):
+    """
+        Calculate the misfit contributions of the data and the constraints for a model
+
+        input arguments:
+            fit: assembled fit dict from assemble_fit
+            m0: model vector
+            Ec: constraint errors from calc_Ec
+            z_est: optional model estimate at the data points.  Calculated from m0 if not specified
+        output arguments:
+            R: dict giving the sum of squared, scaled residuals for the data and each constraint type
+            RMS: dict giving the RMS of the unscaled residuals for the data and each constraint type
+    """
+    Gc=fit['Gc']
+    data=fit['data']
+    if z_est is None:
+        z_est=data_model(fit, m0)
+    # parse the resduals to assess the contributions of the total error:
+    # Make the C matrix for the constraints
+    TCinv_cov=sp.dia_matrix((1./Ec, 0), shape=(Gc.N_eq, Gc.N_eq))
+    rc=TCinv_cov.dot(Gc.toCSR().dot(m0))
+    ru=Gc.toCSR().dot(m0)
+    R=dict()
+    RMS=dict()
+    for eq_type in ['d2z_dt2','grad2_z0','grad2_dzdt']:
+        if eq_type in Gc.TOC['rows']:
+            R[eq_type]=np.sum(rc[Gc.TOC['rows'][eq_type]]**2)
+            RMS[eq_type]=np.sqrt(np.mean(ru[Gc.TOC['rows'][eq_type]]**2))
+    R['data']=np.sum(((z_est-data.z)/data.sigma)**2)
+    RMS['data']=np.sqrt(np.mean((z_est-data.z)**2))
+    return R, RMS
+
+def center_dzbar_matrix(grids, W_ctr, col_N):
+    """
+        Make a matrix that calculates the mean of dz over the central W_ctr x W_ctr box of the grid, for each epoch
+    """
+    XR=np.mean(grids['z0'].bds[0])+np.array([-1., 1.])*W_ctr/2.
+    YR=np.mean(grids['z0'].bds[1])+np.array([-1., 1.])*W_ctr/2.
+    ctr_nodes=np.meshgrid(grids['dz'].ctrs[0], grids['dz'].ctrs[1], indexing='ij')
+    in_ctr=(ctr_nodes[0] >= XR[0]) & (ctr_nodes[0] <= XR[1]) & (ctr_nodes[1] >= YR[0]) & (ctr_nodes[1] <= YR[1])
+    center_dzbar=lin_op(grids['dz'], name='center_dzbar', col_N=col_N).mean_of_regions(in_ctr.astype(int))
+    return center_dzbar.toCSR(row_N=center_dzbar.N_eq)
+
+def smooth_xyt_fit_args(**kwargs):
+    """
+        Fill in the default arguments for smooth_xyt_fit, and check that the required arguments are present
+    """
+    required_fields=('data','W','ctr','spacing','E_RMS')
+    args={'reference_epoch':0,
+    'W_ctr':1e4,
+    'mask_file':None,
+    'mask_scale':None,
+    'compute_E':False,
+    'max_iterations':10,
+    'srs_WKT': None,
+    'N_subset': None,
+    'bias_params': None, 
+    'repeat_res':None, 
+    'repeat_dt': 1, 
+    'Edit_only': False,
+    'dzdt_lags':[1, 4],
+    'fit_structure': None,
+    'precision': 'double',
+    'active_nodes': False,
+    'regions': None,
+    'region_polygons': None,
+    'prior': None,
+    'max_memory': None,
+    'solver': 'qr',
+    'super_obs': None,
+    'refinement': None,
+    'time_basis': None,
+    'robust': None,
+    'VERBOSE': True}
+    args.update(kwargs)
+    for field in required_fields:
+        if field not in kwargs:
+            raise ValueError("%s must be defined", field)
+    return args
+
+def smooth_xyt_fit(**kwargs):
+    args=smooth_xyt_fit_args(**kwargs)
+    valid_data=np.ones_like(args['data'].x, dtype=bool)
+    timing=dict()
+    if args['max_memory'] is not None:
+        # check the estimated cost before any of the fit is set up
+        plan=plan_fit(**args)
+        if plan['peak_memory'] > args['max_memory']:
+            raise MemoryError("fit needs an estimated %3.2g bytes (%d columns), more than max_memory=%3.2g: action=%s" % \
+                              (plan['peak_memory'], plan['N_cols'], args['max_memory'], plan['action']))
+    
+    if args['N_subset'] is not None:
+        tic=time()
+        valid_data=edit_data_by_subset_fit(args['N_subset'], args)
+        timing['edit_by_subset']=time()-tic
+        if args['Edit_only']:
+            return {'timing':timing, 'data':args['data'].copy().subset(valid_data)}
+    m=dict()
+    E=dict()
+
+    # define the grids, the data, and the equations
+    fit=assemble_fit(args, valid_data, timing)
+    grids=fit['grids']
+    data=fit['data']
+    valid_data=fit['valid_data']
+    G_data=fit['G_data']
+    Gc=fit['Gc']
+    Ip_c=fit['Ip_c']
+    Gcoo=fit['Gcoo']
+    rhs=fit['rhs']
+    bias_model=fit['bias_model']
+
+    # put together all the errors
+    Ec=calc_Ec(fit, args['E_RMS'])
+
+    if np.any(data.z>2500):
+        print('outlier!')
+    if args['robust'] is None:
+        m0, inTSE, rs_data, sigma_hat, Ip_r, TCinv=iterate_fit(fit, Ec, args['max_iterations'], timing, VERBOSE=args['VERBOSE'])
+    else:
+        m0, inTSE, rs_data, sigma_hat, Ip_r, TCinv=iterate_robust_fit(fit, Ec, args['max_iterations'], timing, args['robust'], VERBOSE=args['VERBOSE'])
+        data.assign({'robust_weight':fit['robust_weights']})
+
     valid_data[valid_data]=(np.abs(rs_data)<3.0*np.maximum(1, sigma_hat))
     data.assign({'three_sigma_edit':np.abs(rs_data)<3.0*np.maximum(1, sigma_hat)})
     # report the model-based estimate of the data points
-    data.assign({'z_est':np.reshape(G_data.toCSR().dot(m0), data.shape)})
+    data.assign({'z_est':np.reshape(data_model(fit, m0), data.shape)})
     
-
     # reshape the components of m to the grid shapes
     m['z0']=np.reshape(m0[Gc.TOC['cols']['z0']], grids['z0'].shape)
     m['dz']=np.reshape(m0[Gc.TOC['cols']['dz']], grids['dz'].shape)
+    if args['active_nodes']:
+        for key in ('z0','dz'):
+            m[key][~grids[key].active]=np.nan
 
     # calculate height rates
     for lag in args['dzdt_lags']:
         this_name='dzdt_lag%d' % lag
         m[this_name]=lin_op(grids['dz'], name='dzdt', col_N=G_data.col_N).dzdt(lag=lag).grid_prod(m0)
+        if args['active_nodes']:
+            # the inactive nodes are zero in m0, so their rates would be zero, rather than unknown
+            m[this_name][~grids['dz'].active]=np.nan
     
     # build a matrix that takes the average of the central 20 km of the delta-z grid
-    XR=np.mean(grids['z0'].bds[0])+np.array([-1., 1.])*args['W_ctr']/2.
-    YR=np.mean(grids['z0'].bds[1])+np.array([-1., 1.])*args['W_ctr']/2.
-    center_dzbar=lin_op(grids['dz'], name='center_dzbar', col_N=G_data.col_N).vstack([lin_op(grids['dz']).mean_of_bounds((XR, YR, [season, season] )) for season in grids['dz'].ctrs[2]])
-    G_dzbar=center_dzbar.toCSR()
+    # the matrix depends only on the grid geometry, so it is kept with the fit structure
+    G_dzbar_key=(args['W_ctr'], G_data.col_N)
+    if 'G_dzbar' not in fit['structure']:
+        fit['structure']['G_dzbar']=dict()
+    if G_dzbar_key not in fit['structure']['G_dzbar']:
+        fit['structure']['G_dzbar'][G_dzbar_key]=center_dzbar_matrix(grids, args['W_ctr'], G_data.col_N)
+    G_dzbar=fit['structure']['G_dzbar'][G_dzbar_key]
     # calculate the grid mean of dz
     m['dz_bar']=G_dzbar.dot(m0)
 
+    # calculate the mean of dz for each region, if regions are specified
+    G_dzbar_regions=None
+    if args['regions'] is not None or args['region_polygons'] is not None:
+        regions=args['regions']
+        if args['region_polygons'] is not None:
+            regions=[grids['dz'].mask_for_polygon(xy) for xy in args['region_polygons']]
+        region_op=lin_op(grids['dz'], name='dz_bar_regions', col_N=G_data.col_N).mean_of_regions(regions)
+        G_dzbar_regions=region_op.toCSR(row_N=region_op.N_eq)
+        m['region_ids']=region_op.region_ids
+        m['dz_bar_regions']=G_dzbar_regions.dot(m0).reshape([len(region_op.region_ids), grids['dz'].shape[2]])
+        # regions that contain no (active) nodes have no mean
+        empty_regions=(region_op.region_count==0).reshape(m['dz_bar_regions'].shape)
+        m['dz_bar_regions'][empty_regions]=np.nan
+
     # build a matrix that takes the lagged temporal derivative of dzbar (e.g. quarterly dzdt, annual dzdt)
     for lag in args['dzdt_lags']:
         this_name='dzdt_bar_lag%d' % lag
@@ -392,18 +908,7 @@ def smooth_xyt_fit(**kwargs):
     m['extent']=np.concatenate((grids['z0'].bds[1], grids['z0'].bds[0]))
     
     # parse the resduals to assess the contributions of the total error:
-    # Make the C matrix for the constraints
-    TCinv_cov=sp.dia_matrix((1./Ec, 0), shape=(Gc.N_eq, Gc.N_eq))
-    rc=TCinv_cov.dot(Gc.toCSR().dot(m0))
-    ru=Gc.toCSR().dot(m0)
-    R=dict()
-    RMS=dict()
-    for eq_type in ['d2z_dt2','grad2_z0','grad2_dzdt']:
-        if eq_type in Gc.TOC['rows']:
-            R[eq_type]=np.sum(rc[Gc.TOC['rows'][eq_type]]**2)
-            RMS[eq_type]=np.sqrt(np.mean(ru[Gc.TOC['rows'][eq_type]]**2))
-    R['data']=np.sum(((data.z_est-data.z)/data.sigma)**2)
-    RMS['data']=np.sqrt(np.mean((data.z_est-data.z)**2))
+    R, RMS=calc_misfit(fit, m0, Ec, z_est=data.z_est)
 
     # if we need to compute the errors in the solution, continue
     if args['compute_E']:
@@ -425,18 +930,23 @@ def smooth_xyt_fit(**kwargs):
         tic=time(); RR, CC, VV, status=inv_tr_upper(R, np.int(np.prod(R.shape)/4), 1.e-5);
         # save Rinv as a sparse array.  The syntax perm[RR] undoes the permutation from QZ
         Rinv=sp.coo_matrix((VV, (perm[RR], CC)), shape=R.shape).tocsr(); timing['Rinv_cython']=time()-tic;
-        tic=time(); E0=np.sqrt(Rinv.power(2).sum(axis=1)); timing['propagate_errors']=time()-tic;
-
-        # generate the full E vector.  E0 appears to be an ndarray,
-        E0=np.array(Ip_c.dot(E0)).ravel()
+        # generate the full E vector.  Ip_c may interpolate between columns (on variable-resolution grids),
+        # so the errors are propagated through it
+        tic=time(); E0=np.sqrt(Ip_c.dot(Rinv).power(2).sum(axis=1)); timing['propagate_errors']=time()-tic;
+        E0=np.array(E0).ravel()
         E['z0']=np.reshape(E0[Gc.TOC['cols']['z0']], grids['z0'].shape)
         E['dz']=np.reshape(E0[Gc.TOC['cols']['dz']], grids['dz'].shape)
+        if args['active_nodes']:
+            for key in ('z0','dz'):
+                E[key][~grids[key].active]=np.nan
 
         # generate the lagged dz errors:
  
         for lag in args['dzdt_lags']:
             this_name='dzdt_lag%d' % lag
             E[this_name]=lin_op(grids['dz'], name=this_name, col_N=G_data.col_N).dzdt(lag=lag).grid_error(Ip_c.dot(Rinv))
+            if args['active_nodes']:
+                E[this_name][~grids['dz'].active]=np.nan
                       
             this_name='dzdt_bar_lag%d' % lag
             this_op=lin_op(grids['t'], name=this_name).diff(lag=lag).toCSR()
@@ -451,6 +961,9 @@ def smooth_xyt_fit(**kwargs):
 
         # generate the grid-mean error
         E['dz_bar']=np.sqrt((G_dzbar.dot(Ip_c).dot(Rinv)).power(2).sum(axis=1))
+        if G_dzbar_regions is not None:
+            E['dz_bar_regions']=np.asarray(np.sqrt((G_dzbar_regions.dot(Ip_c).dot(Rinv)).power(2).sum(axis=1))).reshape(m['dz_bar_regions'].shape)
+            E['dz_bar_regions'][empty_regions]=np.nan
 
         # generate the grid-mean quarterly dzdt error
         #E['dzdt_bar_qyr']=np.sqrt((ddt_qyr.dot(G_dzbar).dot(Ip_c).dot(Rinv)).power(2).sum(axis=1))
@@ -464,7 +977,10 @@ def smooth_xyt_fit(**kwargs):
 
 
     TOC=Gc.TOC
-    return {'m':m, 'E':E, 'data':data, 'grids':grids, 'valid_data': valid_data, 'TOC':TOC,'R':R, 'RMS':RMS, 'timing':timing,'E_RMS':args['E_RMS']}
+    S={'m':m, 'E':E, 'data':data, 'grids':grids, 'valid_data': valid_data, 'TOC':TOC,'R':R, 'RMS':RMS, 'timing':timing,'E_RMS':args['E_RMS']}
+    if fit['super_obs'] is not None:
+        S['super_obs']=fit['super_obs'].data
+    return S
 
 
 
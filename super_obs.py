@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 01:14:47 2026
+"""
+import numpy as np
+from LSsurf.column_data import column_data
+from LSsurf.unique_by_rows import unique_by_rows
+from LSsurf.predict_xyt import interp_grid
+
+class super_obs(object):
+    # a super_obs object combines the data that fall in the same sub-cell of
+    # a dz grid (the grid cell divided N_sub times in x and y, and N_sub_t
+    # times in time) into one weighted-mean observation.  Data are only
+    # combined if they also agree in every one of group_fields (e.g. the
+    # bias ID).  The location, height, and other fields of each super-
+    # observation are the means of those of its members, weighted by
+    # 1/sigma**2, and its sigma is the propagated error of the weighted mean.
+    # The member attribute maps each data point to its super-observation, so
+    # that the super-observations can be recombined from a subset of their
+    # members (see combine) when individual points are edited.
+    def __init__(self, data, grid, N_sub=4, N_sub_t=1, group_fields=None):
+        self.points=data
+        self.grid=grid
+        if group_fields is None:
+            group_fields=list()
+        self.group_fields=list(group_fields)
+        # sub-cell indices in y, x, and t
+        sub_delta=grid.delta/np.array([N_sub, N_sub, N_sub_t])
+        bins=[np.floor((coord-bd[0])/delta) for coord, bd, delta in zip(data.coords(), grid.bds, sub_delta)]
+        bins += [getattr(data, field) for field in self.group_fields]
+        u_bins, self.member=unique_by_rows(np.c_[tuple(bins)], return_inverse=True)
+        self.member=self.member.ravel()
+        self.N=u_bins.shape[0]
+        self.w=1./data.sigma**2
+        self.sum_w=np.bincount(self.member, weights=self.w, minlength=self.N)
+        fields=dict()
+        for field in data.list_of_fields:
+            if field in self.group_fields:
+                # the group fields are the same for all the members
+                fields[field]=np.zeros(self.N, dtype=getattr(data, field).dtype)
+                fields[field][self.member]=getattr(data, field)
+            elif field != 'sigma':
+                fields[field]=self._mean(getattr(data, field))
+        fields['sigma']=np.sqrt(1./self.sum_w)
+        fields['N_members']=np.bincount(self.member, minlength=self.N)
+        self.data=column_data(fields, coord_fields=('y','x','time'))
+
+    def _mean(self, val):
+        return np.bincount(self.member, weights=self.w*val, minlength=self.N)/self.sum_w
+
+    def combine(self, selected):
+        """
+            Recombine the heights and errors of the super-observations from a subset of their members
+
+            The locations of the super-observations are not changed, so the
+            interpolation matrix built for them remains valid.  If selected
+            is an array of weights, each member's 1/sigma**2 weight is
+            multiplied by its weight.
+
+            input arguments:
+                selected: boolean array, true for the data points that are used, or array of weights for the data points
+            output arguments:
+                z: weighted mean height of the selected members (zero for super-observations with no selected members)
+                sigma: propagated error of z (one for super-observations with no selected members)
+                used: boolean array, true for super-observations that have selected members
+        """
+        sum_w=np.bincount(self.member, weights=self.w*selected, minlength=self.N)
+        used=sum_w > 0
+        z=np.zeros(self.N)
+        sigma=np.ones(self.N)
+        z[used]=np.bincount(self.member, weights=self.w*selected*self.points.z, minlength=self.N)[used]/sum_w[used]
+        sigma[used]=np.sqrt(1./sum_w[used])
+        return z, sigma, used
+
+    def point_model(self, m0, z_est, grids, cols):
+        """
+            Evaluate a model at the member points
+
+            The model at each point is the model at its super-observation plus
+            the difference between the interpolated z0 and dz surfaces at the
+            point and at the super-observation, so that terms that are the
+            same for all members (e.g. biases) are included.
+
+            input arguments:
+                m0: model vector
+                z_est: the model at the super-observations (G_data times m0)
+                grids: dict of the z0 and dz fd_grids
+                cols: dict giving the columns of m0 for z0 and dz (the 'cols' entry of a TOC)
+            output arguments:
+                z_pts: the model at the member points
+        """
+        z0=np.reshape(m0[cols['z0']], grids['z0'].shape)
+        dz=np.reshape(m0[cols['dz']], grids['dz'].shape)
+        pts=self.points.coords()
+        obs=self.data.coords()
+        d_surf=interp_grid(grids['z0'], z0, pts[0:2])+interp_grid(grids['dz'], dz, pts)
+        d_surf -= (interp_grid(grids['z0'], z0, obs[0:2])+interp_grid(grids['dz'], dz, obs))[self.member]
+        return z_est[self.member]+d_surf
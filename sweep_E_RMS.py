@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:12:40 2026
+"""
+import numpy as np
+import multiprocessing
+from time import time
+from LSsurf.lin_op import lin_op
+from LSsurf.smooth_xyt_fit import smooth_xyt_fit_args, edit_data_by_subset_fit, assemble_fit, calc_Ec, iterate_fit, iterate_robust_fit, calc_misfit
+
+# the assembled fit shared by the worker processes, set by _init_sweep_worker
+_sweep_state=dict()
+
+def _init_sweep_worker(fit, args, G_val):
+    _sweep_state.update({'fit':fit, 'args':args, 'G_val':G_val})
+
+def _sweep_worker(E_RMS):
+    return solve_one_setting(_sweep_state['fit'], E_RMS, _sweep_state['args'], G_val=_sweep_state['G_val'])
+
+def solve_one_setting(fit, E_RMS, args, G_val=None):
+    """
+        Solve an assembled fit for one set of E_RMS values and summarize the misfit
+
+        The data are edited (or, if args['robust'] is specified, weighted) as
+        in smooth_xyt_fit.
+
+        input arguments:
+            fit: assembled fit dict from assemble_fit
+            E_RMS: dict of expected RMS values for the smoothness constraints
+            args: fit arguments (see smooth_xyt_fit)
+            G_val: optional CSR matrix that interpolates the model to a set of validation data
+        output arguments:
+            result: dict with entries 'E_RMS', 'R', 'RMS', 'N_data', 'sigma_hat', 'timing', and 'm_all' (if args['return_models'] is true)
+    """
+    timing=dict()
+    Ec=calc_Ec(fit, E_RMS)
+    if args['robust'] is None:
+        m0, inTSE, rs_data, sigma_hat, Ip_r, TCinv=iterate_fit(fit, Ec, args['max_iterations'], timing, VERBOSE=args['VERBOSE'])
+    else:
+        m0, inTSE, rs_data, sigma_hat, Ip_r, TCinv=iterate_robust_fit(fit, Ec, args['max_iterations'], timing, args['robust'], VERBOSE=args['VERBOSE'])
+    R, RMS=calc_misfit(fit, m0, Ec)
+    if G_val is not None:
+        r_val=args['validation_data'].z-G_val.dot(m0)
+        R['validation']=np.sum((r_val/args['validation_data'].sigma)**2)
+        RMS['validation']=np.sqrt(np.mean(r_val**2))
+    result={'E_RMS':E_RMS, 'R':R, 'RMS':RMS, 'N_data':np.sum(np.abs(rs_data)<3.0*np.maximum(1, sigma_hat)),\
+            'sigma_hat':sigma_hat, 'timing':timing}
+    if args['return_models']:
+        result['m_all']=m0
+    return result
+
+def sweep_E_RMS(E_RMS_list, N_workers=1, **kwargs):
+    """
+        Fit a dataset for a list of smoothness-constraint settings
+
+        The grids, data selection, interpolation and constraint matrices and
+        the column map are built once (using the first entry in E_RMS_list),
+        and each setting re-solves the same system with only the constraint
+        weights changed.  All settings must agree on whether the d2z_dt2
+        constraint is used, because it changes the structure of the system.
+        With solver='nd_normal', the nested-dissection ordering is also
+        calculated once and reused for every setting;  with the default QR
+        solver, SPQR chooses its own ordering for each solution.
+
+        input arguments:
+            E_RMS_list: list of E_RMS dicts (see smooth_xyt_fit)
+            N_workers: number of processes used to solve the settings. If 1, the settings are solved in series
+            keywords: any keyword accepted by smooth_xyt_fit (E_RMS is taken from E_RMS_list), plus:
+                validation_data: optional pointdata instance, not used in the fit, for which the misfit is reported
+                return_models: if True, the model vector for each setting is returned
+        output arguments:
+            results: list of dicts (one for each entry in E_RMS_list) containing the misfit summaries from solve_one_setting
+            fit: the assembled fit shared by the settings
+    """
+    kwargs['E_RMS']=E_RMS_list[0]
+    args=smooth_xyt_fit_args(**kwargs)
+    args.update({'validation_data':kwargs.get('validation_data', None),
+                 'return_models':kwargs.get('return_models', False)})
+    has_d2z_dt2=[E_RMS.get('d2z_dt2', None) is not None for E_RMS in E_RMS_list]
+    if np.any(has_d2z_dt2) and not np.all(has_d2z_dt2):
+        raise ValueError("d2z_dt2 must be specified for all E_RMS settings or for none of them")
+
+    timing=dict()
+    valid_data=np.ones_like(args['data'].x, dtype=bool)
+    if args['N_subset'] is not None:
+        tic=time()
+        valid_data=edit_data_by_subset_fit(args['N_subset'], args)
+        timing['edit_by_subset']=time()-tic
+    fit=assemble_fit(args, valid_data, timing)
+
+    # build the validation interpolation matrix once
+    G_val=None
+    if args['validation_data'] is not None:
+        D_val=args['validation_data']
+        good=fit['grids']['dz'].validate_pts(D_val.coords())
+        args['validation_data']=D_val.copy().subset(good)
+        G_val=lin_op(fit['grids']['z0'], name='interp_z').interp_mtx(args['validation_data'].coords()[0:2])
+        G_val.add(lin_op(fit['grids']['dz'], name='interp_dz').interp_mtx(args['validation_data'].coords()))
+        G_val=G_val.toCSR(col_N=fit['G_data'].col_N)
+
+    tic=time()
+    if N_workers > 1:
+        with multiprocessing.Pool(N_workers, initializer=_init_sweep_worker, initargs=(fit, args, G_val)) as pool:
+            results=pool.map(_sweep_worker, E_RMS_list)
+    else:
+        results=[solve_one_setting(fit, E_RMS, args, G_val=G_val) for E_RMS in E_RMS_list]
+    timing['sweep']=time()-tic
+    fit['timing']=timing
+    return results, fit
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:41:08 2026
+"""
+import numpy as np
+import pytest
+from LSsurf.column_data import column_data
+
+def test_fields_are_read_only_with_and_without_subset():
+    full=column_data({'x':np.arange(5.), 'z':np.arange(5.)})
+    sub=full.copy().subset([1, 2, 3])
+    for D in (full, sub):
+        with pytest.raises(ValueError):
+            D.z[0]=99
+
+def test_assigned_fields_survive_subset():
+    full=column_data({'x':np.arange(5.), 'z':np.arange(5.)})
+    sub=full.copy().subset([1, 2, 3])
+    sub.z=sub.z+1
+    sub.subset([0, 1])
+    assert np.all(sub.z==[2., 3.])
+    assert np.all(full.z==np.arange(5.))
+
+def test_assigned_fields_are_read_only_in_copies():
+    a=column_data({'x':np.arange(5.)})
+    a.assign({'f':np.ones(5)})
+    b=a.copy()
+    for D in (a, b, b.copy().subset([0, 1])):
+        with pytest.raises(ValueError):
+            D.f[:]=0
+    b.f=np.zeros(5)
+    assert np.all(a.f==1)
+    assert np.all(b.f==0)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 17:58:03 2026
+"""
+import numpy as np
+import scipy.sparse as sp
+import sparseqr
+from LSsurf.smooth_xyt_fit import smooth_xyt_fit_args, assemble_fit, calc_Ec
+from LSsurf.grid_ordering import grid_nested_dissection, solve_ordered
+from test_mixed_precision import synthetic_tile
+
+# tolerance for the relative difference between the normal-equations and QR solutions
+SOLVE_TOL=1.e-6
+
+def weighted_system(shift=(0., 0.)):
+    # the weighted design matrix and right-hand side for a small tile (moved by shift), and the fit
+    tile=synthetic_tile(N=2000, W=2.e4)
+    tile['data'].assign({'x':tile['data'].x+shift[0], 'y':tile['data'].y+shift[1]})
+    tile['ctr'].update({'x':shift[0], 'y':shift[1]})
+    args=smooth_xyt_fit_args(solver='nd_normal', **tile)
+    fit=assemble_fit(args, np.ones(args['data'].size, dtype=bool), dict())
+    Ec=calc_Ec(fit, args['E_RMS'])
+    TCinv=sp.dia_matrix((1./np.concatenate((fit['Ed'], Ec)), 0), shape=(fit['N_eq'], fit['N_eq']))
+    return TCinv.dot(fit['Gcoo']).tocsc(), TCinv.dot(fit['rhs']), fit
+
+def test_solve_ordered_matches_qr():
+    A, b, fit=weighted_system()
+    x_qr=sparseqr.solve(A, b)
+    x_nd=solve_ordered(A, b, fit['ordering'])
+    assert np.linalg.norm(x_nd-x_qr) < SOLVE_TOL*np.linalg.norm(x_qr)
+
+def test_ordering_reused_for_shifted_grids():
+    A, b, fit=weighted_system()
+    A1, b1, fit1=weighted_system(shift=(5.e4, -3.e4))
+    perm=grid_nested_dissection(fit['grids'])
+    assert grid_nested_dissection(fit1['grids']) is perm
+    assert np.all(np.sort(perm)==np.arange(perm.size))
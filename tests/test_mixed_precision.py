@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:05:21 2026
+"""
+import numpy as np
+from LSsurf.column_data import column_data
+from LSsurf.smooth_xyt_fit import smooth_xyt_fit, smooth_xyt_fit_args, assemble_fit
+
+# tolerance for the difference between the mixed- and double-precision dz fields, in meters
+DZ_TOL=1.e-5
+
+def synthetic_tile(N=5000, W=4.e4, seed=0):
+    # a tile with a planar surface, a thinning signal at its center, and 2% gross outliers
+    rng=np.random.default_rng(seed)
+    x=(rng.random(N)-0.5)*W
+    y=(rng.random(N)-0.5)*W
+    t=2003+6*rng.random(N)
+    z=100+1.e-3*x+2.e-3*y-0.5*(t-2006)*np.exp(-(x**2+y**2)/1.e8)+rng.normal(0, 0.1, N)
+    z[:N//50] += 20
+    data=column_data({'x':x, 'y':y, 'z':z, 'time':t, 'sigma':0.1+np.zeros(N)})
+    return {'data':data, 'W':{'x':W, 'y':W, 't':6}, 'ctr':{'x':0., 'y':0., 't':2006.}, \
+            'spacing':{'z0':2.e3, 'dz':4.e3, 'dt':1}, \
+            'E_RMS':{'d2z0_dx2':200/3000/3000, 'd3z_dx2dt':10/3000/3000, 'd2z_dxdt':100/3000, 'd2z_dt2':None}, \
+            'VERBOSE':False, 'dzdt_lags':[1]}
+
+def _fit_bytes(precision):
+    # bytes used by the G_data triplets and by the assembled matrix
+    args=smooth_xyt_fit_args(precision=precision, **synthetic_tile())
+    fit=assemble_fit(args, np.ones(args['data'].size, dtype=bool), dict())
+    G=fit['G_data']
+    return G.v.nbytes+G.r.nbytes+G.c.nbytes, fit['Gcoo'].data.nbytes
+
+def test_mixed_precision_dz():
+    S_double=smooth_xyt_fit(precision='double', **synthetic_tile())
+    S_mixed=smooth_xyt_fit(precision='mixed', **synthetic_tile())
+    assert np.max(np.abs(S_mixed['m']['dz']-S_double['m']['dz'])) < DZ_TOL
+    assert np.max(np.abs(S_mixed['m']['z0']-S_double['m']['z0'])) < DZ_TOL
+
+def test_mixed_precision_memory():
+    triplets_double, G_double=_fit_bytes('double')
+    triplets_mixed, G_mixed=_fit_bytes('mixed')
+    assert triplets_mixed <= 0.5*triplets_double
+    assert G_mixed <= 0.5*G_double
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 17:20:44 2026
+"""
+import numpy as np
+import pytest
+from LSsurf.smooth_xyt_fit import smooth_xyt_fit
+from test_mixed_precision import synthetic_tile
+
+# the outliers in synthetic_tile are its first N//50 points
+OUTLIERS=np.arange(100)
+# tolerance for the difference between the robust (M-estimate) and edited dz fields, in meters
+ROBUST_DZ_TOL=0.25
+# tolerance for the difference between the three-sigma-finished and edited dz fields, in meters.
+# This is the change in dz at which iterate_fit stops
+EDIT_DZ_TOL=0.05
+
+@pytest.fixture(scope='module')
+def edited():
+    return smooth_xyt_fit(**synthetic_tile())
+
+@pytest.fixture(scope='module')
+def robust():
+    return smooth_xyt_fit(robust={}, **synthetic_tile())
+
+def test_robust_fit_converges(edited, robust):
+    assert robust['timing']['N_solves'] < edited['timing']['N_solves']
+    assert np.all(robust['data'].robust_weight[OUTLIERS]==0)
+    assert not np.any(robust['data'].three_sigma_edit[OUTLIERS])
+    assert np.max(np.abs(robust['m']['dz']-edited['m']['dz'])) < ROBUST_DZ_TOL
+
+def test_robust_warm_start(edited, robust):
+    S=smooth_xyt_fit(robust={'m0':robust['m']['all']}, **synthetic_tile())
+    assert S['timing']['N_solves'] < robust['timing']['N_solves']
+    assert np.all(S['data'].robust_weight[OUTLIERS]==0)
+    assert np.max(np.abs(S['m']['dz']-edited['m']['dz'])) < ROBUST_DZ_TOL
+
+def test_robust_three_sigma_finish(edited, robust):
+    S=smooth_xyt_fit(robust={'three_sigma':True}, **synthetic_tile())
+    assert np.max(np.abs(S['m']['dz']-edited['m']['dz'])) < EDIT_DZ_TOL
+    assert not np.any(S['data'].three_sigma_edit[OUTLIERS])
+    # the weighted solutions are counted with those of the editing
+    assert S['timing']['N_solves'] > robust['timing']['N_solves']
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:31:26 2026
+"""
+import os
+from LSsurf.thread_budget import worker_threads, THREAD_ENV_VARS
+
+def _thread_env(ii):
+    return [os.environ.get(var, None) for var in THREAD_ENV_VARS]
+
+def test_worker_threads_environment():
+    before=[os.environ.get(var, None) for var in THREAD_ENV_VARS]
+    with worker_threads(2) as context, context.Pool(2) as pool:
+        worker_env=pool.map(_thread_env, range(2))
+    assert all(env==['2']*len(THREAD_ENV_VARS) for env in worker_env)
+    assert [os.environ.get(var, None) for var in THREAD_ENV_VARS]==before
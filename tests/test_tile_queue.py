@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:48:12 2026
+"""
+import numpy as np
+import os
+import multiprocessing
+from collections import Counter
+from time import sleep
+from LSsurf.tile_queue import tile_queue, lease_keeper
+
+LEASE_TIME=0.5
+
+def _queue_worker(args):
+    # claim tiles until none are left.  Some claims are abandoned (as by a worker that dies), some
+    # stall for longer than the lease time before failing the tile (as by a worker that hangs), and
+    # the rest are completed while the lease is renewed.  Returns the tiles this worker completed
+    # while it held their leases
+    queue_dir, seed=args
+    rng=np.random.default_rng(seed)
+    queue=tile_queue(queue_dir, lease_time=LEASE_TIME, max_attempts=100)
+    completed=list()
+    while True:
+        lease=queue.claim(worker_id=str(seed), start=int(rng.integers(len(queue.tile_names()))))
+        if lease is None:
+            if queue.status()['leased'] > 0:
+                sleep(LEASE_TIME/10)
+                continue
+            break
+        fate=rng.random()
+        if fate < 0.2:
+            continue
+        if fate < 0.35:
+            sleep(1.5*LEASE_TIME)
+            queue.fail(lease, 'stalled')
+            continue
+        with lease_keeper(queue, lease) as keeper:
+            sleep(LEASE_TIME*rng.random()/2)
+        if keeper.lost:
+            # another worker has taken the tile over (or will)
+            queue.release(lease)
+            continue
+        completed.append(lease['name'])
+        queue.complete(lease, None)
+    return completed
+
+def test_each_tile_completed_once(tmp_path):
+    queue_dir=str(tmp_path)
+    names=tile_queue(queue_dir, lease_time=LEASE_TIME).add_tiles([{'x':x, 'y':0., 't':0.} for x in 1000.*np.arange(12)])
+    with multiprocessing.get_context('fork').Pool(4) as pool:
+        completed=pool.map(_queue_worker, [(queue_dir, seed) for seed in range(4)], chunksize=1)
+    counts=Counter([name for worker in completed for name in worker])
+    assert sorted(counts.keys())==sorted(names)
+    assert all(count==1 for count in counts.values())
+    assert tile_queue(queue_dir, lease_time=LEASE_TIME).status()['done']==len(names)
+
+def _expire(queue, name):
+    # age a tile's lease past the lease time
+    lease_file=queue._path('leases', name)
+    old=os.stat(lease_file).st_mtime-2*queue.lease_time
+    os.utime(lease_file, (old, old))
+
+def test_late_release_keeps_new_lease(tmp_path):
+    queue=tile_queue(str(tmp_path), lease_time=LEASE_TIME)
+    queue.add_tiles([{'x':0., 'y':0., 't':0.}])
+    stalled=queue.claim(worker_id='stalled')
+    _expire(queue, stalled['name'])
+    current=queue.claim(worker_id='current')
+    assert current is not None and queue.attempts(current['name'])==1
+    # the stalled worker gives up on the tile after it has been taken over
+    queue.fail(stalled, 'stalled')
+    assert queue.holds(current)
+    assert queue.attempts(current['name'])==1
+    assert not queue.release(stalled)
+    assert queue.release(current)
+
+def test_break_lock(tmp_path):
+    queue=tile_queue(str(tmp_path), lease_time=LEASE_TIME)
+    queue.add_tiles([{'x':0., 'y':0., 't':0.}])
+    lease=queue.claim(worker_id='dead')
+    _expire(queue, lease['name'])
+    break_file=queue._path('leases', lease['name'])+'.break'
+    # a break lock held by a live worker blocks the break
+    with open(break_file,'w') as fh:
+        fh.write('{"token":"live"}')
+    assert queue.claim(worker_id='new') is None
+    # a break lock left by a worker that died does not
+    old=os.stat(break_file).st_mtime-2*LEASE_TIME
+    os.utime(break_file, (old, old))
+    assert queue.claim(worker_id='new') is not None
+    assert not os.path.isfile(break_file)
+    assert queue.attempts(lease['name'])==1
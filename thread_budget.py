@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 11:20:34 2026
+"""
+import numpy as np
+import os
+import multiprocessing
+from contextlib import contextmanager
+
+# environment variables read by the native thread pools (OpenMP, used by SuiteSparseQR, and the BLAS libraries)
+THREAD_ENV_VARS=('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# the thread-pool limiter for this process, kept so that the limits stay in place
+_limits=dict()
+
+def available_cores():
+    # the number of cores this process may run on
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+def split_cores(N_cores, N_tiles, N_cols, cols_per_thread=2.e4):
+    """
+        Split a number of cores between worker processes and the native threads of each solve
+
+        A sparse QR factorization only uses extra threads efficiently when
+        the system is large, so each solve is given one thread for every
+        cols_per_thread columns (rounded down to a power of two), and the
+        remaining cores are used for more worker processes.  If there are
+        fewer tiles than workers, the spare cores are given to the solves.
+
+        input arguments:
+            N_cores: the number of cores available
+            N_tiles: the number of tiles to be fit
+            N_cols: the number of columns in each tile's fit (e.g. from fit_plan.plan_fit)
+            cols_per_thread: the number of columns per solver thread
+        output arguments:
+            N_workers: the number of worker processes
+            N_threads: the number of native threads for each worker
+    """
+    N_threads=int(2**np.floor(np.log2(np.maximum(N_cols/cols_per_thread, 1))))
+    N_threads=int(np.clip(N_threads, 1, N_cores))
+    N_workers=int(np.maximum(1, np.minimum(N_cores//N_threads, N_tiles)))
+    N_threads=int(np.maximum(N_threads, N_cores//N_workers))
+    return N_workers, N_threads
+
+@contextmanager
+def worker_threads(N_threads):
+    """
+        Start worker processes whose native thread pools are limited
+
+        The native libraries read their thread limits from the environment
+        when they are loaded, which, in a process forked from this one, has
+        already happened.  Within this context, the environment variables are
+        set to N_threads, and the multiprocessing context returned starts
+        workers with the 'spawn' method, so that each worker loads the
+        libraries with the limits in place.  This does not need threadpoolctl.
+        The pools must be used (and closed) within the context, and the
+        functions and arguments given to them must be picklable.  The
+        environment of this process is restored on exit.
+
+        input arguments:
+            N_threads: the maximum number of threads for each thread pool in each worker
+        output arguments:
+            context: a multiprocessing context, whose Pool method starts the workers
+    """
+    saved={var:os.environ.get(var, None) for var in THREAD_ENV_VARS}
+    for var in THREAD_ENV_VARS:
+        os.environ[var]=str(int(N_threads))
+    try:
+        yield multiprocessing.get_context('spawn')
+    finally:
+        for var, val in saved.items():
+            if val is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var]=val
+
+def limit_threads(N_threads):
+    """
+        Limit the number of native threads used by this process
+
+        The environment variables are set for libraries that are loaded (or
+        processes that are started) later.  Thread pools that are already
+        loaded (as they are once numpy has been imported) can only be limited
+        through threadpoolctl, which is optional:  without it, this has no
+        effect on them, and the limits should be set before the process
+        starts (see worker_threads).
+
+        input arguments:
+            N_threads: the maximum number of threads for each thread pool
+        output arguments:
+            limited: True if the loaded thread pools were limited, False if only the environment was set
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var]=str(int(N_threads))
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return False
+    _limits['limiter']=threadpool_limits(limits=int(N_threads))
+    return True
+
+def utilization(results, t_wall, N_cores):
+    """
+        Calculate the fraction of the available core time used by a set of fits
+
+        input arguments:
+            results: list of smooth_xyt_fit output dicts (None entries are skipped), whose timing includes 'tile_cpu'
+            t_wall: the wall-clock time for the whole set of fits
+            N_cores: the number of cores available
+        output arguments:
+            fraction: total CPU time of the fits divided by t_wall*N_cores
+    """
+    t_cpu=np.sum([S['timing']['tile_cpu'] for S in results if S is not None])
+    return t_cpu/(t_wall*N_cores)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:48:12 2026
+"""
+import numpy as np
+
+def RDE_select(x):
+    """
+    Robust dispersion estimate, calculated by selection instead of sorting
+
+    Gives the same result as RDE:  half the distance between the 16th and
+    84th percentiles of the finite values of x, where the k-th sorted value
+    is taken to lie at position k+0.5.  Only the four order statistics that
+    bracket the two percentiles are found (with np.partition), so the cost
+    is O(n) instead of O(n log n).
+    """
+    x=np.asarray(x)
+    xs=x[np.isfinite(x)]
+    N=xs.size
+    if N<2:
+        return np.nan
+    pos=np.array([0.16, 0.84])*N
+    # the sorted values on either side of each percentile
+    k=np.minimum(np.maximum(np.floor(pos-0.5).astype(int), 0), N-2)
+    kth=np.unique(np.concatenate([k, k+1]))
+    xp=np.partition(xs, kth)
+    # interpolating between the same pair of points as RDE's np.interp gives identical values
+    LH=[np.interp(p, [kk+0.5, kk+1.5], [xp[kk], xp[kk+1]]) for p, kk in zip(pos, k)]
+    return (LH[1]-LH[0])/2.
+
+class three_sigma_editor(object):
+    # a three_sigma_editor keeps track of which data are within three times
+    # the robust spread of the scaled residuals as a boolean mask, and
+    # reports which rows changed state in the last update.  The spread is
+    # calculated from the data that were selected before the update, and is
+    # not allowed to fall below 1.
+    def __init__(self, N, selected=None):
+        if selected is None:
+            self.selected=np.ones(N, dtype=bool)
+        else:
+            self.selected=np.asarray(selected, dtype=bool).copy()
+        self.last_selected=self.selected
+        self.changed=np.zeros(0, dtype=int)
+        self.sigma_hat=np.nan
+
+    def update(self, rs):
+        # update the selection based on a new set of scaled residuals, return the robust spread
+        self.sigma_hat=RDE_select(rs[self.selected])
+        self.last_selected=self.selected
+        self.selected=np.abs(rs)<3.0*np.maximum(1, self.sigma_hat)
+        self.changed=np.flatnonzero(self.selected != self.last_selected)
+        return self.sigma_hat
+
+    @property
+    def N_selected(self):
+        return np.count_nonzero(self.selected)
+
+    @property
+    def converged(self):
+        # true if the last update did not change the selection
+        return self.changed.size==0
+
+    def rows(self, last=False):
+        # return the indices of the selected rows (or of the rows selected before the last update)
+        if last:
+            return np.flatnonzero(self.last_selected)
+        return np.flatnonzero(self.selected)
+
+# default tuning constants for the robust weights, in units of the robust spread (95% efficiency for normal errors)
+ROBUST_C={'huber':1.345, 'tukey':4.685}
+
+def robust_rho(u, kind='huber', c=None):
+    """
+    Robust loss for normalized residuals u, equal to u**2/2 for small u
+    """
+    if c is None:
+        c=ROBUST_C[kind]
+    au=np.abs(u)
+    if kind=='huber':
+        return np.where(au <= c, 0.5*u**2, c*au-0.5*c**2)
+    elif kind=='tukey':
+        return np.where(au <= c, c**2/6.*(1-(1-(u/c)**2)**3), c**2/6.)
+    raise ValueError("unknown robust weight: %s" % kind)
+
+def robust_weights(u, kind='huber', c=None):
+    """
+    IRLS weights (psi(u)/u) for normalized residuals u:  one for small
+    residuals, decreasing as c/|u| (Huber) or to zero at |u|=c (Tukey)
+    """
+    if c is None:
+        c=ROBUST_C[kind]
+    au=np.abs(u)
+    if kind=='huber':
+        return np.minimum(1., c/np.maximum(au, 1e-12))
+    elif kind=='tukey':
+        return np.where(au < c, (1-(u/c)**2)**2, 0.)
+    raise ValueError("unknown robust weight: %s" % kind)
+
+class robust_weighter(object):
+    # a robust_weighter is the iteratively-reweighted counterpart of the
+    # three_sigma_editor:  instead of selecting the data within three sigma
+    # of the solution, it gives each datum a weight that decreases smoothly
+    # with its scaled residual (normalized by the robust spread of the
+    # residuals of the data with nonzero weight, which is not allowed to
+    # fall below 1).  It also tracks the weighted objective that the
+    # iterations minimize, and reports convergence when the objective
+    # changes by less than a fraction tol of its value, or of the total
+    # decrease since the first update, between updates.
+    def __init__(self, N, kind='tukey', c=None, tol=2.e-2, weights=None):
+        self.kind=kind
+        self.c=c
+        self.tol=tol
+        if weights is None:
+            self.weights=np.ones(N)
+        else:
+            self.weights=np.asarray(weights, dtype=float).copy()
+        self.sigma_hat=np.nan
+        self.objective=np.nan
+        self.last_objective=np.nan
+        self.first_objective=np.nan
+
+    def update(self, rs, constraint_misfit=0.):
+        # update the weights from a new set of scaled residuals and the squared, scaled
+        # misfit of the constraints for the same solution.  Returns the robust spread
+        self.sigma_hat=RDE_select(rs[self.weights > 0])
+        scale=np.maximum(1, self.sigma_hat)
+        u=rs/scale
+        self.weights=robust_weights(u, kind=self.kind, c=self.c)
+        self.last_objective=self.objective
+        self.objective=2*scale**2*np.sum(robust_rho(u, kind=self.kind, c=self.c))+constraint_misfit
+        if not np.isfinite(self.first_objective):
+            self.first_objective=self.objective
+        return self.sigma_hat
+
+    @property
+    def selected(self):
+        return self.weights > 0
+
+    @property
+    def converged(self):
+        # true if the objective changed by less than tol (relative to the objective or to its total decrease) in the last update
+        change=np.abs(self.last_objective-self.objective)
+        return (change < self.tol*np.abs(self.objective)) or (change < self.tol*(self.first_objective-self.objective))
+
+    def rows(self):
+        # return the indices of the rows with nonzero weight
+        return np.flatnonzero(self.weights > 0)
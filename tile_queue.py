@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:02:51 2026
+"""
+import numpy as np
+import os
+import json
+import uuid
+import socket
+import threading
+import traceback
+from time import time, sleep
+from LSsurf.smooth_xyt_fit import smooth_xyt_fit_args
+from LSsurf.batch_xyt_fit import batch_fit_structure, fit_one_tile
+from LSsurf.fit_h5 import write_fit_h5
+from LSsurf.thread_budget import available_cores, limit_threads, worker_threads
+
+def tile_name(ctr):
+    # the name used for a tile's task, lease, and output files
+    return 'E%d_N%d' % (np.round(ctr['x']), np.round(ctr['y']))
+
+def _write_json(filename, D):
+    # write a json file atomically:  readers see either the old file or the complete new one
+    temp_file='%s.%s.tmp' % (filename, uuid.uuid4().hex)
+    with open(temp_file,'w') as fh:
+        json.dump(D, fh)
+    os.replace(temp_file, filename)
+
+def _read_json(filename):
+    try:
+        with open(filename,'r') as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+
+class tile_queue(object):
+    # a tile_queue coordinates the fitting of a set of tiles by workers on
+    # any number of nodes that share a filesystem, without a central
+    # service.  The queue is a directory with four subdirectories:
+    #   tasks/<name>.json:  the center of each tile
+    #   leases/<name>.lease:  present while a worker is fitting the tile
+    #   done/<name>.json:  written when the tile's output is complete
+    #   failed/<name>.json:  the number of failed attempts and the last error
+    # A worker claims a tile by hard-linking a file it has written to the
+    # lease filename.  The link is atomic (also on NFS), so exactly one
+    # worker gets each lease.  The worker renews the lease by updating its
+    # modification time; a lease that has not been renewed for lease_time
+    # seconds belongs to a worker that has died, and can be taken over by
+    # another worker.  A worker that breaks an expired lease first takes a
+    # separate break lock (leases/<name>.lease.break, also made with a hard
+    # link), so that each expired lease is counted as one failure.  Leases
+    # and break locks are never removed on the strength of an earlier check:
+    # the file is first renamed to a name unique to the worker (which no
+    # other worker can renew or replace), checked there, and then removed,
+    # or linked back if it turns out to belong to another worker.  A worker
+    # that claims the tile in the moment that a lease is set aside takes the
+    # tile from its holder, which finds out at its next renewal.  Tiles that
+    # fail (or whose workers die) max_attempts times are not attempted
+    # again.  The clocks of the nodes are assumed to agree to much better
+    # than lease_time.
+    def __init__(self, queue_dir, lease_time=600., max_attempts=3):
+        self.queue_dir=queue_dir
+        self.lease_time=lease_time
+        self.max_attempts=max_attempts
+        for sub in ('tasks','leases','done','failed'):
+            os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+        self._names=None
+
+    def _path(self, sub, name):
+        ext={'tasks':'.json', 'leases':'.lease', 'done':'.json', 'failed':'.json'}[sub]
+        return os.path.join(self.queue_dir, sub, name+ext)
+
+    def add_tiles(self, tile_ctrs):
+        """
+            Add tiles to the queue.  Tiles that are already in the queue are not changed
+
+            input arguments:
+                tile_ctrs: list of dicts giving the x, y, and t center of each tile
+            output arguments:
+                names: the names of the tiles
+        """
+        names=list()
+        for ctr in tile_ctrs:
+            name=tile_name(ctr)
+            if not os.path.isfile(self._path('tasks', name)):
+                _write_json(self._path('tasks', name), {'ctr':{key:float(val) for key, val in ctr.items()}})
+            names.append(name)
+        self._names=None
+        return names
+
+    def tile_names(self):
+        # the names of the tiles in the queue.  The task list does not change while the tiles are fit, so it is read once
+        if self._names is None:
+            self._names=sorted([item[:-5] for item in os.listdir(os.path.join(self.queue_dir, 'tasks')) if item.endswith('.json')])
+        return self._names
+
+    def is_done(self, name):
+        return os.path.isfile(self._path('done', name))
+
+    def attempts(self, name):
+        failed=_read_json(self._path('failed', name))
+        if failed is None:
+            return 0
+        return failed['attempts']
+
+    def _lease_age(self, name):
+        # seconds since the lease was last renewed, or None if the tile is not leased
+        try:
+            return time()-os.stat(self._path('leases', name)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _link_file(self, filename, contents):
+        # atomically create a file with the given (json) contents.  Returns False if the file already exists
+        temp_file='%s.%s.tmp' % (filename, uuid.uuid4().hex)
+        with open(temp_file,'w') as fh:
+            json.dump(contents, fh)
+        try:
+            os.link(temp_file, filename)
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(temp_file)
+        return True
+
+    def _remove_checked(self, filename, check):
+        # remove a file if check(stat, contents) is True for it.  The file is renamed to a unique name
+        # before it is checked, so the file that is checked is the file that is removed; if the check
+        # fails, the file is linked back to its name.  Returns True if the file was removed
+        temp_file='%s.%s.tmp' % (filename, uuid.uuid4().hex)
+        try:
+            os.rename(filename, temp_file)
+        except FileNotFoundError:
+            return False
+        try:
+            if check(os.stat(temp_file), _read_json(temp_file)):
+                return True
+            try:
+                os.link(temp_file, filename)
+            except FileExistsError:
+                # another worker created the file while it was set aside, and now holds it
+                pass
+            return False
+        finally:
+            os.remove(temp_file)
+
+    def _try_lease(self, name, worker_id):
+        # try to create the lease for a tile.  Returns the lease, or None if another worker holds it
+        lease={'name':name, 'token':uuid.uuid4().hex, 'worker':worker_id}
+        if not self._link_file(self._path('leases', name), lease):
+            return None
+        return lease
+
+    def _take_break_lock(self, break_file):
+        # take the break lock for a lease.  A lock older than lease_time belongs to a worker that died
+        # while breaking the lease:  it is removed (if it is still the same stale lock) and the lock is
+        # tried once more.  Returns the lock's token, or None if another worker holds the lock
+        lock={'token':uuid.uuid4().hex, 'time':time()}
+        if self._link_file(break_file, lock):
+            return lock['token']
+        try:
+            found=os.stat(break_file)
+        except FileNotFoundError:
+            found=None
+        if found is not None:
+            if time()-found.st_mtime <= self.lease_time:
+                # another worker is breaking the lease
+                return None
+            if not self._remove_checked(break_file, lambda st, contents: (st.st_ino, st.st_mtime)==(found.st_ino, found.st_mtime)):
+                return None
+        if self._link_file(break_file, lock):
+            return lock['token']
+        return None
+
+    def _break_lease(self, name):
+        # remove an expired lease.  Only the worker holding the break lock for the tile may remove the
+        # lease, and the lease is checked for expiry after it has been set aside (see _remove_checked),
+        # so a lease that was renewed, or replaced by a new worker's lease, is put back.  Returns True
+        # if the lease was removed
+        lease_file=self._path('leases', name)
+        break_file=lease_file+'.break'
+        token=self._take_break_lock(break_file)
+        if token is None:
+            return False
+        holder=dict()
+        def expired(st, contents):
+            holder['worker']=(contents or {}).get('worker', None)
+            return time()-st.st_mtime > self.lease_time
+        try:
+            if not self._remove_checked(lease_file, expired):
+                return False
+            # the worker that held the lease has died:  count its attempt as a failure
+            self._record_failure(name, 'lease expired (worker %s)' % str(holder['worker']))
+            return True
+        finally:
+            # remove the break lock, unless it was taken over as stale by another worker
+            self._remove_checked(break_file, lambda st, contents: contents is not None and contents['token']==token)
+
+    def _record_failure(self, name, message):
+        _write_json(self._path('failed', name), {'attempts':self.attempts(name)+1, 'message':message})
+
+    def claim(self, worker_id=None, start=0):
+        """
+            Claim a tile that is not done, not leased, and has not failed too many times
+
+            input arguments:
+                worker_id: a string identifying the worker, stored in the lease
+                start: the position in the task list at which the search starts.  Workers that start at different
+                    positions are less likely to compete for the same tiles
+            output arguments:
+                lease: dict giving the name, token, worker, and ctr of the claimed tile, or None if no tile is available
+        """
+        names=self.tile_names()
+        for ii in range(len(names)):
+            name=names[(start+ii) % len(names)]
+            if self.is_done(name) or self.attempts(name) >= self.max_attempts:
+                continue
+            age=self._lease_age(name)
+            if age is not None:
+                if age <= self.lease_time or not self._break_lease(name):
+                    continue
+                if self.attempts(name) >= self.max_attempts:
+                    continue
+            lease=self._try_lease(name, worker_id)
+            if lease is None:
+                continue
+            if self.is_done(name):
+                # the tile was finished between the check and the claim
+                self.release(lease)
+                continue
+            lease['ctr']=_read_json(self._path('tasks', name))['ctr']
+            return lease
+        return None
+
+    def holds(self, lease):
+        # check that a lease has not been taken over by another worker
+        current=_read_json(self._path('leases', lease['name']))
+        return current is not None and current['token']==lease['token']
+
+    def renew(self, lease):
+        # renew a lease.  Returns False if the lease has been lost
+        if not self.holds(lease):
+            return False
+        try:
+            os.utime(self._path('leases', lease['name']))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, lease):
+        # remove a lease, if it is still held.  The token is checked after the lease file has been set
+        # aside (see _remove_checked), so the lease of a worker that took the tile over is put back.
+        # Returns True if the lease was held and has been removed
+        return self._remove_checked(self._path('leases', lease['name']), lambda st, contents: contents is not None and contents['token']==lease['token'])
+
+    def complete(self, lease, out_file):
+        # record that a tile is done, and release its lease
+        _write_json(self._path('done', lease['name']), {'out_file':out_file, 'worker':lease['worker'], 'time':time()})
+        self.release(lease)
+
+    def fail(self, lease, message):
+        # release the lease of a tile, and record a failed attempt if the lease was still held.  If the
+        # lease has been taken over, the failure was already counted when the lease was broken, and the
+        # new holder's attempt is not affected
+        if self.release(lease):
+            self._record_failure(lease['name'], message)
+
+    def status(self):
+        """
+            Count the tiles in each state
+
+            output arguments:
+                counts: dict giving the number of tiles that are done, leased, failed (too many attempts), and pending
+        """
+        counts={'done':0, 'leased':0, 'failed':0, 'pending':0}
+        for name in self.tile_names():
+            if self.is_done(name):
+                counts['done'] += 1
+            elif self.attempts(name) >= self.max_attempts:
+                counts['failed'] += 1
+            elif self._lease_age(name) is not None and self._lease_age(name) <= self.lease_time:
+                counts['leased'] += 1
+            else:
+                counts['pending'] += 1
+        return counts
+
+class lease_keeper(object):
+    # a lease_keeper renews a lease from a background thread while a tile
+    # is being fit.  A renewal that fails (e.g. because of a transient
+    # filesystem error) is retried once after retry_wait seconds.  If the
+    # lease is lost (because the worker stalled for longer than the lease
+    # time and another worker took the tile over), the lost attribute is set.
+    def __init__(self, queue, lease, interval=None, retry_wait=None):
+        self.queue=queue
+        self.lease=lease
+        if interval is None:
+            interval=queue.lease_time/4.
+        if retry_wait is None:
+            retry_wait=interval/10.
+        self.interval=interval
+        self.retry_wait=retry_wait
+        self.lost=False
+        self._stop=threading.Event()
+        self._thread=threading.Thread(target=self._run, daemon=True)
+
+    def _renew(self):
+        try:
+            return self.queue.renew(self.lease)
+        except OSError:
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._renew():
+                continue
+            if self._stop.wait(self.retry_wait):
+                return
+            if not self._renew():
+                self.lost=True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+def queue_worker(queue_dir, read_tile, out_dir, worker_id=None, lease_time=600., max_attempts=3, poll_interval=None, min_data=10, N_threads=None, **kwargs):
+    """
+        Fit tiles from a tile_queue until none are left
+
+        Each tile's data are read with read_tile, the tile is fit with
+        smooth_xyt_fit, and the output is written to <out_dir>/<tile name>.h5
+        (see fit_h5).  The output is written to a temporary file that is
+        renamed when it is complete, so a partial output is never seen.  The
+        fit structure is built once and reused for all the tiles this worker
+        fits (see batch_xyt_fit).  When no tiles can be claimed, but other
+        workers hold leases, the worker waits for poll_interval seconds and
+        tries again, so that it can take over the tiles of workers that die.
+
+        input arguments:
+            queue_dir: the directory of the tile_queue
+            read_tile: function that returns the data (a pointdata instance) for a tile, called as read_tile(ctr, W).
+                It must be picklable (a module-level function) to be used by run_queue_workers
+            out_dir: the directory for the output files
+            worker_id: a string identifying the worker, defaults to <host>_<pid>
+            lease_time: seconds after which a lease that has not been renewed may be taken over
+            max_attempts: number of times each tile is attempted before it is considered failed
+            poll_interval: seconds to wait for tiles leased by other workers, defaults to lease_time/4
+            min_data: tiles with fewer than this many data are marked done without a fit
+            N_threads: if specified, the native threads of the solver and BLAS are limited to this number.  The
+                libraries are already loaded in this process, so this only works if threadpoolctl is installed
+                (see thread_budget.limit_threads); otherwise, set OMP_NUM_THREADS etc. before the worker starts,
+                as run_queue_workers does
+            keywords: any keyword accepted by smooth_xyt_fit except 'ctr' and 'data'
+        output arguments:
+            fitted: the names of the tiles this worker completed
+    """
+    if worker_id is None:
+        worker_id='%s_%d' % (socket.gethostname(), os.getpid())
+    if poll_interval is None:
+        poll_interval=lease_time/4.
+    if N_threads is not None:
+        limit_threads(N_threads)
+    queue=tile_queue(queue_dir, lease_time=lease_time, max_attempts=max_attempts)
+    os.makedirs(out_dir, exist_ok=True)
+    # start the search for tiles at a worker-dependent position in the task list
+    start=uuid.uuid5(uuid.NAMESPACE_DNS, worker_id).int % max(len(queue.tile_names()), 1)
+    kwargs['min_data']=min_data
+    fitted=list()
+    while True:
+        lease=queue.claim(worker_id=worker_id, start=start)
+        if lease is None:
+            if queue.status()['leased'] > 0:
+                sleep(poll_interval)
+                continue
+            break
+        try:
+            with lease_keeper(queue, lease) as keeper:
+                data=read_tile(lease['ctr'], kwargs['W'])
+                if 'fit_structure' not in kwargs and data is not None and data.size >= min_data:
+                    kwargs['fit_structure']=batch_fit_structure(smooth_xyt_fit_args(ctr=lease['ctr'], data=data, **kwargs))
+                S=fit_one_tile(lease['ctr'], data, kwargs)
+                out_file=None
+                if S is not None:
+                    out_file=os.path.join(out_dir, lease['name']+'.h5')
+                    temp_file='%s.%s.tmp' % (out_file, lease['token'])
+                    write_fit_h5(temp_file, S)
+                    os.replace(temp_file, out_file)
+        except Exception:
+            queue.fail(lease, traceback.format_exc())
+            continue
+        # a worker that lost its lease still wrote a complete output, so the tile is done either way
+        queue.complete(lease, out_file)
+        if not keeper.lost:
+            fitted.append(lease['name'])
+    return fitted
+
+def _queue_worker_process(args):
+    queue_dir, read_tile, out_dir, worker_id, kwargs=args
+    return queue_worker(queue_dir, read_tile, out_dir, worker_id=worker_id, **kwargs)
+
+def run_queue_workers(N_workers, queue_dir, read_tile, out_dir, tile_ctrs=None, **kwargs):
+    """
+        Run several queue workers on this node, in separate processes
+
+        Each process behaves like an independent node, so this can be used to
+        run a queue on one machine, or to run N_workers workers on each of
+        several nodes that share queue_dir.  Unless N_threads is given, the
+        cores of the node are divided evenly between the workers.  The
+        workers are started with their thread limits in the environment (see
+        thread_budget.worker_threads), so read_tile and the keywords must be
+        picklable, and the calling script must guard its top-level code with
+        if __name__=='__main__'.
+
+        input arguments:
+            N_workers: the number of worker processes
+            queue_dir: the directory of the tile_queue
+            read_tile: function that reads the data for a tile (see queue_worker)
+            out_dir: the directory for the output files
+            tile_ctrs: optional list of tile centers to add to the queue before the workers start
+            keywords: keywords for queue_worker and smooth_xyt_fit
+        output arguments:
+            fitted: dict giving the names of the tiles completed by each worker
+            status: the queue status (see tile_queue.status) after the workers finish
+    """
+    if tile_ctrs is not None:
+        tile_queue(queue_dir).add_tiles(tile_ctrs)
+    if kwargs.get('N_threads', None) is None:
+        kwargs['N_threads']=max(1, available_cores()//N_workers)
+    worker_ids=['%s_%d_%d' % (socket.gethostname(), os.getpid(), ii) for ii in range(N_workers)]
+    with worker_threads(kwargs['N_threads']) as context, context.Pool(N_workers) as pool:
+        results=pool.map(_queue_worker_process, [(queue_dir, read_tile, out_dir, worker_id, kwargs) for worker_id in worker_ids], chunksize=1)
+    queue_args={key:kwargs[key] for key in ('lease_time','max_attempts') if key in kwargs}
+    return dict(zip(worker_ids, results)), tile_queue(queue_dir, **queue_args).status()
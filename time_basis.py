@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:40 2026
+"""
+import numpy as np
+from scipy.interpolate import BSpline
+
+def bspline_basis(t, knot_spacing, degree=3):
+    """
+        Evaluate a set of B-splines with uniformly spaced knots at a set of times
+
+        The splines are clamped at the first and last time, so they span
+        polynomials of the given degree between knots, and sum to one.
+
+        input arguments:
+            t: the times (e.g. the epochs of a dz grid), in increasing order
+            knot_spacing: the nominal time between knots.  The knots are spaced evenly between t[0] and t[-1]
+            degree: the polynomial degree of the splines (1 for piecewise-linear, 3 for cubic)
+        output arguments:
+            B: array, t.size x N_basis, the value of each spline at each time
+    """
+    t=np.asarray(t, dtype=float)
+    N_int=int(np.maximum(1, np.round((t[-1]-t[0])/knot_spacing)))
+    breaks=np.linspace(t[0], t[-1], N_int+1)
+    knots=np.r_[np.zeros(degree)+t[0], breaks, np.zeros(degree)+t[-1]]
+    N_basis=N_int+degree
+    return BSpline(knots, np.eye(N_basis), degree)(t)
+
+def harmonic_basis(t, periods=(1.,), trend=True):
+    """
+        Evaluate a constant, a linear trend, and sine and cosine terms at a set of times
+
+        input arguments:
+            t: the times
+            periods: the period of each pair of sine and cosine terms (in the units of t)
+            trend: if True, a linear trend (centered on the mean of t) is included
+        output arguments:
+            B: array, t.size x N_basis, the value of each function at each time
+    """
+    t=np.asarray(t, dtype=float)
+    cols=[np.ones_like(t)]
+    if trend:
+        cols.append(t-np.mean(t))
+    for period in periods:
+        cols += [np.sin(2*np.pi*t/period), np.cos(2*np.pi*t/period)]
+    return np.column_stack(cols)
+
+def reference_basis(B, i_ref):
+    """
+        Reduce a basis to the functions that are zero at a reference time
+
+        The function with the largest value at the reference time is
+        subtracted from the others (scaled to cancel their reference values),
+        and is then removed, so the remaining functions span the combinations
+        of the original ones that are zero at the reference time.
+
+        input arguments:
+            B: array, N_t x N_basis, the basis functions evaluated at each time
+            i_ref: the index of the reference time
+        output arguments:
+            B_ref: array, N_t x (N_basis-1)
+    """
+    j_ref=int(np.argmax(np.abs(B[i_ref,:])))
+    if B[i_ref, j_ref]==0:
+        # all the functions are already zero at the reference time
+        return B
+    B_ref=B-np.outer(B[:, j_ref], B[i_ref,:]/B[i_ref, j_ref])
+    return np.delete(B_ref, j_ref, axis=1)
+
+def time_basis(t, reference_epoch=None, type='bspline', **kwargs):
+    """
+        Build the temporal basis for a dz grid
+
+        input arguments:
+            t: the epochs of the dz grid
+            reference_epoch: if not None, the basis is reduced so that dz is zero at this epoch (see reference_basis)
+            type: 'bspline' or 'harmonic'
+            kwargs: keywords for bspline_basis (knot_spacing, degree) or harmonic_basis (periods, trend)
+        output arguments:
+            B: array, t.size x N_basis, giving dz at each epoch as a combination of the basis coefficients
+    """
+    if type=='bspline':
+        B=bspline_basis(t, **kwargs)
+    elif type=='harmonic':
+        B=harmonic_basis(t, **kwargs)
+    else:
+        raise ValueError("unknown time basis type: %s" % type)
+    if reference_epoch is not None:
+        B=reference_basis(B, reference_epoch)
+    # suppress roundoff so that the basis stays sparse
+    B[np.abs(B) < 1e-12]=0.
+    return B